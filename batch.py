@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+命令行批处理入口
+不经过界面上传，直接原地读取目录或文件列表中的视频（无上传副本、无队列数量与文件大小限制），
+参数取自 saved_params.json（与界面相同）。整个批次内 llama-server 以常驻模式运行、识别模型保持加载，
+不会在文件之间重复加载模型；配置中未开启常驻模式时，退出前停止批处理启动的服务器。
+--watch 模式持续监视目录，处理新写入且大小已稳定的视频；
+--realign 模式按编辑后的 _aligned_recognition.json 重新计算时间戳（优先复用缓存的发射矩阵）
+
+示例:
+    python batch.py D:\\videos
+    python batch.py D:\\videos --recursive --beside
+    python batch.py --file-list list.txt --output-dir D:\\subs
+    python batch.py D:\\incoming --watch --interval 10 --settle 30
+    python batch.py D:\\videos --realign
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+from config import CONFIG_FILE, OUTPUT_DIR, config
+from utils.queue_manager import VideoProcessorPipeline, VIDEO_EXTENSIONS
+from utils.stage_scheduler import StageScheduler
+from utils.speech_recognizer import clear_model_cache, realign_recognition_result
+from utils.translator import clear_translator_cache
+from utils.llama_server_pool import stop_shared_managers
+from utils.recognition_worker import shutdown_worker_pool
+from utils.video_processor import allow_directory
+
+
+def _is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def collect_videos(paths, recursive=False):
+    """展开文件与目录参数，返回去重后的视频路径（目录内按名称排序）"""
+    videos = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            if _is_video(path):
+                videos.append(path)
+            else:
+                print(f"[批处理] 跳过不支持的格式: {path}")
+        elif os.path.isdir(path):
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    videos.extend(os.path.join(dirpath, name) for name in sorted(filenames) if _is_video(name))
+            else:
+                videos.extend(
+                    os.path.join(path, name) for name in sorted(os.listdir(path))
+                    if _is_video(name) and os.path.isfile(os.path.join(path, name))
+                )
+        else:
+            print(f"[批处理] 路径不存在: {path}")
+    seen = set()
+    return [v for v in videos if not (v in seen or seen.add(v))]
+
+
+def read_file_list(list_path):
+    """每行一个文件或目录路径，忽略空行与 # 开头的注释"""
+    with open(list_path, 'r', encoding='utf-8-sig') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class BatchRunner:
+    """在同一进程内依次处理视频，模型与 llama-server 在文件之间保持加载"""
+
+    def __init__(self, params, output_dir=None, beside=False, force=False):
+        self.params = params
+        self.output_dir = output_dir
+        self.beside = beside
+        self.force = force
+        self.cancel_event = threading.Event()
+        self.pipeline = VideoProcessorPipeline(
+            add_print_callback=self._print,
+            check_cancelled_fn=self.cancel_event.is_set,
+        )
+        self.results = []
+
+    @staticmethod
+    def _print(msg):
+        if msg and isinstance(msg, str):
+            print(f"[处理] {msg}")
+
+    def _output_dir_for(self, video):
+        return os.path.dirname(video) if self.beside else (self.output_dir or OUTPUT_DIR)
+
+    def is_done(self, video):
+        """双语字幕已存在时视为已处理"""
+        base_name = os.path.splitext(os.path.basename(video))[0]
+        return os.path.exists(os.path.join(self._output_dir_for(video), f"{base_name}_bilingual_subtitles.srt"))
+
+    def _prepare(self, videos, staged):
+        jobs = []
+        for index, video in enumerate(videos):
+            output_dir = allow_directory(self._output_dir_for(video))
+            os.makedirs(output_dir, exist_ok=True)
+            allow_directory(os.path.dirname(video))
+            params = dict(self.params, output_dir=output_dir)
+            jobs.append(self.pipeline.prepare_job(video, params, index=index, staged=staged))
+        return jobs
+
+    def _record(self, job):
+        success, msg, outputs = job.result
+        self.results.append((job.video_file, success, msg))
+        status = "完成" if success else ("已取消" if job.outcome == "已取消" else "失败")
+        print(f"[批处理] {status}: {job.video_file} - {msg}")
+        for path in outputs or []:
+            print(f"    {path}")
+
+    def run(self, videos):
+        """处理一批视频，返回成功数"""
+        if not self.force:
+            skipped = [v for v in videos if self.is_done(v)]
+            for video in skipped:
+                print(f"[批处理] 已有字幕，跳过: {video}")
+            videos = [v for v in videos if v not in skipped]
+        if not videos:
+            return 0
+
+        print(f"[批处理] 开始处理 {len(videos)} 个视频")
+        start = time.time()
+        staged = self.params.get('queue_stage_pipelined', False)
+        jobs = self._prepare(videos, staged)
+        done = 0
+        if staged:
+            scheduler = StageScheduler(
+                self.pipeline,
+                extract_workers=self.params.get('queue_extract_workers', 1),
+                recognize_workers=self.params.get('queue_recognize_workers', 1),
+                cancelled_fn=self.cancel_event.is_set,
+            )
+            for job, event in scheduler.run(jobs):
+                if event == 'done':
+                    self._record(job)
+                    done += job.result[0]
+                else:
+                    print(f"[批处理] {os.path.basename(job.video_file)}: 进入阶段 {event}")
+        else:
+            for job in jobs:
+                if job.result is None:
+                    try:
+                        for stage in ('extract', 'recognize', 'translate'):
+                            self.pipeline.run_stage(job, stage)
+                    finally:
+                        self.pipeline.finish_job(job)
+                self._record(job)
+                done += job.result[0]
+                if self.cancel_event.is_set():
+                    break
+        print(f"[批处理] 本批完成 {done}/{len(videos)}，耗时 {time.time() - start:.1f}s")
+        return done
+
+    def realign(self, videos):
+        """按编辑后的强制对齐识别结果重新计算时间戳并写回 JSON，返回成功数"""
+        done = 0
+        for video in videos:
+            if self.cancel_event.is_set():
+                break
+            base_name = os.path.splitext(os.path.basename(video))[0]
+            json_path = os.path.join(self._output_dir_for(video), f"{base_name}_aligned_recognition.json")
+            if not os.path.exists(json_path):
+                print(f"[批处理] 未找到识别结果，跳过: {json_path}")
+                continue
+            allow_directory(os.path.dirname(video))
+            try:
+                realign_recognition_result(json_path, video, device_choice=self.params.get('device', 'auto'))
+            except Exception as e:
+                self.results.append((video, False, f"重新对齐失败: {e}"))
+                print(f"[批处理] 失败: {video} - 重新对齐失败: {e}")
+                continue
+            self.results.append((video, True, "重新对齐完成"))
+            print(f"[批处理] 完成: {video} - 重新对齐完成")
+            done += 1
+        return done
+
+    def watch(self, paths, recursive=False, interval=10.0, settle=30.0):
+        """持续监视目录：文件大小与修改时间在 settle 秒内不再变化后视为写入完成并处理"""
+        processed = set()
+        pending = {}
+        print(f"[监视] 监视 {len(paths)} 个路径，每 {interval:g}s 扫描一次，文件稳定 {settle:g}s 后处理（Ctrl+C 退出）")
+        while not self.cancel_event.is_set():
+            now = time.time()
+            ready = []
+            for video in collect_videos(paths, recursive):
+                try:
+                    stat = os.stat(video)
+                except OSError:
+                    continue
+                signature = (video, stat.st_size, stat.st_mtime)
+                if signature in processed:
+                    continue
+                first_seen = pending.get(signature)
+                if first_seen is None:
+                    # 新文件或仍在写入（大小 / 修改时间变化）时重新计时
+                    pending = {k: v for k, v in pending.items() if k[0] != video}
+                    pending[signature] = now
+                elif now - first_seen >= settle:
+                    ready.append(video)
+                    processed.add(signature)
+                    del pending[signature]
+            if ready:
+                self.run(ready)
+            self.cancel_event.wait(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="视频字幕批处理（参数取自 saved_params.json，与界面相同）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("paths", nargs="*", help="视频文件或目录")
+    parser.add_argument("--file-list", action="append", default=[], help="文件列表（每行一个文件或目录），可重复指定")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("-o", "--output-dir", help=f"字幕输出目录，默认 {OUTPUT_DIR}")
+    parser.add_argument("--beside", action="store_true", help="字幕写到视频所在目录")
+    parser.add_argument("--force", action="store_true", help="已有字幕时也重新处理")
+    parser.add_argument("--watch", action="store_true", help="持续监视目录，处理新写入的视频")
+    parser.add_argument("--interval", type=float, default=10.0, help="监视模式扫描间隔（秒）")
+    parser.add_argument("--settle", type=float, default=30.0, help="监视模式中文件大小稳定多久后开始处理（秒）")
+    parser.add_argument("--realign", action="store_true",
+                        help="不重新识别，按编辑后的 _aligned_recognition.json 重新计算时间戳")
+    parser.add_argument("--no-warm", action="store_true",
+                        help="不强制常驻 llama-server 与保持模型加载，完全按配置文件运行")
+    args = parser.parse_args(argv)
+
+    paths = list(args.paths)
+    for list_path in args.file_list:
+        paths.extend(read_file_list(list_path))
+    if not paths:
+        parser.error("请指定视频文件、目录或 --file-list")
+    if args.realign and args.watch:
+        parser.error("--realign 不能与 --watch 同时使用")
+
+    overrides = {}
+    if not args.no_warm:
+        # 批次内的多个文件复用同一个 llama-server 与已加载的识别模型
+        overrides = {'llama_server_daemon': True, 'keep_models_loaded': True}
+    params = config.build_params(**overrides)
+    print(f"[批处理] 使用配置: {CONFIG_FILE if os.path.exists(CONFIG_FILE) else '默认参数'}")
+    print(f"[批处理] 识别模型: {params.get('model')}，翻译模型: {params.get('translator')}，"
+          f"{params.get('source_language')} → {params.get('target_language')}")
+
+    runner = BatchRunner(params, output_dir=args.output_dir, beside=args.beside, force=args.force)
+    try:
+        if args.realign:
+            runner.realign(collect_videos(paths, args.recursive))
+        elif args.watch:
+            runner.watch(paths, recursive=args.recursive, interval=args.interval, settle=args.settle)
+        else:
+            runner.run(collect_videos(paths, args.recursive))
+    except KeyboardInterrupt:
+        print("\n[批处理] 收到中断，停止处理")
+        runner.cancel_event.set()
+    finally:
+        clear_model_cache()
+        if not config.get('llama_server_daemon', False):
+            # 常驻模式仅为本批次开启：空闲计时线程随进程退出，需在此停止服务器，不留下无人管理的进程
+            stop_shared_managers()
+        clear_translator_cache()
+        shutdown_worker_pool()
+
+    failed = [r for r in runner.results if not r[1]]
+    if runner.results:
+        print(f"[批处理] 共处理 {len(runner.results)} 个视频，成功 {len(runner.results) - len(failed)}，失败 {len(failed)}")
+        for video, _, msg in failed:
+            print(f"    {video}: {msg}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
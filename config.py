@@ -11,6 +11,8 @@ import threading
 from typing import Dict, Any, List, Tuple, Optional, ClassVar
 from dataclasses import dataclass, fields
 
+from utils.model_registry import ModelRegistry
+
 def _detect_package_mode():
     _current_dir = os.path.dirname(os.path.abspath(__file__))
     _parent_dir = os.path.dirname(_current_dir)
@@ -29,9 +31,10 @@ else:
 MODEL_CACHE_DIR = os.path.join(PROJECT_ROOT, "models")
 TEMP_DIR = os.path.join(PROJECT_ROOT, "temp")
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "outputs")
+CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 CONFIG_FILE = os.path.join(PROJECT_ROOT, "saved_params.json")
 
-for d in [MODEL_CACHE_DIR, TEMP_DIR, OUTPUT_DIR]:
+for d in [MODEL_CACHE_DIR, TEMP_DIR, OUTPUT_DIR, CACHE_DIR]:
     os.makedirs(d, exist_ok=True)
 
 os.environ.setdefault('PYTHONIOENCODING', 'utf-8')
@@ -119,6 +122,20 @@ class TransParams(ParamBase):
     short_text_threshold: int = 5          # 短文本判断阈值（字符数），低于此值视为短文本特殊处理，范围 [1, 20]
     kana_ratio_threshold: float = 0.3      # 日译中时假名占比阈值，高于此值判定为未翻译，范围 [0.1, 0.8]
     request_timeout: int = 300             # 翻译HTTP请求超时时间（秒），范围 [30, 600]
+    concurrent: bool = False               # 是否并发翻译，按 llama-server 并行槽数同时发送请求（不使用共享聊天历史）
+    pack_size: int = 1                     # 打包翻译每次请求包含的片段数，1 表示逐条翻译，范围 [1, 32]
+    memory: bool = False                   # 是否启用持久化翻译记忆（SQLite），命中时跳过模型请求
+    memory_max_entries: int = 50000        # 翻译记忆最大条目数，超出时淘汰最久未使用的记录，范围 [1000, 1000000]
+    stream_abort: bool = False             # 是否流式请求并在输出循环重复、超长或目标语言占比明显失败时提前中止
+    abort_repeat_threshold: int = 6        # 流式中止的重复阈值，同一片段在末尾连续重复达到此次数时中止，范围 [3, 20]
+    abort_length_ratio: float = 4.0        # 流式中止的长度倍数，输出字符数超过原文此倍数时中止，范围 [1.5, 10.0]
+    prompt_layout: str = "classic"         # 提示词布局：classic 为原有布局；prefix_cache 固定前缀、历史按块重置，提高 KV 缓存复用
+    candidates: int = 1                    # 每条请求并发采样的候选数，本地验证后保留最佳，1 表示单候选，范围 [1, 8]
+    candidate_temperature_step: float = 0.3  # 多候选时相邻候选的温度增量，第 k 个候选温度为 temperature + k * step，范围 [0.0, 1.0]
+    grammar: bool = False                  # 是否随请求发送 GBNF 语法，约束为单行（打包时为编号行）目标语言输出
+    pipelined: bool = False                # 是否边识别边翻译：识别定稿的片段经有界队列送入后台翻译线程
+    adaptive_output: bool = True           # 是否按语言对学习的 输出/输入 token 比例设定 n_predict，样本不足时沿用固定规则
+    output_length_quantile: float = 0.95   # 长度模型采用的比例分位数，越高越不容易截断、预留越多，范围 [0.5, 1.0]
 
     _KEY_MAP: ClassVar[Dict[str, str]] = {
         'temperature': 'translation_temperature',
@@ -135,6 +152,20 @@ class TransParams(ParamBase):
         'short_text_threshold': 'translation_short_text_threshold',
         'kana_ratio_threshold': 'translation_kana_ratio_threshold',
         'request_timeout': 'translation_request_timeout',
+        'concurrent': 'translation_concurrent',
+        'pack_size': 'translation_pack_size',
+        'memory': 'translation_memory',
+        'memory_max_entries': 'translation_memory_max_entries',
+        'stream_abort': 'translation_stream_abort',
+        'abort_repeat_threshold': 'translation_abort_repeat_threshold',
+        'abort_length_ratio': 'translation_abort_length_ratio',
+        'prompt_layout': 'translation_prompt_layout',
+        'candidates': 'translation_candidates',
+        'candidate_temperature_step': 'translation_candidate_temperature_step',
+        'grammar': 'translation_grammar',
+        'pipelined': 'translation_pipelined',
+        'adaptive_output': 'translation_adaptive_output',
+        'output_length_quantile': 'translation_output_length_quantile',
     }
 
 
@@ -147,6 +178,16 @@ class ServerParams(ParamBase):
     ngl: int = 99                           # llama-server GPU 卸载层数，0 表示仅 CPU，99 表示全部卸载到 GPU，范围 [0, 999]
     batch_size: int = 512                  # llama-server 批处理大小，影响推理速度和显存占用，范围 [512, 8192]
     parallel_slots: int = 1                 # llama-server 并行处理槽数，单用户建议设为1以释放VRAM提升速度，范围 [1, 8]
+    slot_cache: bool = True                 # 是否保存预热后的提示词前缀 KV 状态，服务器（重新）启动后直接恢复而无需重新计算
+    instances: int = 1                      # llama-server 实例数，大于 1 时启动实例池，线程数在实例间均分并绑定不同 CPU 核，范围 [1, 16]
+    daemon: bool = False                    # 是否常驻：翻译结束后保持 llama-server 运行供后续视频复用，并通过锁文件供重启后的界面接管
+    idle_timeout: int = 600                 # 常驻服务器空闲多少秒后自动停止，0 表示不自动停止，范围 [0, 86400]
+    draft_model: str = ""                   # 推测解码草稿模型（models/ 下的 GGUF 文件名或路径片段），为空表示不启用
+    draft_max: int = 16                     # 每次推测的最大草稿 token 数，范围 [1, 64]
+    draft_min: int = 0                      # 每次推测的最小草稿 token 数，范围 [0, 64]
+    telemetry: bool = True                  # 是否记录翻译请求 timings 并定期抓取 /metrics 与 /slots，任务结束后写出 JSON 性能报告
+    mock: bool = False                      # 是否以 utils/mock_llama_server.py 模拟服务器代替 llama-server（离线测试与压测）
+    mock_args: str = ""                     # 传给模拟服务器的附加参数，如 "--mock-gen-latency 0.01 --mock-fail-rate 0.05"
 
     _KEY_MAP: ClassVar[Dict[str, str]] = {
         'host': 'llama_server_host',
@@ -156,6 +197,16 @@ class ServerParams(ParamBase):
         'ngl': 'llama_server_ngl',
         'batch_size': 'llama_server_batch_size',
         'parallel_slots': 'llama_server_parallel_slots',
+        'slot_cache': 'llama_server_slot_cache',
+        'instances': 'llama_server_instances',
+        'daemon': 'llama_server_daemon',
+        'idle_timeout': 'llama_server_idle_timeout',
+        'draft_model': 'llama_server_draft_model',
+        'draft_max': 'llama_server_draft_max',
+        'draft_min': 'llama_server_draft_min',
+        'telemetry': 'llama_server_telemetry',
+        'mock': 'llama_server_mock',
+        'mock_args': 'llama_server_mock_args',
     }
 
 
@@ -190,6 +241,47 @@ def _build_param_definitions() -> Dict[str, Dict[str, Any]]:
             "default": True,
             "description": "是否启用 Wav2Vec2 强制对齐，获取字符级和词级精确时间戳"
         },
+        "alignment_emission_cache": {
+            "default": False,
+            "description": "是否缓存强制对齐的 CTC 发射矩阵（fp16，按音频哈希+对齐模型存储），编辑识别文本后可直接重新对齐而无需重跑 Wav2Vec2"
+        },
+        "word_timestamp_mode": {
+            "default": "wav2vec2",
+            "options": ["wav2vec2", "whisper_dtw", "auto"],
+            "description": "词级时间戳来源：wav2vec2 为强制对齐；whisper_dtw 使用 Whisper 对齐头交叉注意力 + DTW，无需加载第二个模型；auto 在源语言没有本地 Wav2Vec2 模型时改用 whisper_dtw"
+        },
+        "keep_models_loaded": {
+            "default": False,
+            "description": "识别结束后保留 Whisper 与强制对齐模型，队列中的后续视频直接复用；两者同时常驻显存"
+        },
+        "recognition_worker_process": {
+            "default": False,
+            "description": "在常驻子进程中运行语音识别与强制对齐，音频经共享内存传递，界面进程不加载 torch 模型"
+        },
+        "recognition_worker_max_jobs": {
+            "default": 20,
+            "range": [1, 1000],
+            "description": "识别子进程完成此数量的视频后退出并在下次任务时重启，释放累积的内存碎片"
+        },
+        "recognition_worker_max_memory_mb": {
+            "default": 0,
+            "range": [0, 262144],
+            "description": "识别子进程常驻内存超过此值（MB）时在任务结束后回收，0 表示不按内存回收"
+        },
+        "queue_stage_pipelined": {
+            "default": False,
+            "description": "队列按阶段流水线处理：后一个视频的音频提取与语音识别和前一个视频的翻译同时进行，各阶段之间以有界队列交接"
+        },
+        "queue_extract_workers": {
+            "default": 1,
+            "range": [1, 4],
+            "description": "阶段流水线中同时提取音频的视频数"
+        },
+        "queue_recognize_workers": {
+            "default": 1,
+            "range": [1, 4],
+            "description": "阶段流水线中同时进行语音识别的视频数，每个识别线程各占一份模型显存"
+        },
     }
 
     param_metadata = {
@@ -225,6 +317,20 @@ def _build_param_definitions() -> Dict[str, Dict[str, Any]]:
         "translation_short_text_threshold": {"range": [1, 20], "description": "短文本判断阈值（字符数），低于此值视为短文本特殊处理"},
         "translation_kana_ratio_threshold": {"range": [0.1, 0.8], "description": "日译中时假名占比阈值，高于此值判定为未翻译"},
         "translation_request_timeout": {"range": [30, 600], "description": "翻译HTTP请求超时时间（秒）"},
+        "translation_concurrent": {"description": "是否并发翻译：按 llama-server 并行槽数同时发送请求，每条请求仅使用前后片段上下文（不使用共享聊天历史），需将并行槽数设为大于1"},
+        "translation_pack_size": {"range": [1, 32], "description": "打包翻译每次请求包含的连续片段数，按编号行输出后逐行解析验证，解析或验证失败的行回退逐条翻译；1 表示逐条翻译"},
+        "translation_memory": {"description": "是否启用持久化翻译记忆：按预处理后的原文、语言方向、翻译模型和采样/验证参数缓存已验证的译文，重复台词直接复用"},
+        "translation_memory_max_entries": {"range": [1000, 1000000], "description": "翻译记忆最大条目数，超出时淘汰最久未使用的记录"},
+        "translation_stream_abort": {"description": "是否以流式方式请求翻译，逐块检查输出，出现循环重复、超长或目标语言占比明显失败时断开连接提前中止并进入重试"},
+        "translation_abort_repeat_threshold": {"range": [3, 20], "description": "流式中止的重复阈值，同一片段在输出末尾连续重复达到此次数时中止"},
+        "translation_abort_length_ratio": {"range": [1.5, 10.0], "description": "流式中止的长度倍数，输出字符数超过原文此倍数时中止"},
+        "translation_prompt_layout": {"options": ["classic", "prefix_cache"], "description": "提示词布局：classic 为原有布局；prefix_cache 将翻译指令固定在系统提示词中、聊天历史只追加并按块重置、上下文与原文放在末尾，使 llama-server 的 prompt 缓存可复用更长前缀"},
+        "translation_candidates": {"range": [1, 8], "description": "每条翻译并发采样的候选数：共享同一提示词、按温度递增采样，本地验证后保留目标语言占比最高的有效译文，减少验证失败后的重试轮次。每条片段的生成量随之成倍增加；同时在途的请求不超过并行槽数，候选数大于并行槽数时多出的候选依次生成，耗时相应成倍增加"},
+        "translation_candidate_temperature_step": {"range": [0.0, 1.0], "description": "多候选时相邻候选的温度增量，第 k 个候选温度为 翻译温度 + k × 增量"},
+        "translation_grammar": {"description": "是否随每条请求发送 GBNF 语法：只允许单行输出（打包请求为严格编号行），CJK 目标语言禁止以拉丁字母开头，并排除不属于目标语言的文字（如日译中的假名）；有/无约束的验证失败率会累计记录"},
+        "translation_pipelined": {"description": "是否边识别边翻译：Whisper-CD 每解码完一个30秒分段，已定稿的字幕片段即经有界队列送入后台翻译线程，片段在收到其后“上下文片段数量”条片段后开始翻译；识别结束后仅对断句发生变化或验证失败的片段补充翻译。识别与翻译同时占用显存，显存不足时请勿启用"},
+        "translation_adaptive_output": {"description": "是否自适应设定输出 token 上限：按语言对记录验证通过译文的 输出/输入 token 比例（保存在 cache/output_length_model.json），以高分位数加余量作为 n_predict，减少长句截断重试并在并发时少占 KV；样本不足 20 个时沿用按字符数的固定规则"},
+        "translation_output_length_quantile": {"range": [0.5, 1.0], "description": "输出长度模型采用的比例分位数，越高越不容易截断，预留的输出 token 越多"},
         "llama_server_host": {"description": "llama-server 监听地址，通常为 127.0.0.1"},
         "llama_server_port": {"range": [1, 65535], "description": "llama-server 监听端口"},
         "llama_server_context_size": {"range": [512, 32768], "description": "llama-server 上下文窗口大小，限制单次请求的 prompt+输出总 token 数"},
@@ -232,6 +338,16 @@ def _build_param_definitions() -> Dict[str, Dict[str, Any]]:
         "llama_server_ngl": {"range": [0, 999], "description": "llama-server GPU 卸载层数，0 表示仅 CPU，99 表示全部卸载到 GPU"},
         "llama_server_batch_size": {"range": [512, 8192], "description": "llama-server 批处理大小，影响推理速度和显存占用"},
         "llama_server_parallel_slots": {"range": [1, 8], "description": "llama-server 并行处理槽数，单用户建议设为1以释放VRAM提升速度"},
+        "llama_server_slot_cache": {"description": "是否按翻译模型保存预热后的提示词前缀 KV 状态（保存在 cache/llama_slots），服务器（重新）启动后直接恢复；关闭时仍以 --slot-save-path 启动，会话重置始终通过清空槽位完成而不重启服务器"},
+        "llama_server_instances": {"range": [1, 16], "description": "llama-server 实例数：大于 1 时在自动分配的端口上启动多个实例，“线程数”与“并行槽数”均为所有实例的总数并按实例均分（每个实例至少 1 个槽），各实例绑定不同的 CPU 核，GGUF 通过 mmap 共享；请求按未完成数最少的实例分发，适合 CPU 推理，建议同时启用并发翻译。GPU 卸载时每个实例都会占用一份显存"},
+        "llama_server_daemon": {"description": "是否以常驻模式运行 llama-server：每个翻译模型一个服务器，队列中的后续视频直接复用已加载的模型；服务器信息写入 cache/llama_server 下的锁文件，界面重启后自动接管仍在运行的服务器而不是重新启动"},
+        "llama_server_idle_timeout": {"range": [0, 86400], "description": "常驻服务器空闲超时（秒），翻译结束后超过此时间没有新的翻译任务则停止服务器，0 表示不自动停止"},
+        "llama_server_draft_model": {"description": "推测解码草稿模型：填写 models/ 下的 GGUF 文件名或路径片段（如 qwen2.5-0.5b），需与翻译模型使用相同的词表；草稿模型先连续猜测若干 token，主模型一次性验证，译文与不启用时一致。为空表示不启用"},
+        "llama_server_draft_max": {"range": [1, 64], "description": "推测解码每次最多草稿 token 数，字幕译文较短，一般 8~16 即可"},
+        "llama_server_draft_min": {"range": [0, 64], "description": "推测解码每次最少草稿 token 数"},
+        "llama_server_telemetry": {"description": "是否记录 llama-server 性能遥测：汇总每个翻译请求的 prompt/缓存/生成 token 数与速度，每 5 秒抓取 /metrics 与 /slots（KV 缓存占用、处理中与排队请求数）并在处理日志中输出摘要；每个视频处理结束后在 logs/telemetry 下写出 JSON 报告，可据此调整上下文大小、批处理大小与并行槽数"},
+        "llama_server_mock": {"description": "以内置的模拟服务器（utils/mock_llama_server.py）代替 llama-server：不需要 GPU 与 GGUF 模型，返回确定性的伪译文，用于在普通机器上测试并发、重试与缓存等功能"},
+        "llama_server_mock_args": {"description": "模拟服务器的附加参数：--mock-prompt-latency / --mock-gen-latency（每 token 延迟秒数）、--mock-load-time、--mock-fail-rate、--mock-timeout-rate、--mock-crash-after、--mock-upstream 与 --mock-record（录制真实会话）、--mock-replay（回放）"},
     }
 
     result = {}
@@ -479,20 +595,24 @@ WHISPER_MODEL_PATTERNS: Dict[str, List[str]] = {
 }
 
 
+model_registry = ModelRegistry(
+    MODEL_CACHE_DIR,
+    os.path.join(CACHE_DIR, "model_manifest.json"),
+    server_dir=os.path.join(PROJECT_ROOT, "llama_cpp"),
+)
+
+
 def get_available_models() -> List[str]:
     available_models = []
-    if os.path.exists(MODEL_CACHE_DIR):
-        for item in os.listdir(MODEL_CACHE_DIR):
-            item_path = os.path.join(MODEL_CACHE_DIR, item)
-            if os.path.isdir(item_path):
-                item_lower = item.lower()
-                matched = None
-                for model_name, patterns in WHISPER_MODEL_PATTERNS.items():
-                    if any(p in item_lower for p in patterns):
-                        if matched is None or len(model_name) > len(matched):
-                            matched = model_name
-                if matched and matched not in available_models:
-                    available_models.append(matched)
+    for item in model_registry.model_dir_names():
+        item_lower = item.lower()
+        matched = None
+        for model_name, patterns in WHISPER_MODEL_PATTERNS.items():
+            if any(p in item_lower for p in patterns):
+                if matched is None or len(model_name) > len(matched):
+                    matched = model_name
+        if matched and matched not in available_models:
+            available_models.append(matched)
     if not available_models:
         available_models = ["tiny", "base", "small", "medium", "large-v2", "large-v3", "large-v3-turbo"]
     model_priority = ["tiny", "base", "small", "medium", "large-v2", "large-v3-turbo", "large-v3"]
@@ -500,7 +620,17 @@ def get_available_models() -> List[str]:
     return available_models
 
 
-MODEL_OPTIONS: List[str] = get_available_models()
+_model_options: Optional[List[str]] = None
+
+
+def __getattr__(name):
+    # MODEL_OPTIONS 在首次访问时才查询模型注册表，仅导入 config 不会扫描模型目录
+    global _model_options
+    if name == 'MODEL_OPTIONS':
+        if _model_options is None:
+            _model_options = get_available_models()
+        return _model_options
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 LANGUAGE_OPTIONS: List[Tuple[str, str]] = [
     ("auto", "自动检测"),
@@ -525,13 +655,16 @@ __all__ = [
     'config',
     'PARAM_DEFINITIONS',
     'MODEL_OPTIONS',
+    'get_available_models',
     'LANGUAGE_OPTIONS',
     'DEVICE_OPTIONS',
     'TRANSLATOR_OPTIONS',
     'PROJECT_ROOT',
     'MODEL_CACHE_DIR',
+    'model_registry',
     'TEMP_DIR',
     'OUTPUT_DIR',
+    'CACHE_DIR',
     'CONFIG_FILE',
     'IS_PACKAGE_MODE',
     'CdParams',
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+LlamaCppTranslator 对模拟服务器（utils/mock_llama_server.py）的端到端测试
+覆盖打包翻译、流式请求与翻译记忆三条路径，不需要 GGUF 模型与 llama-server
+"""
+
+import os
+import re
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("requests")
+
+from config import ServerParams, TransParams
+from utils import llama_server_manager, output_constraints, output_length_model, translation_memory
+from utils.translator import LlamaCppTranslator
+
+_CJK = re.compile(r'[一-鿿]')
+
+SOURCE_TEXTS = [
+    "Good morning, everyone.",
+    "Today we are going to talk about the weather.",
+    "It has been raining for three days.",
+    "The river is higher than usual.",
+    "Please stay away from the bridge.",
+    "We will update you tomorrow.",
+    "Thank you for watching.",
+    "See you next time.",
+]
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _segments():
+    return [{'id': i, 'text': text, 'start': float(i), 'end': i + 0.9} for i, text in enumerate(SOURCE_TEXTS)]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """统计、长度模型、翻译记忆、锁文件与服务器日志写入临时目录，不污染项目的 cache/ 与 logs/"""
+    for module in (llama_server_manager, output_constraints, output_length_model, translation_memory):
+        monkeypatch.setattr(module, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(llama_server_manager, "LOG_DIR", str(tmp_path / "logs"))
+    return tmp_path
+
+
+@pytest.fixture
+def server_params(cache_dir):
+    return ServerParams(port=_free_port(), threads=2, parallel_slots=2, slot_cache=False, mock=True)
+
+
+@pytest.fixture
+def translator(server_params):
+    translator = LlamaCppTranslator(server_params=server_params)
+    yield translator
+    translator._server_manager.stop_server()
+
+
+def _assert_translated(segments):
+    assert len(segments) == len(SOURCE_TEXTS)
+    for seg, text in zip(segments, SOURCE_TEXTS):
+        assert seg.get('original_text', seg['text']) == text
+        assert _CJK.search(seg.get('translated', '')), seg
+
+
+def test_packed_translation(translator):
+    segments = translator.translate_batch(_segments(), "en", "zh", trans_params=TransParams(pack_size=4))
+
+    _assert_translated(segments)
+    # 打包后每次请求包含多个片段，请求数少于片段数
+    assert translator._server_manager.get_prompt_cache_stats()['requests'] < len(SOURCE_TEXTS)
+
+
+def test_streamed_translation(translator):
+    segments = translator.translate_batch(_segments(), "en", "zh", trans_params=TransParams(stream_abort=True))
+
+    _assert_translated(segments)
+    assert translator._server_manager.get_prompt_cache_stats()['requests'] >= len(SOURCE_TEXTS)
+
+
+def test_translation_memory_skips_requests(translator, server_params, cache_dir):
+    trans_params = TransParams(memory=True)
+    first = translator.translate_batch(_segments(), "en", "zh", trans_params=trans_params)
+    _assert_translated(first)
+    assert os.path.exists(os.path.join(cache_dir, "translation_memory.sqlite3"))
+
+    second = translator.translate_batch(_segments(), "en", "zh", trans_params=trans_params)
+
+    _assert_translated(second)
+    assert [seg['translated'] for seg in second] == [seg['translated'] for seg in first]
+    # 全部命中翻译记忆，本批次没有发送任何翻译请求
+    assert translator._server_manager.get_prompt_cache_stats()['requests'] == 0
+
+
+def test_reset_session_erases_slots_without_restart(translator, monkeypatch):
+    manager = translator._server_manager
+    assert manager.ensure_server_running()
+    pid = manager.pid
+    erased = []
+    erase_slots = manager.erase_slots
+    monkeypatch.setattr(manager, "erase_slots", lambda: erased.append(True) or erase_slots())
+    monkeypatch.setattr(manager, "restart_server", lambda: pytest.fail("reset_session() 不应重启服务器"))
+
+    assert manager.reset_session()
+    assert erased
+    assert manager.pid == pid
+
+
+def test_truncated_output_under_learned_budget_is_retried(translator):
+    # 预置极小的输出比例，长度模型的预算落在下限 16 token，长句必然达到 n_predict
+    model = translator._length_model
+    name = translator._translator_name
+    for _ in range(model.min_samples):
+        model.record("en", "zh", 100, 1, model=name)
+    text = ("After three days of heavy rain the river near the old stone bridge has risen far above its usual level, "
+            "and the city council asks every resident living along the eastern bank to prepare for evacuation tonight.")
+
+    segments = translator.translate_batch([{'id': 0, 'text': text, 'start': 0.0, 'end': 5.0}], "en", "zh",
+                                          trans_params=TransParams())
+
+    processed_text = translator.preprocess_text(text)
+    assert processed_text in translator._length_fallback
+    translated = segments[0].get('translated', '')
+    assert len(_CJK.findall(translated)) > 16
+    # 截断的输出不计入样本，只有改用固定规则后的完整译文被记录
+    assert len(model._samples[model._pair("en", "zh", name)]) == model.min_samples + 1
+
+
+def test_length_samples_skip_estimated_token_counts(translator, monkeypatch):
+    # /tokenize 不可用，token 数只能按字符估算
+    monkeypatch.setattr(translator._server_manager, "tokenize", lambda text: None)
+
+    translator.translate_batch(_segments(), "en", "zh", trans_params=TransParams())
+
+    assert not translator._length_model._samples
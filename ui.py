@@ -58,7 +58,16 @@ class SaveConfigParams:
     device: Any = None
     source_language: Any = None
     target_language: Any = None
+    queue_stage_pipelined: Any = None
+    queue_extract_workers: Any = None
+    queue_recognize_workers: Any = None
     enable_forced_alignment: Any = None
+    alignment_emission_cache: Any = None
+    word_timestamp_mode: Any = None
+    keep_models_loaded: Any = None
+    recognition_worker_process: Any = None
+    recognition_worker_max_jobs: Any = None
+    recognition_worker_max_memory_mb: Any = None
     whispercd_alpha: Any = None
     whispercd_temperature: Any = None
     whispercd_snr_db: Any = None
@@ -84,7 +93,28 @@ class SaveConfigParams:
     llama_server_ngl: Any = None
     llama_server_batch_size: Any = None
     llama_server_parallel_slots: Any = None
+    llama_server_slot_cache: Any = None
+    llama_server_instances: Any = None
+    llama_server_daemon: Any = None
+    llama_server_idle_timeout: Any = None
+    llama_server_draft_model: Any = None
+    llama_server_draft_max: Any = None
+    llama_server_telemetry: Any = None
     translation_reset_session: Any = None
+    translation_concurrent: Any = None
+    translation_pack_size: Any = None
+    translation_memory: Any = None
+    translation_memory_max_entries: Any = None
+    translation_stream_abort: Any = None
+    translation_abort_repeat_threshold: Any = None
+    translation_abort_length_ratio: Any = None
+    translation_prompt_layout: Any = None
+    translation_candidates: Any = None
+    translation_candidate_temperature_step: Any = None
+    translation_grammar: Any = None
+    translation_pipelined: Any = None
+    translation_adaptive_output: Any = None
+    translation_output_length_quantile: Any = None
     translation_temperature: Any = None
     translation_top_k: Any = None
     translation_top_p: Any = None
@@ -221,10 +251,10 @@ def cancel_processing():
         return msg
 
 
-_STR_FIELDS = {'model', 'device', 'source_language', 'target_language', 'translator', 'llama_server_host', 'whispercd_particle_chars'}
-_INT_FIELDS = {'llama_server_port', 'whispercd_context_max_tokens', 'whispercd_max_token_repeat', 'whispercd_long_seq_window', 'whispercd_target_token_count', 'whispercd_search_range', 'llama_server_context_size', 'llama_server_threads', 'llama_server_ngl', 'llama_server_batch_size', 'llama_server_parallel_slots', 'translation_top_k', 'translation_segment_context_window', 'translation_max_context_tokens', 'translation_max_retries', 'translation_max_total_retries', 'translation_max_output_tokens', 'translation_short_text_threshold', 'translation_request_timeout'}
-_FLOAT_FIELDS = {'whispercd_alpha', 'whispercd_temperature', 'whispercd_snr_db', 'whispercd_temporal_shift', 'whispercd_max_duration', 'whispercd_min_duration', 'whispercd_merge_max_duration', 'whispercd_gap_threshold', 'whispercd_long_seq_threshold', 'whispercd_low_confidence_threshold', 'whispercd_continuation_gap_multiplier', 'translation_temperature', 'translation_top_p', 'translation_repetition_penalty', 'translation_validation_threshold', 'translation_kana_ratio_threshold'}
-_BOOL_FIELDS = {'enable_forced_alignment', 'translation_reset_session'}
+_STR_FIELDS = {'model', 'device', 'source_language', 'target_language', 'translator', 'llama_server_host', 'whispercd_particle_chars', 'word_timestamp_mode', 'translation_prompt_layout', 'llama_server_draft_model'}
+_INT_FIELDS = {'queue_extract_workers', 'queue_recognize_workers', 'recognition_worker_max_jobs', 'recognition_worker_max_memory_mb', 'llama_server_port', 'whispercd_context_max_tokens', 'whispercd_max_token_repeat', 'whispercd_long_seq_window', 'whispercd_target_token_count', 'whispercd_search_range', 'llama_server_context_size', 'llama_server_threads', 'llama_server_ngl', 'llama_server_batch_size', 'llama_server_parallel_slots', 'llama_server_instances', 'llama_server_idle_timeout', 'llama_server_draft_max', 'translation_top_k', 'translation_segment_context_window', 'translation_max_context_tokens', 'translation_max_retries', 'translation_max_total_retries', 'translation_max_output_tokens', 'translation_short_text_threshold', 'translation_request_timeout', 'translation_pack_size', 'translation_memory_max_entries', 'translation_abort_repeat_threshold', 'translation_candidates'}
+_FLOAT_FIELDS = {'whispercd_alpha', 'whispercd_temperature', 'whispercd_snr_db', 'whispercd_temporal_shift', 'whispercd_max_duration', 'whispercd_min_duration', 'whispercd_merge_max_duration', 'whispercd_gap_threshold', 'whispercd_long_seq_threshold', 'whispercd_low_confidence_threshold', 'whispercd_continuation_gap_multiplier', 'translation_temperature', 'translation_top_p', 'translation_repetition_penalty', 'translation_validation_threshold', 'translation_kana_ratio_threshold', 'translation_abort_length_ratio', 'translation_candidate_temperature_step', 'translation_output_length_quantile'}
+_BOOL_FIELDS = {'queue_stage_pipelined', 'enable_forced_alignment', 'recognition_worker_process', 'keep_models_loaded', 'alignment_emission_cache', 'translation_reset_session', 'translation_concurrent', 'translation_memory', 'translation_stream_abort', 'llama_server_slot_cache', 'translation_grammar', 'translation_pipelined', 'llama_server_daemon', 'translation_adaptive_output', 'llama_server_telemetry'}
 
 
 def _gradio_save_config(*args):
@@ -286,10 +316,19 @@ with gr.Blocks() as demo:
                 device = gr.Dropdown(choices=["auto", "cuda", "cpu"], value=config.get('device'), label="计算设备")
                 source_language = gr.Dropdown(choices=["zh", "en", "ja", "ko", "fr", "de", "es", "ru", "ar", "hi", "pt", "it", "nl", "pl"], value=config.get('source_language'), label="源语言")
                 target_language = gr.Dropdown(choices=["zh", "en", "ja", "ko", "fr", "de", "es", "ru", "ar", "hi", "pt", "it", "nl", "pl"], value=config.get('target_language'), label="目标语言(当源语言和目标语言相同时跳过翻译)")
+                queue_stage_pipelined = gr.Checkbox(value=config.get('queue_stage_pipelined', False), label="队列阶段流水线", info="后一个视频的提取与识别和前一个视频的翻译同时进行")
+                queue_extract_workers = gr.Slider(minimum=1, maximum=4, value=int(config.get('queue_extract_workers', 1)), step=1, label="同时提取音频数")
+                queue_recognize_workers = gr.Slider(minimum=1, maximum=4, value=int(config.get('queue_recognize_workers', 1)), step=1, label="同时识别数", info="每个识别线程各占一份模型显存")
 
             # 语音识别设置
             with gr.Accordion("语音识别设置", open=False):
                 enable_forced_alignment = gr.Checkbox(value=config.get('enable_forced_alignment'), label="启用强制对齐(Wav2Vec2)")
+                alignment_emission_cache = gr.Checkbox(value=config.get('alignment_emission_cache'), label="缓存对齐发射矩阵", info="编辑识别文本后可直接重新对齐，每集约占用数百MB磁盘")
+                word_timestamp_mode = gr.Dropdown(choices=["wav2vec2", "whisper_dtw", "auto"], value=config.get('word_timestamp_mode'), label="词级时间戳来源", info="whisper_dtw 使用交叉注意力DTW，无需Wav2Vec2模型；auto 在缺少对齐模型时自动切换")
+                keep_models_loaded = gr.Checkbox(value=config.get('keep_models_loaded', False), label="保持模型加载", info="后续视频直接复用已加载的识别与对齐模型，两者同时常驻显存")
+                recognition_worker_process = gr.Checkbox(value=config.get('recognition_worker_process', False), label="在子进程中识别", info="识别与对齐在常驻子进程中运行，界面进程不占用模型内存")
+                recognition_worker_max_jobs = gr.Slider(minimum=1, maximum=1000, value=int(config.get('recognition_worker_max_jobs', 20)), step=1, label="子进程回收任务数")
+                recognition_worker_max_memory_mb = gr.Slider(minimum=0, maximum=262144, value=int(config.get('recognition_worker_max_memory_mb', 0)), step=512, label="子进程回收内存阈值(MB)", info="0 表示不按内存回收")
                 whispercd_alpha = gr.Slider(minimum=0.0, maximum=2.0, value=float(config.get('whispercd_alpha', 1.0)), step=0.1, label="对比强度参数")
                 whispercd_temperature = gr.Slider(minimum=0.1, maximum=5.0, value=float(config.get('whispercd_temperature', 1.0)), step=0.01, label="log-sum-exp温度参数")
                 whispercd_snr_db = gr.Slider(minimum=0.0, maximum=30.0, value=float(config.get('whispercd_snr_db', 10.0)), step=1.0, label="高斯噪声注入的SNR值")
@@ -330,10 +369,48 @@ with gr.Blocks() as demo:
                     label="并行处理槽数",
                     info="单用户建议设为1，释放VRAM提升翻译速度"
                 )
+                llama_server_slot_cache = gr.Checkbox(
+                    value=config.get('llama_server_slot_cache'),
+                    label="保存预热KV状态",
+                    info="服务器重启后直接恢复提示词前缀缓存"
+                )
+                llama_server_instances = gr.Slider(
+                    minimum=1, maximum=16, value=int(config.get('llama_server_instances', 1)), step=1,
+                    label="服务器实例数",
+                    info="CPU推理时启动多个实例均分线程、并行槽与CPU核，配合并发翻译使用"
+                )
+                llama_server_daemon = gr.Checkbox(
+                    value=config.get('llama_server_daemon'),
+                    label="常驻服务器",
+                    info="视频之间保持模型加载，界面重启后自动接管"
+                )
+                llama_server_idle_timeout = gr.Number(
+                    value=int(config.get('llama_server_idle_timeout', 600)), precision=0,
+                    label="常驻服务器空闲超时(秒)", info="0 表示不自动停止"
+                )
+                llama_server_draft_model = gr.Textbox(
+                    value=config.get('llama_server_draft_model', ""),
+                    label="推测解码草稿模型",
+                    info="models/ 下与翻译模型同词表的小模型 GGUF 文件名，留空不启用"
+                )
+                llama_server_draft_max = gr.Slider(
+                    minimum=1, maximum=64, value=int(config.get('llama_server_draft_max', 16)), step=1,
+                    label="最大草稿token数"
+                )
+                llama_server_telemetry = gr.Checkbox(
+                    value=config.get('llama_server_telemetry', True),
+                    label="性能遥测",
+                    info="输出吞吐与KV占用摘要，处理结束后在 logs/telemetry 写出 JSON 报告"
+                )
                 translation_reset_session = gr.Checkbox(
                     value=config.get('translation_reset_session'),
                     label="翻译前重置会话"
                 )
+                translation_concurrent = gr.Checkbox(
+                    value=config.get('translation_concurrent'),
+                    label="并发翻译",
+                    info="按并行槽数同时发送翻译请求，需将并行处理槽数设为大于1"
+                )
 
             # 翻译策略设置
             with gr.Accordion("翻译策略设置", open=False):
@@ -346,6 +423,19 @@ with gr.Blocks() as demo:
                 translation_max_retries = gr.Slider(minimum=1, maximum=10, value=int(config.get('translation_max_retries', 3)), step=1, label="单条最大重试次数")
                 translation_max_total_retries = gr.Slider(minimum=3, maximum=30, value=int(config.get('translation_max_total_retries', 3)), step=1, label="验证失败最大总重试次数")
                 translation_max_output_tokens = gr.Slider(minimum=64, maximum=4096, value=int(config.get('translation_max_output_tokens', 512)), step=64, label="最大输出token数")
+                translation_pack_size = gr.Slider(minimum=1, maximum=32, value=int(config.get('translation_pack_size', 1)), step=1, label="打包翻译条数", info="每次请求合并翻译的连续片段数，1为逐条翻译")
+                translation_memory = gr.Checkbox(value=config.get('translation_memory'), label="启用翻译记忆", info="缓存已验证的译文，重复台词直接复用")
+                translation_memory_max_entries = gr.Number(value=int(config.get('translation_memory_max_entries', 50000)), precision=0, label="翻译记忆最大条目数")
+                translation_stream_abort = gr.Checkbox(value=config.get('translation_stream_abort'), label="流式提前中止", info="输出循环重复、超长或语言明显错误时立即中止并重试")
+                translation_abort_repeat_threshold = gr.Slider(minimum=3, maximum=20, value=int(config.get('translation_abort_repeat_threshold', 6)), step=1, label="中止重复次数阈值")
+                translation_abort_length_ratio = gr.Slider(minimum=1.5, maximum=10.0, value=float(config.get('translation_abort_length_ratio', 4.0)), step=0.5, label="中止长度倍数")
+                translation_prompt_layout = gr.Dropdown(choices=["classic", "prefix_cache"], value=config.get('translation_prompt_layout'), label="提示词布局", info="prefix_cache 固定提示词前缀，提高 llama-server KV 缓存复用率")
+                translation_candidates = gr.Slider(minimum=1, maximum=8, value=int(config.get('translation_candidates', 1)), step=1, label="每条候选数", info="一次采样多个候选，本地验证后取最佳；生成量成倍增加，建议不超过并行槽数")
+                translation_candidate_temperature_step = gr.Slider(minimum=0.0, maximum=1.0, value=float(config.get('translation_candidate_temperature_step', 0.3)), step=0.05, label="候选温度增量")
+                translation_grammar = gr.Checkbox(value=config.get('translation_grammar'), label="语法约束输出", info="以GBNF语法限制为单行目标语言输出，减少格式错误导致的重试")
+                translation_pipelined = gr.Checkbox(value=config.get('translation_pipelined'), label="边识别边翻译", info="识别定稿的片段即送入翻译，总耗时接近识别与翻译中较长者；两者同时占用显存")
+                translation_adaptive_output = gr.Checkbox(value=config.get('translation_adaptive_output', True), label="自适应输出长度", info="按语言对学习译文长度比例设定输出上限")
+                translation_output_length_quantile = gr.Slider(minimum=0.5, maximum=1.0, value=float(config.get('translation_output_length_quantile', 0.95)), step=0.01, label="输出长度分位数")
 
                 with gr.Accordion("验证与超时", open=False):
                     translation_validation_threshold = gr.Slider(minimum=0.1, maximum=1.0, value=float(config.get('translation_validation_threshold', 0.5)), step=0.05, label="翻译验证阈值", info="目标语言占比低于此值判定为翻译失败")
@@ -366,7 +456,10 @@ with gr.Blocks() as demo:
                 _gradio_save_config,
                 inputs=[
                     model, device, source_language, target_language,
-                    enable_forced_alignment,
+                    queue_stage_pipelined, queue_extract_workers, queue_recognize_workers,
+                    enable_forced_alignment, alignment_emission_cache, word_timestamp_mode,
+                    keep_models_loaded,
+                    recognition_worker_process, recognition_worker_max_jobs, recognition_worker_max_memory_mb,
                     whispercd_alpha, whispercd_temperature, whispercd_snr_db, whispercd_temporal_shift,
                     whispercd_context_max_tokens, whispercd_max_duration, whispercd_min_duration, whispercd_merge_max_duration, whispercd_gap_threshold,
                     whispercd_particle_chars,
@@ -374,8 +467,13 @@ with gr.Blocks() as demo:
                     whispercd_target_token_count, whispercd_search_range, whispercd_low_confidence_threshold, whispercd_continuation_gap_multiplier,
                     translator,
                     llama_server_host, llama_server_port, llama_server_context_size, llama_server_threads,
-                    llama_server_ngl, llama_server_batch_size, llama_server_parallel_slots,
-                    translation_reset_session,
+                    llama_server_ngl, llama_server_batch_size, llama_server_parallel_slots, llama_server_slot_cache, llama_server_instances,
+                    llama_server_daemon, llama_server_idle_timeout, llama_server_draft_model, llama_server_draft_max, llama_server_telemetry,
+                    translation_reset_session, translation_concurrent, translation_pack_size,
+                    translation_memory, translation_memory_max_entries,
+                    translation_stream_abort, translation_abort_repeat_threshold, translation_abort_length_ratio,
+                    translation_prompt_layout, translation_candidates, translation_candidate_temperature_step,
+                    translation_grammar, translation_pipelined, translation_adaptive_output, translation_output_length_quantile,
                     translation_temperature, translation_top_k, translation_top_p, translation_repetition_penalty,
                     translation_segment_context_window, translation_max_context_tokens, translation_max_retries, translation_max_total_retries,
                     translation_max_output_tokens,
@@ -389,7 +487,10 @@ with gr.Blocks() as demo:
                 outputs=[
                     config_status,
                     model, device, source_language, target_language,
-                    enable_forced_alignment,
+                    queue_stage_pipelined, queue_extract_workers, queue_recognize_workers,
+                    enable_forced_alignment, alignment_emission_cache, word_timestamp_mode,
+                    keep_models_loaded,
+                    recognition_worker_process, recognition_worker_max_jobs, recognition_worker_max_memory_mb,
                     whispercd_alpha, whispercd_temperature, whispercd_snr_db, whispercd_temporal_shift,
                     whispercd_context_max_tokens, whispercd_max_duration, whispercd_min_duration, whispercd_merge_max_duration, whispercd_gap_threshold,
                     whispercd_particle_chars,
@@ -397,8 +498,13 @@ with gr.Blocks() as demo:
                     whispercd_target_token_count, whispercd_search_range, whispercd_low_confidence_threshold, whispercd_continuation_gap_multiplier,
                     translator,
                     llama_server_host, llama_server_port, llama_server_context_size, llama_server_threads,
-                    llama_server_ngl, llama_server_batch_size, llama_server_parallel_slots,
-                    translation_reset_session,
+                    llama_server_ngl, llama_server_batch_size, llama_server_parallel_slots, llama_server_slot_cache, llama_server_instances,
+                    llama_server_daemon, llama_server_idle_timeout, llama_server_draft_model, llama_server_draft_max, llama_server_telemetry,
+                    translation_reset_session, translation_concurrent, translation_pack_size,
+                    translation_memory, translation_memory_max_entries,
+                    translation_stream_abort, translation_abort_repeat_threshold, translation_abort_length_ratio,
+                    translation_prompt_layout, translation_candidates, translation_candidate_temperature_step,
+                    translation_grammar, translation_pipelined, translation_adaptive_output, translation_output_length_quantile,
                     translation_temperature, translation_top_k, translation_top_p, translation_repetition_penalty,
                     translation_segment_context_window, translation_max_context_tokens, translation_max_retries, translation_max_total_retries,
                     translation_max_output_tokens,
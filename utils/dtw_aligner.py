@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+交叉注意力对齐模块
+利用 Whisper 对齐注意力头（alignment heads）的交叉注意力权重，通过 DTW 计算 token 级时间戳，
+并生成与强制对齐相同格式的 words / chars 字段，无需加载第二个声学模型
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+
+TIME_PRECISION = 0.02           # Whisper 编码器每帧对应 20ms
+MAX_ENCODER_FRAMES = 1500       # 30 秒音频对应的编码器帧数
+MEDFILT_WIDTH = 7
+NO_SPACE_LANGUAGES = {'ja', 'zh', 'yue', 'th', 'lo', 'my'}
+
+
+def median_filter(x: np.ndarray, width: int) -> np.ndarray:
+    """沿最后一维做中值滤波（边缘反射填充）"""
+    if width <= 1 or x.shape[-1] < width:
+        return x
+    pad = width // 2
+    padded = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad, pad)], mode='reflect')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width, axis=-1)
+    return np.median(windows, axis=-1)
+
+
+def dtw(cost: np.ndarray):
+    """动态时间规整，按反对角线向量化计算累计代价
+
+    Args:
+        cost: (tokens, frames) 代价矩阵
+
+    Returns:
+        (text_indices, time_indices) 对齐路径
+    """
+    n, m = cost.shape
+    acc = np.full((n + 1, m + 1), np.inf, dtype=np.float64)
+    trace = np.full((n + 1, m + 1), -1, dtype=np.int8)
+    acc[0, 0] = 0.0
+
+    for d in range(2, n + m + 1):
+        i = np.arange(max(1, d - m), min(n, d - 1) + 1)
+        if i.size == 0:
+            continue
+        j = d - i
+        candidates = np.stack([acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1]])
+        choice = np.argmin(candidates, axis=0)
+        acc[i, j] = cost[i - 1, j - 1] + candidates[choice, np.arange(i.size)]
+        trace[i, j] = choice
+
+    trace[0, :] = 2
+    trace[:, 0] = 1
+
+    i, j = n, m
+    path = []
+    while i > 0 or j > 0:
+        path.append((i - 1, j - 1))
+        step = trace[i, j]
+        if step == 0:
+            i -= 1
+            j -= 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    path.reverse()
+    path = np.array([(a, b) for a, b in path if a >= 0 and b >= 0])
+    return path[:, 0], path[:, 1]
+
+
+def _get_alignment_heads(model):
+    heads = getattr(model.generation_config, 'alignment_heads', None)
+    if heads:
+        return [(int(layer), int(head)) for layer, head in heads]
+    num_layers = model.config.decoder_layers
+    num_heads = model.config.decoder_attention_heads
+    return [(layer, head) for layer in range(num_layers // 2, num_layers) for head in range(num_heads)]
+
+
+@contextmanager
+def _eager_attention(model):
+    """SDPA 不返回注意力权重，计算交叉注意力时临时切换为 eager 实现"""
+    previous = getattr(model.config, '_attn_implementation', None)
+    switched = False
+    if previous != 'eager' and hasattr(model, 'set_attn_implementation'):
+        try:
+            model.set_attn_implementation('eager')
+            switched = True
+        except Exception as e:
+            print(f"[DTW对齐] 切换 eager 注意力失败: {e}")
+    try:
+        yield
+    finally:
+        if switched:
+            try:
+                model.set_attn_implementation(previous)
+            except Exception as e:
+                print(f"[DTW对齐] 恢复注意力实现失败: {e}")
+
+
+def compute_token_timestamps(model, encoder_output, token_ids, prefix_len, num_frames):
+    """对已解码的 token 序列做一次 teacher-forcing 解码器前向，取对齐头交叉注意力并用 DTW 求时间戳
+
+    复用 Whisper-CD 已计算的 clean 编码器输出，不重复运行编码器。
+
+    Args:
+        model: WhisperForConditionalGeneration
+        encoder_output: (1, frames, d_model) clean 编码器输出
+        token_ids: 以 SOT 开头的完整解码序列
+        prefix_len: 强制前缀长度（SOT、语言、任务 token）
+        num_frames: 有效编码器帧数
+
+    Returns:
+        与 token_ids[prefix_len:] 等长的 (start, end) 列表（秒，片段内相对时间）；失败时返回 None
+    """
+    if len(token_ids) <= prefix_len + 1:
+        return None
+    num_frames = max(1, min(int(num_frames), MAX_ENCODER_FRAMES, encoder_output.shape[1]))
+
+    device = encoder_output.device
+    decoder_input = torch.tensor([token_ids[:-1]], dtype=torch.long, device=device)
+
+    with torch.no_grad(), _eager_attention(model):
+        outputs = model.model.decoder(
+            input_ids=decoder_input,
+            encoder_hidden_states=encoder_output,
+            output_attentions=True,
+            use_cache=False,
+        )
+
+    cross_attentions = getattr(outputs, 'cross_attentions', None)
+    if not cross_attentions or cross_attentions[0] is None:
+        print("[DTW对齐] 模型未返回交叉注意力权重，跳过词级时间戳")
+        return None
+
+    heads = _get_alignment_heads(model)
+    weights = torch.stack([cross_attentions[layer][0, head] for layer, head in heads])
+    weights = weights[:, prefix_len - 1:, :num_frames].float().cpu().numpy()
+
+    std = weights.std(axis=-2, keepdims=True)
+    weights = (weights - weights.mean(axis=-2, keepdims=True)) / np.where(std > 0, std, 1.0)
+    weights = median_filter(weights, MEDFILT_WIDTH)
+    matrix = weights.mean(axis=0)
+
+    text_indices, time_indices = dtw(-matrix)
+    jumps = np.pad(np.diff(text_indices), (1, 0), constant_values=1).astype(bool)
+    jump_times = time_indices[jumps] * TIME_PRECISION
+
+    num_tokens = matrix.shape[0]
+    if len(jump_times) < num_tokens:
+        jump_times = np.pad(jump_times, (0, num_tokens - len(jump_times)), mode='edge')
+    end_time = num_frames * TIME_PRECISION
+    timestamps = []
+    for k in range(num_tokens):
+        start = float(jump_times[k])
+        end = float(jump_times[k + 1]) if k + 1 < num_tokens else end_time
+        timestamps.append((start, max(start, end)))
+    return timestamps
+
+
+def _group_unicode_units(timed_tokens, tokenizer):
+    """合并 token 直到解码结果不含替换字符，避免多字节字符被拆开"""
+    units = []
+    current_ids = []
+    current_start = None
+    for tid, start, end in timed_tokens:
+        if not current_ids:
+            current_start = start
+        current_ids.append(tid)
+        text = tokenizer.decode(current_ids)
+        if '\ufffd' not in text:
+            units.append((text, current_start, end))
+            current_ids = []
+    if current_ids:
+        text = tokenizer.decode(current_ids).replace('\ufffd', '')
+        if text:
+            units.append((text, current_start, timed_tokens[-1][2]))
+    return units
+
+
+def build_word_char_alignments(timed_tokens, tokenizer, language=None):
+    """根据 token 时间戳生成 words / chars 字段
+
+    Args:
+        timed_tokens: [(token_id, start, end), ...]
+        tokenizer: Whisper 分词器
+        language: 语言代码，无空格语言按字符单元切分单词
+
+    Returns:
+        (words, chars)
+    """
+    units = _group_unicode_units(timed_tokens, tokenizer)
+    no_space = bool(language) and language.split('-')[0] in NO_SPACE_LANGUAGES
+
+    chars = []
+    words = []
+    for text, start, end in units:
+        visible = [ch for ch in text if not ch.isspace()]
+        if visible:
+            step = (end - start) / len(visible)
+            for k, ch in enumerate(visible):
+                chars.append({'char': ch, 'start': start + k * step, 'end': start + (k + 1) * step})
+
+        stripped = text.strip()
+        if not stripped:
+            continue
+        starts_new_word = no_space or not words or text[:1].isspace()
+        if starts_new_word:
+            words.append({'word': stripped, 'start': start, 'end': end})
+        else:
+            words[-1]['word'] += stripped
+            words[-1]['end'] = end
+
+    return words, chars
+
+
+def attach_alignments(segments, timed_tokens, tokenizer, language=None, special_ids=None):
+    """按段落的 _token_ids 顺序消费带时间戳的 token，填充每个段落的 words / chars"""
+    special_ids = special_ids or set()
+    pointer = 0
+    for seg in segments:
+        seg_tokens = [tid for tid in seg.get('_token_ids', []) if tid not in special_ids]
+        matched = []
+        for tid in seg_tokens:
+            for k in range(pointer, min(pointer + 8, len(timed_tokens))):
+                if timed_tokens[k][0] == tid:
+                    matched.append(timed_tokens[k])
+                    pointer = k + 1
+                    break
+        if not matched:
+            continue
+        words, chars = build_word_char_alignments(matched, tokenizer, language)
+        seg['words'] = words
+        seg['chars'] = chars
+    return segments
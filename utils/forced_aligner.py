@@ -7,10 +7,165 @@
 import os
 import gc
 import re
+import json
+import hashlib
+import numpy as np
 import torch
 import torchaudio
 
-from config import MODEL_CACHE_DIR
+from config import MODEL_CACHE_DIR, CACHE_DIR, model_registry
+
+
+WAV2VEC2_MODELS = {
+    "ar": "jonatasgrosman--wav2vec2-large-xlsr-53-arabic",
+    "nl": "jonatasgrosman--wav2vec2-large-xlsr-53-dutch",
+    "en": "jonatasgrosman--wav2vec2-large-xlsr-53-english",
+    "fi": "jonatasgrosman--wav2vec2-large-xlsr-53-finnish",
+    "fr": "jonatasgrosman--wav2vec2-large-xlsr-53-french",
+    "de": "jonatasgrosman--wav2vec2-large-xlsr-53-german",
+    "it": "jonatasgrosman--wav2vec2-large-xlsr-53-italian",
+    "ja": "jonatasgrosman--wav2vec2-large-xlsr-53-japanese",
+    "fa": "jonatasgrosman--wav2vec2-large-xlsr-53-persian",
+    "pl": "jonatasgrosman--wav2vec2-large-xlsr-53-polish",
+    "pt": "jonatasgrosman--wav2vec2-large-xlsr-53-portuguese",
+    "ru": "jonatasgrosman--wav2vec2-large-xlsr-53-russian",
+    "zh": "jonatasgrosman--wav2vec2-large-xlsr-53-chinese-zh-cn",
+    "es": "jonatasgrosman--wav2vec2-large-xlsr-53-spanish",
+}
+
+
+ALIGN_SAMPLE_RATE = 16000
+
+
+def load_audio(audio_path, sr=ALIGN_SAMPLE_RATE):
+    """读取音频并转换为单声道、sr 采样率的 float32 数组，返回 (采样数据, 采样率)
+
+    强制对齐、发射缓存的音频哈希与识别子进程的共享内存音频都经由此函数解码，保证采样数据逐位一致
+    """
+    full_waveform, sample_rate = torchaudio.load(audio_path)
+    if full_waveform.shape[0] > 1:
+        full_waveform = torch.mean(full_waveform, dim=0, keepdim=True)
+    if sample_rate != sr:
+        resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=sr)
+        full_waveform = resampler(full_waveform)
+    return full_waveform.squeeze().numpy(), sr
+
+
+def has_alignment_model(language_code: str) -> bool:
+    """判断语言是否有可用的本地 Wav2Vec2 对齐模型"""
+    model_name = WAV2VEC2_MODELS.get(language_code)
+    return bool(model_name) and model_registry.find_dir(model_name) is not None
+
+
+class EmissionCache:
+    """CTC 发射矩阵缓存
+
+    按 音频哈希 + 对齐模型 持久化每个段落的 Wav2Vec2 logits（fp16 原始二进制 + JSON 索引），
+    读取时以内存映射方式打开，编辑文本后仅需重新运行 forced_align 即可得到新时间戳。
+    """
+
+    def __init__(self, audio_hash: str, model_name: str, cache_dir: str = None):
+        self.audio_hash = audio_hash
+        self.model_name = model_name
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, "alignment_emissions")
+        base = os.path.join(self.cache_dir, f"{audio_hash[:24]}_{model_name}")
+        self.data_path = base + ".f16"
+        self.index_path = base + ".json"
+        self._writer = None
+        self._entries = []
+        self._frame_offset = 0
+        self._vocab_size = None
+        self._memmap = None
+
+    @staticmethod
+    def hash_audio(full_audio) -> str:
+        """对解码后的采样数据求哈希，与容器元数据和 ffmpeg 版本无关"""
+        samples = np.ascontiguousarray(full_audio, dtype=np.float32)
+        return hashlib.sha1(samples.tobytes()).hexdigest()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path) and os.path.exists(self.data_path)
+
+    def begin_write(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._writer = open(self.data_path + ".tmp", "wb")
+        self._entries = []
+        self._frame_offset = 0
+        self._vocab_size = None
+
+    def append(self, index, start, end, logits):
+        """追加一个段落的 logits，logits 形状为 (1, frames, vocab)"""
+        if self._writer is None:
+            return
+        emission = logits[0].detach().to("cpu", dtype=torch.float16).numpy()
+        if self._vocab_size is None:
+            self._vocab_size = int(emission.shape[1])
+        self._writer.write(emission.tobytes())
+        self._entries.append({
+            "index": index,
+            "start": float(start),
+            "end": float(end),
+            "offset": self._frame_offset,
+            "frames": int(emission.shape[0]),
+        })
+        self._frame_offset += int(emission.shape[0])
+
+    def finish_write(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        if not self._entries:
+            os.remove(self.data_path + ".tmp")
+            return
+        os.replace(self.data_path + ".tmp", self.data_path)
+        index = {
+            "audio_hash": self.audio_hash,
+            "model_name": self.model_name,
+            "dtype": "float16",
+            "vocab_size": self._vocab_size,
+            "total_frames": self._frame_offset,
+            "entries": self._entries,
+        }
+        tmp_index = self.index_path + ".tmp"
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_index, self.index_path)
+        print(f"[强制对齐] 发射矩阵已缓存: {self.data_path} ({len(self._entries)} 段, {self._frame_offset} 帧)")
+
+    def abort_write(self):
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+        finally:
+            self._writer = None
+            if os.path.exists(self.data_path + ".tmp"):
+                os.remove(self.data_path + ".tmp")
+
+    def load(self):
+        """以内存映射方式打开缓存，返回段落索引列表"""
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._entries = index["entries"]
+        self._memmap = np.memmap(self.data_path, dtype=np.float16, mode="r",
+                                 shape=(index["total_frames"], index["vocab_size"]))
+        return self._entries
+
+    def find_entry(self, position, segment, total_segments):
+        """按段落序号匹配缓存窗口，段落数量变化时按时间中点匹配"""
+        if len(self._entries) == total_segments:
+            entry = self._entries[position]
+            if entry["index"] == position:
+                return entry
+        midpoint = (segment.get('start', 0.0) + segment.get('end', 0.0)) / 2
+        for entry in self._entries:
+            if entry["start"] <= midpoint <= entry["end"]:
+                return entry
+        return None
+
+    def get_emission(self, entry):
+        return self._memmap[entry["offset"]:entry["offset"] + entry["frames"]]
 
 
 class ForcedAligner:
@@ -29,43 +184,28 @@ class ForcedAligner:
             self.device = device
         self.align_model = None
         self.align_processor = None
+        self.model_name = None
 
-    def load_alignment_model(self, language_code: str) -> bool:
+    def load_alignment_model(self, language_code: str, processor_only: bool = False) -> bool:
         """
         加载对齐模型
 
         Args:
             language_code: 语言代码 (如 "en", "zh", "ja")
+            processor_only: 仅加载处理器（分词器），用于基于缓存发射矩阵的重新对齐
 
         Returns:
             是否成功加载模型
         """
         print(f"[强制对齐] 正在加载对齐模型 (语言: {language_code})...")
 
-        # 检查本地是否存在wav2vec2模型
-        wav2vec2_models = {
-            "ar": "jonatasgrosman--wav2vec2-large-xlsr-53-arabic",
-            "nl": "jonatasgrosman--wav2vec2-large-xlsr-53-dutch",
-            "en": "jonatasgrosman--wav2vec2-large-xlsr-53-english",
-            "fi": "jonatasgrosman--wav2vec2-large-xlsr-53-finnish",
-            "fr": "jonatasgrosman--wav2vec2-large-xlsr-53-french",
-            "de": "jonatasgrosman--wav2vec2-large-xlsr-53-german",
-            "it": "jonatasgrosman--wav2vec2-large-xlsr-53-italian",
-            "ja": "jonatasgrosman--wav2vec2-large-xlsr-53-japanese",
-            "fa": "jonatasgrosman--wav2vec2-large-xlsr-53-persian",
-            "pl": "jonatasgrosman--wav2vec2-large-xlsr-53-polish",
-            "pt": "jonatasgrosman--wav2vec2-large-xlsr-53-portuguese",
-            "ru": "jonatasgrosman--wav2vec2-large-xlsr-53-russian",
-            "zh": "jonatasgrosman--wav2vec2-large-xlsr-53-chinese-zh-cn",
-            "es": "jonatasgrosman--wav2vec2-large-xlsr-53-spanish",
-        }
-
         model_exists = False
         model_path = None
-        if language_code in wav2vec2_models:
-            model_name = wav2vec2_models[language_code]
+        if language_code in WAV2VEC2_MODELS:
+            model_name = WAV2VEC2_MODELS[language_code]
+            self.model_name = model_name
             model_path = os.path.join(MODEL_CACHE_DIR, model_name)
-            if os.path.exists(model_path):
+            if model_registry.find_dir(model_name):
                 print(f"[强制对齐] 找到本地wav2vec2模型: {model_path}")
                 model_exists = True
             else:
@@ -98,6 +238,9 @@ class ForcedAligner:
 
                 # 加载处理器和模型
                 self.align_processor = Wav2Vec2Processor.from_pretrained(model_path)
+                if processor_only:
+                    print(f"[强制对齐] 对齐处理器加载完成（仅分词器）")
+                    return True
                 dtype = torch.float16 if self.device == "cuda" else torch.float32
                 self.align_model = Wav2Vec2ForCTC.from_pretrained(model_path, torch_dtype=dtype)
                 self.align_model.to(self.device)
@@ -191,14 +334,7 @@ class ForcedAligner:
         return text
 
     def _load_full_audio(self, audio_path):
-        sr = 16000
-        full_waveform, sample_rate = torchaudio.load(audio_path)
-        if full_waveform.shape[0] > 1:
-            full_waveform = torch.mean(full_waveform, dim=0, keepdim=True)
-        if sample_rate != sr:
-            resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=sr)
-            full_waveform = resampler(full_waveform)
-        return full_waveform.squeeze().numpy(), sr
+        return load_audio(audio_path)
 
     def _extract_segment_audio(self, full_audio, start_time, end_time, sr):
         try:
@@ -417,20 +553,62 @@ class ForcedAligner:
         if segment.get('start') != original_start or segment.get('end') != original_end:
             print(f"[强制对齐] 时间戳修正: start {original_start:.3f}->{segment['start']:.3f}, end {original_end:.3f}->{segment['end']:.3f}")
 
+    def _align_segment_with_logits(self, segment, text, logits, start_time, end_time, return_char_alignments):
+        """对单个段落运行 Viterbi forced_align，logits 可来自模型推理或发射矩阵缓存"""
+        tokens = self.align_processor.tokenizer.tokenize(text)
+        if not tokens:
+            segment['alignment_fallback'] = True
+            return segment
+        labels = [self.align_processor.tokenizer.convert_tokens_to_ids(token) for token in tokens]
+        labels = torch.tensor([labels], device=self.device)
+
+        if labels.shape[1] == 0:
+            segment['alignment_fallback'] = True
+            return segment
+
+        input_length = logits.shape[1]
+        target_length = labels.shape[1]
+
+        if input_length < 2:
+            segment['alignment_fallback'] = True
+            return segment
+
+        token_alignments = self._extract_token_alignments(logits, labels, input_length, target_length)
+
+        frame_duration = (end_time - start_time) / logits.shape[1]
+
+        if return_char_alignments:
+            merged_alignments = self._build_char_alignments(token_alignments, start_time, frame_duration)
+            segment['chars'] = merged_alignments
+            print(f"[强制对齐] 字符级对齐完成，字符数: {len(merged_alignments)}")
+
+        self._build_word_alignments(segment)
+        self._filter_and_fix_timestamps(segment, start_time, end_time)
+        segment.pop('alignment_fallback', None)
+        return segment
+
     def align(
               self,
               transcript_segments: list,
               audio_path: str,
-              return_char_alignments: bool = False) -> list:
+              return_char_alignments: bool = False,
+              use_emission_cache: bool = False,
+              audio=None) -> list:
         if self.align_model is None or self.align_processor is None:
             raise RuntimeError("对齐模型未加载，请先调用 load_alignment_model()")
 
         print(f"[强制对齐] 开始帧级对齐处理...")
 
+        emission_cache = None
         try:
             aligned_segments = []
 
-            full_audio, sr = self._load_full_audio(audio_path)
+            # audio 为调用方已解码的 (采样数据, 采样率)，例如识别子进程共享内存中的音频
+            full_audio, sr = audio if audio is not None else self._load_full_audio(audio_path)
+
+            if use_emission_cache and self.model_name:
+                emission_cache = EmissionCache(EmissionCache.hash_audio(full_audio), self.model_name)
+                emission_cache.begin_write()
 
             print(f"[强制对齐] 开始处理 {len(transcript_segments)} 个段落")
 
@@ -445,56 +623,37 @@ class ForcedAligner:
 
                 text = self._preprocess_text_for_alignment(text, language)
 
-                if not text:
-                    print(f"[强制对齐] 跳过空文本段落")
-                    segment['alignment_fallback'] = True
-                    aligned_segments.append(segment)
-                    continue
-
                 segment_audio = self._extract_segment_audio(full_audio, start_time, end_time, sr)
                 if segment_audio is None:
                     segment['alignment_fallback'] = True
                     aligned_segments.append(segment)
                     continue
 
-                logits = self._run_model_inference(segment_audio, sr)
-
-                tokens = self.align_processor.tokenizer.tokenize(text)
-                if not tokens:
+                if not text and emission_cache is None:
+                    print(f"[强制对齐] 跳过空文本段落")
                     segment['alignment_fallback'] = True
                     aligned_segments.append(segment)
                     continue
-                labels = [self.align_processor.tokenizer.convert_tokens_to_ids(token) for token in tokens]
-                labels = torch.tensor([labels], device=self.device)
 
-                if labels.shape[1] == 0:
-                    segment['alignment_fallback'] = True
-                    aligned_segments.append(segment)
-                    continue
+                logits = self._run_model_inference(segment_audio, sr)
 
-                input_length = logits.shape[1]
-                target_length = labels.shape[1]
+                if emission_cache is not None:
+                    emission_cache.append(i, start_time, end_time, logits)
 
-                if input_length < 2:
+                if not text:
+                    print(f"[强制对齐] 跳过空文本段落")
                     segment['alignment_fallback'] = True
                     aligned_segments.append(segment)
                     continue
 
-                token_alignments = self._extract_token_alignments(logits, labels, input_length, target_length)
-
-                frame_duration = (end_time - start_time) / logits.shape[1]
-
-                if return_char_alignments:
-                    merged_alignments = self._build_char_alignments(token_alignments, start_time, frame_duration)
-                    segment['chars'] = merged_alignments
-                    print(f"[强制对齐] 字符级对齐完成，字符数: {len(merged_alignments)}")
-
-                self._build_word_alignments(segment)
-                self._filter_and_fix_timestamps(segment, start_time, end_time)
+                self._align_segment_with_logits(segment, text, logits, start_time, end_time, return_char_alignments)
 
                 aligned_segments.append(segment)
                 print(f"[强制对齐] 段落 {i+1} 处理完成")
 
+            if emission_cache is not None:
+                emission_cache.finish_write()
+
             print(f"[强制对齐] 所有段落处理完成，共 {len(aligned_segments)} 个段落")
 
             torch.cuda.empty_cache()
@@ -502,6 +661,8 @@ class ForcedAligner:
             return aligned_segments
 
         except Exception as e:
+            if emission_cache is not None:
+                emission_cache.abort_write()
             print(f"[强制对齐错误] {str(e)}")
             import traceback
             print(f"[强制对齐错误详情] {traceback.format_exc()}")
@@ -510,6 +671,56 @@ class ForcedAligner:
                 seg['alignment_fallback'] = True
             return transcript_segments
 
+    def realign(self,
+                transcript_segments: list,
+                audio_path: str,
+                return_char_alignments: bool = True):
+        """基于缓存的发射矩阵重新对齐编辑后的文本
+
+        只需要对齐处理器（分词器），不运行 Wav2Vec2 模型推理。
+
+        Args:
+            transcript_segments: 编辑后的段落列表（与缓存时的段落顺序一致）
+            audio_path: 原始音频路径，用于计算缓存键
+            return_char_alignments: 是否输出字符级时间戳
+
+        Returns:
+            重新对齐后的段落列表；缓存不存在时返回 None
+        """
+        if self.align_processor is None or not self.model_name:
+            raise RuntimeError("对齐处理器未加载，请先调用 load_alignment_model()")
+
+        full_audio, _ = self._load_full_audio(audio_path)
+        emission_cache = EmissionCache(EmissionCache.hash_audio(full_audio), self.model_name)
+        if not emission_cache.exists():
+            print(f"[强制对齐] 未找到发射矩阵缓存: {emission_cache.index_path}")
+            return None
+
+        emission_cache.load()
+        total = len(transcript_segments)
+        print(f"[强制对齐] 使用缓存发射矩阵重新对齐 {total} 个段落")
+
+        for i, segment in enumerate(transcript_segments):
+            entry = emission_cache.find_entry(i, segment, total)
+            if entry is None:
+                print(f"[强制对齐] 段落 {i+1} 无匹配的缓存窗口，保留原时间戳")
+                segment['alignment_fallback'] = True
+                continue
+
+            text = self._preprocess_text_for_alignment(segment.get('text', ''), segment.get('language', 'en'))
+            if not text:
+                segment['alignment_fallback'] = True
+                continue
+
+            emission = emission_cache.get_emission(entry)
+            logits = torch.from_numpy(np.asarray(emission, dtype=np.float32)).unsqueeze(0).to(self.device)
+            segment.pop('chars', None)
+            segment.pop('words', None)
+            self._align_segment_with_logits(segment, text, logits, entry["start"], entry["end"], return_char_alignments)
+
+        print(f"[强制对齐] 重新对齐完成")
+        return transcript_segments
+
     def cleanup(self):
         """清理对齐模型资源"""
         if self.align_model is not None:
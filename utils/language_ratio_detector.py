@@ -5,7 +5,8 @@
 """
 
 import re
-from typing import Any, Dict, Tuple
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
 
 
 # 语言字符范围定义
@@ -30,6 +31,19 @@ ARABIC_LANGS = {'ar', 'fa', 'ur', 'ps'}
 DEVANAGARI_LANGS = {'hi', 'bn', 'ne', 'mr'}
 THAI_LANGS = {'th', 'lo'}
 
+# 每类文字一个预编译字符类，计数在正则引擎内完成，避免逐字符调用 Python 函数；
+# 各范围互不重叠，与 is_*_char 的判定完全一致（中文标点计入 chinese）
+_SCRIPT_PATTERNS = (
+    ('chinese', re.compile('[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef\u2000-\u206f]')),
+    ('japanese', re.compile('[\u3040-\u30ff]')),
+    ('korean', re.compile('[\uac00-\ud7af]')),
+    ('latin', re.compile('[\u0041-\u007a\u00c0-\u024f]')),
+    ('cyrillic', re.compile('[\u0400-\u04ff]')),
+    ('arabic', re.compile('[\u0600-\u06ff]')),
+    ('devanagari', re.compile('[\u0900-\u097f]')),
+    ('thai', re.compile('[\u0e00-\u0e7f]')),
+)
+
 LANG_NAMES = {
     'zh': '中文', 'ja': '日文', 'ko': '韩文', 'en': '英文',
     'fr': '法文', 'de': '德文', 'es': '西班牙文', 'pt': '葡萄牙文',
@@ -118,6 +132,17 @@ def is_korean_char(char: str) -> bool:
     return 0xAC00 <= code <= 0xD7AF
 
 
+_COUNT_KEYS = tuple(name for name, _ in _SCRIPT_PATTERNS) + ('other',)
+
+
+@lru_cache(maxsize=4096)
+def _count_scripts(text: str) -> Tuple[int, ...]:
+    """按文字类别计数，结果按文本缓存（重试循环中同一原文/译文会被反复验证）"""
+    counts = [len(pattern.findall(text)) for _, pattern in _SCRIPT_PATTERNS]
+    counts.append(len(text) - sum(counts))
+    return tuple(counts)
+
+
 def detect_language_chars(text: str) -> Dict[str, int]:
     """检测文本中各语言的字符数量
 
@@ -138,54 +163,7 @@ def detect_language_chars(text: str) -> Dict[str, int]:
         - 'latin': 拉丁字母数量
         - 'other': 其他字符数量
     """
-    if not text:
-        return {
-            'chinese': 0,
-            'japanese': 0,
-            'korean': 0,
-            'latin': 0,
-            'cyrillic': 0,
-            'arabic': 0,
-            'devanagari': 0,
-            'other': 0
-        }
-
-    counts = {
-        'chinese': 0,
-        'japanese': 0,
-        'korean': 0,
-        'latin': 0,
-        'cyrillic': 0,
-        'arabic': 0,
-        'devanagari': 0,
-        'thai': 0,
-        'other': 0
-    }
-
-    for char in text:
-        if is_chinese_char(char):
-            counts['chinese'] += 1
-        elif is_japanese_char(char):
-            counts['japanese'] += 1
-        elif is_korean_char(char):
-            counts['korean'] += 1
-        elif is_latin_char(char):
-            counts['latin'] += 1
-        elif 0x0400 <= ord(char) <= 0x04FF:  # Cyrillic
-            counts['cyrillic'] += 1
-        elif 0x0600 <= ord(char) <= 0x06FF:  # Arabic
-            counts['arabic'] += 1
-        elif 0x0900 <= ord(char) <= 0x097F:  # Devanagari
-            counts['devanagari'] += 1
-        elif 0x0E00 <= ord(char) <= 0x0E7F:  # Thai
-            counts['thai'] += 1
-        elif is_other_chinese_char(char):
-            # 中文标点符号也算作中文字符
-            counts['chinese'] += 1
-        else:
-            counts['other'] += 1
-
-    return counts
+    return dict(zip(_COUNT_KEYS, _count_scripts(text or '')))
 
 
 def calculate_language_ratio(text: str, language: str = 'chinese') -> float:
@@ -220,10 +198,11 @@ def calculate_language_ratio(text: str, language: str = 'chinese') -> float:
     return target_count / total if total > 0 else 0.0
 
 
-def _calculate_target_language_ratio(text, target_lang, original_text='', source_lang='', trans_params=None):
+def _calculate_target_language_ratio(text, target_lang, original_text='', source_lang='', trans_params=None, lang_counts=None):
     if not text:
         return 0.0
-    lang_counts = detect_language_chars(text)
+    if lang_counts is None:
+        lang_counts = detect_language_chars(text)
     total = len(text)
     if total == 0:
         return 0.0
@@ -289,7 +268,8 @@ def check_translation_success(
         return False, 0.0, {}
 
     lang_counts = detect_language_chars(translated_text)
-    target_ratio = _calculate_target_language_ratio(translated_text, target_lang, original_text, source_lang, trans_params=trans_params)
+    target_ratio = _calculate_target_language_ratio(translated_text, target_lang, original_text, source_lang,
+                                                    trans_params=trans_params, lang_counts=lang_counts)
 
     success = target_ratio >= threshold
 
@@ -321,6 +301,50 @@ def is_translation_valid(original_text, translated_text, source_lang='ja', targe
     return success, target_ratio, lang_counts
 
 
+def validate_translations(
+    pairs: Iterable[Tuple[str, str]],
+    source_lang: str = 'ja',
+    target_lang: str = 'zh',
+    threshold: float = 0.5,
+    trans_params=None
+) -> List[Tuple[bool, float]]:
+    """批量验证译文
+
+    Args:
+        pairs: (原文, 译文) 序列，例如整个字幕文件的全部片段
+        source_lang: 源语言代码
+        target_lang: 目标语言代码
+        threshold: 目标语言字符占比阈值
+
+    Returns:
+        List[Tuple[bool, float]]: 与输入顺序一致的 (是否通过, 目标语言占比)，重复的 (原文, 译文) 只计算一次
+    """
+    results = {}
+    output = []
+    for original_text, translated_text in pairs:
+        key = (original_text, translated_text)
+        if key not in results:
+            valid, ratio, _ = is_translation_valid(original_text, translated_text, source_lang, target_lang,
+                                                   threshold=threshold, trans_params=trans_params)
+            results[key] = (valid, ratio)
+        output.append(results[key])
+    return output
+
+
+def is_partial_translation_failing(partial_text, original_text='', source_lang='ja', target_lang='zh',
+                                   min_chars=12, margin=0.5, trans_params=None):
+    """判断流式生成中的部分译文是否已明显失败
+
+    部分译文达到 min_chars 字符后，若目标语言占比低于验证阈值的 margin 倍，
+    则认为模型已滑向源语言或其他语言，可提前中止生成。
+    """
+    if not partial_text or len(partial_text.strip()) < min_chars:
+        return False
+    threshold = trans_params.validation_threshold if trans_params else 0.5
+    ratio = _calculate_target_language_ratio(partial_text, target_lang, original_text, source_lang, trans_params=trans_params)
+    return ratio < threshold * margin
+
+
 def get_translation_quality_info(
     original_text: str,
     translated_text: str,
@@ -351,7 +375,8 @@ def get_translation_quality_info(
     lang_counts = detect_language_chars(translated_text)
     total_chars = len(translated_text)
 
-    target_ratio = _calculate_target_language_ratio(translated_text, target_lang, original_text, trans_params=trans_params)
+    target_ratio = _calculate_target_language_ratio(translated_text, target_lang, original_text,
+                                                    trans_params=trans_params, lang_counts=lang_counts)
 
     target_lang_name = LANG_NAMES.get(target_lang, '目标语言')
 
@@ -5,25 +5,100 @@ llama-server 进程管理模块
 """
 
 import os
+import sys
+import json
+import shlex
 import time
+import threading
 import subprocess
 import requests
-import glob
+from requests.adapters import HTTPAdapter
 import signal
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, Tuple
 
-from config import config, ServerParams, PROJECT_ROOT
+from config import config, ServerParams, PROJECT_ROOT, CACHE_DIR, model_registry
+
+
+# 常驻模式下服务器就绪等待：/health 轮询间隔从 0.05s 指数退避到 1s，总时长上限
+_STARTUP_TIMEOUT = 120.0
+_POLL_INITIAL = 0.05
+_POLL_MAX = 1.0
+
+# 存活状态：请求路径只检查进程与该状态，不访问网络；/health 探测与故障重启由看门狗线程完成
+STATE_STOPPED = "stopped"
+STATE_READY = "ready"
+STATE_UNHEALTHY = "unhealthy"
+# 看门狗检查间隔；该间隔内有成功响应时跳过 /health 探测，连续探测失败达到次数后重启
+_WATCHDOG_INTERVAL = 5.0
+_WATCHDOG_MAX_FAILURES = 3
+
+
+MOCK_SERVER_SCRIPT = os.path.join(PROJECT_ROOT, "utils", "mock_llama_server.py")
+LOG_DIR = os.path.join(PROJECT_ROOT, "logs")
+
+
+def _pid_alive(pid: int) -> bool:
+    """判断进程是否存在（不向进程发送任何信号）"""
+    if not pid:
+        return False
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        try:
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _terminate_pid(pid: int):
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(pid)], capture_output=True, timeout=5)
+        else:
+            os.kill(pid, signal.SIGTERM)
+    except Exception as e:
+        print(f"[llama-server] 终止进程 {pid} 失败: {e}")
 
 
 class LlamaServerManager:
-    def __init__(self, port=None, server_params: ServerParams = None):
+    def __init__(self, port=None, server_params: ServerParams = None, threads=None, cpu_range=None,
+                 use_mmap=False, log_name="llama_server.log", auto_port=False, parallel_slots=None):
         if server_params is None:
             server_params = ServerParams()
         self._server_params = server_params
         self.host = server_params.host
         self.port = port or server_params.port
         self.context_size = server_params.ctx_size
-        self.threads = server_params.threads
+        self.threads = threads or server_params.threads
+        self.parallel_slots = max(1, parallel_slots or server_params.parallel_slots)
+        # 实例池：CPU 核范围（--cpu-range lo-hi）、共享 mmap 映射的模型文件、按实例区分的日志
+        self.cpu_range = cpu_range
+        self.use_mmap = use_mmap
+        self.log_name = log_name
+        # 常驻模式：任务结束后保持运行直到空闲超时，并通过锁文件供重启后的进程接管
+        self.daemon = server_params.daemon
+        self.idle_timeout = server_params.idle_timeout
+        self.auto_port = auto_port
+        self.mock = server_params.mock
+        self.lockfile_path = os.path.join(CACHE_DIR, "llama_server", os.path.splitext(log_name)[0] + ".json")
+        self._attached_pid = None
+        self._idle_timer = None
+        self.state = STATE_STOPPED
+        self._last_ok = 0.0
+        self._watchdog = None
+        self._watchdog_stop = None
 
         self.process: Optional[subprocess.Popen] = None
         self.pid = None
@@ -32,29 +107,45 @@ class LlamaServerManager:
         self.fail_count = 0
         self.max_failures = 3
         self._log_file = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_prompt_cache_stats()
+        # 始终以 --slot-save-path 启动：未指定时 llama-server 对所有 /slots 操作（包括 erase）返回 501，
+        # 会话重置只能退回重启服务器；slot_cache 仅控制是否保存与恢复预热前缀
+        self.slot_save_path = os.path.join(CACHE_DIR, "llama_slots")
+        self.slot_cache = server_params.slot_cache
+        self._warm_state = None
+        # 在途翻译请求不超过并行槽数（见 LlamaCppTranslator），另为看门狗健康检查与指标抓取预留连接
+        self._http = self._create_http_session(self.parallel_slots + 2)
 
         self._find_server_path()
         self._find_model_path()
+        self.draft_model_path = self._find_draft_model_path(server_params.draft_model)
+
+    @staticmethod
+    def _create_http_session(pool_size: int) -> requests.Session:
+        """创建保持长连接的 HTTP 会话"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def slot_context_size(self) -> int:
+        """单个并行槽可用的上下文大小（llama-server 将 -c 平均分配给 -np 个槽）"""
+        return self.context_size // self.parallel_slots
 
     def _find_server_path(self):
+        if self.mock:
+            self.server_path = MOCK_SERVER_SCRIPT
+            return
         possible_paths = [
             os.path.join(PROJECT_ROOT, "llama_cpp", "llama-server.exe"),
             os.path.join(PROJECT_ROOT, "llama_cpp", "build", "llama-server.exe"),
         ]
-        for path in possible_paths:
-            if os.path.exists(path):
-                self.server_path = path
-                return
-
-        for exe_name in ["llama-server.exe"]:
-            search_pattern = os.path.join(PROJECT_ROOT, "llama_cpp", "**", exe_name)
-            found = glob.glob(search_pattern, recursive=True)
-            if found:
-                self.server_path = found[0]
-                return
-
-        self.server_path = None
-        print(f"[llama-server] 未找到 llama-server 可执行文件")
+        self.server_path = model_registry.find_server(possible_paths)
+        if self.server_path is None:
+            print(f"[llama-server] 未找到 llama-server 可执行文件")
 
     @classmethod
     def find_model_path(cls, model_name):
@@ -70,10 +161,6 @@ class LlamaServerManager:
         if quantization is None:
             translator_repo = translator
 
-        print(f"[llama-server] 模型缓存目录: {MODEL_CACHE_DIR}")
-        print(f"[llama-server] 当前翻译模型: {translator}")
-        print(f"[llama-server] 仓库ID: {translator_repo}, 量化版本: {quantization}")
-
         translator_dir_name = translator_repo.replace("/", "--")
         model_dirs = [
             os.path.join(MODEL_CACHE_DIR, translator_dir_name),
@@ -85,66 +172,221 @@ class LlamaServerManager:
             model_dirs.append(os.path.join(MODEL_CACHE_DIR, "Sakura-7B-Qwen2.5-v1.0-GGUF"))
 
         for model_dir in model_dirs:
-            print(f"[llama-server] 检查模型目录: {model_dir}")
-            if os.path.exists(model_dir):
-                print(f"[llama-server] 找到模型目录: {model_dir}")
-                gguf_files = glob.glob(os.path.join(model_dir, "*.gguf"))
-                print(f"[llama-server] 找到 GGUF 文件: {gguf_files}")
-                if gguf_files:
-                    if quantization:
-                        print(f"[llama-server] 按量化版本查找: {quantization}")
-                        for f in gguf_files:
-                            if quantization in f:
-                                print(f"[llama-server] 找到匹配的模型: {f}")
-                                return f
-                    print("[llama-server] 按优先顺序查找模型")
-                    for preferred in ["Q2_K", "Q3_K_S", "Q3_K_M", "Q4_0", "Q4_K_S", "Q4_K_M", "Q5_0", "Q5_K_S", "Q5_K_M", "Q6_K", "Q8_0"]:
-                        for f in gguf_files:
-                            if preferred in f:
-                                print(f"[llama-server] 找到优先模型: {f}")
-                                return f
-                    print(f"[llama-server] 使用第一个模型: {gguf_files[0]}")
-                    return gguf_files[0]
-
-        search_pattern = os.path.join(MODEL_CACHE_DIR, "**", "*.gguf")
-        print(f"[llama-server] 递归搜索模型: {search_pattern}")
-        found = glob.glob(search_pattern, recursive=True)
-        print(f"[llama-server] 递归搜索结果: {found}")
+            gguf_files = [e['path'] for e in model_registry.gguf_files(model_dir)]
+            if gguf_files:
+                if quantization:
+                    for f in gguf_files:
+                        if quantization in f:
+                            return f
+                for preferred in ["Q2_K", "Q3_K_S", "Q3_K_M", "Q4_0", "Q4_K_S", "Q4_K_M", "Q5_0", "Q5_K_S", "Q5_K_M", "Q6_K", "Q8_0"]:
+                    for f in gguf_files:
+                        if preferred in f:
+                            return f
+                return gguf_files[0]
+
+        found = model_registry.gguf_files()
         if found:
             if quantization:
-                print(f"[llama-server] 按量化版本查找: {quantization}")
-                for f in found:
-                    if quantization in f:
-                        print(f"[llama-server] 找到匹配的模型: {f}")
-                        return f
-            smallest_file = min(found, key=os.path.getsize)
-            print(f"[llama-server] 使用最小模型: {smallest_file}")
-            return smallest_file
-
-        print("[llama-server] 未找到模型文件")
+                for entry in found:
+                    if entry['quantization'] == quantization or quantization in entry['path']:
+                        return entry['path']
+            smallest = min(found, key=lambda e: e['size'])
+            print(f"[llama-server] 未找到 {translator} 的模型目录，使用最小模型: {smallest['path']}")
+            return smallest['path']
+
+        print(f"[llama-server] 未找到模型文件 (翻译模型: {translator}, 模型目录: {MODEL_CACHE_DIR})")
         return None
 
+    def _find_draft_model_path(self, draft_model: str) -> Optional[str]:
+        """通过模型注册表查找推测解码的草稿模型，未配置时返回 None"""
+        if not draft_model:
+            return None
+        path = model_registry.find_gguf(draft_model)
+        if path is None:
+            print(f"[llama-server] 未找到草稿模型 {draft_model}，不启用推测解码")
+        elif path == self.model_path:
+            print(f"[llama-server] 草稿模型与主模型相同，不启用推测解码")
+            return None
+        return path
+
     def _find_model_path(self):
+        if self.mock:
+            # 模拟服务器不加载模型，该名称仅用于日志与预热状态文件命名
+            self.model_path = "mock.gguf"
+            return
         self.model_path = self.find_model_path(None)
 
+    def _process_alive(self) -> bool:
+        if self.process is not None:
+            return self.process.poll() is None
+        return self._attached_pid is not None and _pid_alive(self._attached_pid)
+
+    def is_live(self) -> bool:
+        """不访问网络的存活判断：进程仍在运行，且未被请求失败或看门狗标记为不健康"""
+        return self.state == STATE_READY and self._process_alive()
+
     def is_server_running(self) -> bool:
-        if self.process is None:
+        """进程存活且 /health 返回 200（访问网络，仅用于启动、故障判断等非请求路径）"""
+        if not self._process_alive():
             return False
-        if self.process.poll() is not None:
-            return False
-        return self._health_check()
+        if self._health_check():
+            self._mark_ok()
+            return True
+        return False
+
+    def _mark_ok(self):
+        self._last_ok = time.monotonic()
+        self.state = STATE_READY
 
-    def _health_check(self) -> bool:
+    def _on_ready(self):
+        self._mark_ok()
+        self._start_watchdog()
+
+    def _start_watchdog(self):
+        if self._watchdog is not None and self._watchdog.is_alive() and not self._watchdog_stop.is_set():
+            return
+        self._watchdog_stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watchdog_loop, args=(self._watchdog_stop,),
+                                          name=f"llama-watchdog-{self.port}", daemon=True)
+        self._watchdog.start()
+
+    def _stop_watchdog(self):
+        if self._watchdog_stop is not None:
+            self._watchdog_stop.set()
+        self._watchdog = None
+
+    def _watchdog_loop(self, stop_event: threading.Event):
+        """定期确认服务器存活：进程退出或 /health 连续失败时重启，重启后由新的看门狗线程接管"""
+        failures = 0
+        while not stop_event.wait(_WATCHDOG_INTERVAL):
+            alive = self._process_alive()
+            if alive and time.monotonic() - self._last_ok < _WATCHDOG_INTERVAL:
+                failures = 0
+                continue
+            if not alive:
+                reason = "进程已退出"
+            elif self._health_check(quiet=True):
+                self._mark_ok()
+                failures = 0
+                continue
+            else:
+                failures += 1
+                if failures < _WATCHDOG_MAX_FAILURES:
+                    continue
+                reason = f"健康检查连续失败 {failures} 次"
+            with self._start_lock:
+                if stop_event.is_set():
+                    return
+                self.state = STATE_UNHEALTHY
+                print(f"[llama-server] 看门狗: {self.host}:{self.port} {reason}，正在重启服务器")
+                if not self.restart_server():
+                    print(f"[llama-server] 看门狗重启失败，下次请求时重试启动")
+            return
+
+    def _health_check(self, quiet=False) -> bool:
         url = f"http://{self.host}:{self.port}/health"
         try:
-            response = requests.get(url, timeout=5)
+            response = self._http.get(url, timeout=5)
             return response.status_code == 200
         except requests.exceptions.RequestException:
-            print(f"[llama-server] 健康检查失败: {self.host}:{self.port}")
+            if not quiet:
+                print(f"[llama-server] 健康检查失败: {self.host}:{self.port}")
+            return False
+
+    def _wait_until_ready(self, timeout: float = _STARTUP_TIMEOUT) -> bool:
+        """以指数退避轮询 /health（模型加载期间返回 503），进程退出时立即判定失败"""
+        deadline = time.time() + timeout
+        delay = _POLL_INITIAL
+        while time.time() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                print(f"[llama-server] 启动失败，退出码: {self.process.returncode}")
+                return False
+            if self._health_check(quiet=True):
+                return True
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX)
+        print(f"[llama-server] 启动超时 ({timeout:.0f}s)")
+        return False
+
+    def _launch_signature(self) -> Dict[str, Any]:
+        """决定能否复用已运行服务器的启动参数（不含端口）"""
+        return {
+            'server_path': self.server_path,
+            'model_path': self.model_path,
+            'host': self.host,
+            'ctx_size': self.context_size,
+            'threads': self.threads,
+            'ngl': self._server_params.ngl,
+            'batch_size': self._server_params.batch_size,
+            'parallel_slots': self.parallel_slots,
+            'slot_save_path': self.slot_save_path,
+            'cpu_range': list(self.cpu_range) if self.cpu_range else None,
+            'use_mmap': self.use_mmap,
+            'draft_model_path': self.draft_model_path,
+            'draft_max': self._server_params.draft_max,
+            'draft_min': self._server_params.draft_min,
+            'mock_args': self._server_params.mock_args if self.mock else None,
+        }
+
+    def _write_lockfile(self):
+        data = {'pid': self.pid, 'port': self.port, 'started': time.time(), 'signature': self._launch_signature()}
+        try:
+            os.makedirs(os.path.dirname(self.lockfile_path), exist_ok=True)
+            with open(self.lockfile_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"[llama-server] 写入锁文件失败: {e}")
+
+    def _remove_lockfile(self):
+        try:
+            os.remove(self.lockfile_path)
+        except OSError:
+            pass
+
+    def _stop_orphaned_daemon(self):
+        """关闭常驻模式后，停止之前以常驻模式留下的服务器，避免占用端口"""
+        try:
+            with open(self.lockfile_path, 'r', encoding='utf-8') as f:
+                pid = json.load(f).get('pid')
+        except (OSError, ValueError):
+            return
+        if _pid_alive(pid):
+            print(f"[llama-server] 停止之前留下的常驻服务器: PID {pid}")
+            _terminate_pid(pid)
+        self._remove_lockfile()
+
+    def _try_attach(self) -> bool:
+        """读取锁文件，接管参数一致且仍在运行的常驻服务器；参数不一致的旧服务器会被停止"""
+        try:
+            with open(self.lockfile_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        pid = data.get('pid')
+        port = data.get('port')
+        if not _pid_alive(pid):
+            self._remove_lockfile()
+            return False
+        if data.get('signature') != self._launch_signature() or (port != self.port and not self.auto_port):
+            print(f"[llama-server] 已运行的常驻服务器 (PID {pid}, 端口 {port}) 启动参数不同，停止后重新启动")
+            _terminate_pid(pid)
+            self._remove_lockfile()
             return False
+        self.port = port
+        self._attached_pid = pid
+        self.pid = pid
+        if not self._wait_until_ready(timeout=10):
+            self._attached_pid = None
+            self.pid = None
+            return False
+        print(f"[llama-server] 已接管常驻服务器: PID {pid}, {self.host}:{self.port}")
+        self._on_ready()
+        self._restore_warm_state()
+        return True
 
     def start_server(self) -> bool:
         if self.is_server_running():
+            self._start_watchdog()
             return True
 
         if self.server_path is None:
@@ -157,11 +399,17 @@ class LlamaServerManager:
 
         self.stop_server()
 
+        if self.daemon:
+            if self._try_attach():
+                return True
+        else:
+            self._stop_orphaned_daemon()
+
         ngl = self._server_params.ngl
         batch_size = self._server_params.batch_size
-        parallel_slots = self._server_params.parallel_slots
-        cmd = [
-            self.server_path,
+        parallel_slots = self.parallel_slots
+        cmd = [sys.executable, self.server_path] if self.mock else [self.server_path]
+        cmd += [
             "-m", self.model_path,
             "--host", self.host,
             "--port", str(self.port),
@@ -171,14 +419,28 @@ class LlamaServerManager:
             "-ngl", str(ngl),
             "-np", str(parallel_slots),
             "--flash-attn", "auto",
-            "--no-mmap",
+            "--metrics",
         ]
+        if not self.use_mmap:
+            cmd.append("--no-mmap")
+        if self.cpu_range:
+            cmd += ["--cpu-range", f"{self.cpu_range[0]}-{self.cpu_range[1]}"]
+        os.makedirs(self.slot_save_path, exist_ok=True)
+        cmd += ["--slot-save-path", self.slot_save_path]
+        if self.draft_model_path:
+            cmd += [
+                "-md", self.draft_model_path,
+                "-ngld", str(ngl),
+                "--draft-max", str(self._server_params.draft_max),
+                "--draft-min", str(self._server_params.draft_min),
+            ]
+        if self.mock:
+            cmd += shlex.split(self._server_params.mock_args)
         
         try:
             print(f"[llama-server] 启动命令: {' '.join(cmd)}")
-            log_dir = os.path.join(PROJECT_ROOT, "logs")
-            os.makedirs(log_dir, exist_ok=True)
-            log_path = os.path.join(log_dir, "llama_server.log")
+            os.makedirs(LOG_DIR, exist_ok=True)
+            log_path = os.path.join(LOG_DIR, self.log_name)
             try:
                 self._log_file = open(log_path, "w", encoding="utf-8")
             except Exception:
@@ -195,28 +457,34 @@ class LlamaServerManager:
                     self._log_file = None
                 raise
             self.pid = self.process.pid
-            time.sleep(0.5)
+            start_time = time.time()
 
-            if self.process.poll() is not None:
-                print(f"[llama-server] 启动失败，退出码: {self.process.returncode}")
+            if not self._wait_until_ready():
                 return False
 
-            for _ in range(15):
-                if self._health_check():
-                    self.fail_count = 0
-                    print(f"[llama-server] 服务器已启动: {self.host}:{self.port}")
-                    return True
-                time.sleep(1)
-
-            print(f"[llama-server] 启动超时")
-            return False
+            self.fail_count = 0
+            print(f"[llama-server] 服务器已启动: {self.host}:{self.port}，就绪耗时 {time.time() - start_time:.2f}s")
+            if self.daemon:
+                self._write_lockfile()
+            self._on_ready()
+            self._restore_warm_state()
+            return True
 
         except Exception as e:
             print(f"[llama-server] 启动异常: {e}")
             return False
 
     def stop_server(self):
+        self._cancel_idle_timer()
+        self._stop_watchdog()
+        self.state = STATE_STOPPED
         if self.process is None:
+            if self._attached_pid is not None:
+                _terminate_pid(self._attached_pid)
+                print(f"[llama-server] 已停止常驻服务器: PID {self._attached_pid}")
+                self._attached_pid = None
+                self.pid = None
+                self._remove_lockfile()
             return
 
         try:
@@ -238,6 +506,8 @@ class LlamaServerManager:
 
         self.process = None
         self.pid = None
+        if self.daemon:
+            self._remove_lockfile()
 
         if self._log_file is not None:
             try:
@@ -246,6 +516,29 @@ class LlamaServerManager:
                 pass
             self._log_file = None
 
+    def release(self):
+        """翻译任务结束：常驻模式下保持运行并开始空闲计时，否则停止服务器"""
+        if not self.daemon:
+            self.stop_server()
+            return
+        self._cancel_idle_timer()
+        if self.idle_timeout > 0 and self.is_server_running():
+            self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle_timeout)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+            print(f"[llama-server] 常驻服务器保持运行，空闲 {self.idle_timeout}s 后自动停止")
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_idle_timeout(self):
+        with self._start_lock:
+            self._idle_timer = None
+            print(f"[llama-server] 常驻服务器空闲超过 {self.idle_timeout}s，停止服务器")
+            self.stop_server()
+
     def __enter__(self):
         return self
 
@@ -255,7 +548,9 @@ class LlamaServerManager:
 
     def __del__(self):
         try:
-            self.stop_server()
+            # 常驻服务器在本进程退出后继续运行，供下次启动时通过锁文件接管
+            if not self.daemon:
+                self.stop_server()
         except Exception:
             pass
         if self._log_file is not None:
@@ -266,7 +561,17 @@ class LlamaServerManager:
             self._log_file = None
 
     def ensure_server_running(self) -> bool:
-        if self.is_server_running():
+        self._cancel_idle_timer()
+        if self.is_live():
+            return True
+
+        with self._start_lock:
+            return self._ensure_server_running_locked()
+
+    def _ensure_server_running_locked(self) -> bool:
+        # 并发请求时可能已由其他线程完成启动；被标记为不健康但 /health 正常时恢复就绪状态
+        if self.is_live() or self.is_server_running():
+            self._start_watchdog()
             self.fail_count = 0
             return True
 
@@ -286,17 +591,21 @@ class LlamaServerManager:
     def reset_session(self) -> bool:
         """
         重置会话状态
-        通过重启服务器来确保全新的会话环境
+        优先通过 slot API 清空所有并行槽的 KV 缓存；服务器未运行或清空失败时才重启服务器
         
         Returns:
             bool: 重置是否成功
         """
         print(f"[llama-server] 正在重置会话...")
         start_time = time.time()
-        
-        # 停止并重启服务器
-        self.stop_server()
-        success = self.start_server()
+
+        if self.is_server_running() and self.erase_slots():
+            execution_time = (time.time() - start_time) * 1000
+            print(f"[llama-server] 会话重置成功（清空槽位KV），耗时: {execution_time:.2f}ms")
+            return True
+
+        print(f"[llama-server] 槽位清空不可用，改为重启服务器")
+        success = self.restart_server()
         
         end_time = time.time()
         execution_time = (end_time - start_time) * 1000
@@ -304,7 +613,79 @@ class LlamaServerManager:
         
         return success
 
-    def send_chat_request(self, messages: list, **kwargs) -> Optional[str]:
+    def restart_server(self) -> bool:
+        """停止并重新启动服务器进程，仅用于服务器故障恢复"""
+        self.stop_server()
+        return self.start_server()
+
+    def erase_slots(self) -> bool:
+        """通过 POST /slots/{id}?action=erase 清空每个并行槽的 KV 缓存"""
+        for slot_id in range(self.parallel_slots):
+            url = f"http://{self.host}:{self.port}/slots/{slot_id}"
+            try:
+                response = self._http.post(url, params={"action": "erase"}, timeout=10)
+            except requests.exceptions.RequestException as e:
+                print(f"[llama-server] 清空槽位 {slot_id} 失败: {e}")
+                return False
+            if response.status_code != 200:
+                print(f"[llama-server] 清空槽位 {slot_id} 失败: HTTP {response.status_code}, 响应: {response.text[:200]}")
+                return False
+        return True
+
+    def _slot_action(self, slot_id: int, action: str, filename: Optional[str] = None) -> bool:
+        url = f"http://{self.host}:{self.port}/slots/{slot_id}"
+        body = {"filename": filename} if filename else None
+        try:
+            response = self._http.post(url, params={"action": action}, json=body, timeout=30)
+        except requests.exceptions.RequestException as e:
+            print(f"[llama-server] 槽位 {slot_id} {action} 失败: {e}")
+            return False
+        if response.status_code != 200:
+            print(f"[llama-server] 槽位 {slot_id} {action} 失败: HTTP {response.status_code}, 响应: {response.text[:200]}")
+            return False
+        return True
+
+    def has_slot_state(self, filename: str) -> bool:
+        return self.slot_cache and os.path.isfile(os.path.join(self.slot_save_path, filename))
+
+    def save_slot_state(self, filename: str, slot_id: int = 0) -> bool:
+        """将指定槽位的 KV 状态保存到 --slot-save-path 下"""
+        if not self.slot_cache:
+            return False
+        return self._slot_action(slot_id, "save", filename)
+
+    def restore_slot_state(self, filename: str) -> bool:
+        """将已保存的 KV 状态恢复到所有并行槽"""
+        if not self.has_slot_state(filename):
+            return False
+        return all(self._slot_action(slot_id, "restore", filename) for slot_id in range(self.parallel_slots))
+
+    def set_warm_state(self, filename: Optional[str]):
+        """登记预热状态文件，之后每次（重新）启动服务器都会自动恢复"""
+        self._warm_state = filename
+
+    def _restore_warm_state(self):
+        if not self._warm_state or not self.has_slot_state(self._warm_state):
+            return
+        start_time = time.time()
+        if self.restore_slot_state(self._warm_state):
+            print(f"[llama-server] 已恢复预热KV状态 {self._warm_state}，耗时: {(time.time() - start_time) * 1000:.0f}ms")
+
+    def send_chat_request(self, messages: list, stream_monitor: Optional[Callable[[str], Optional[str]]] = None,
+                          telemetry=None, with_finish_reason: bool = False, **kwargs):
+        """发送 Chat 请求
+
+        Args:
+            messages: 聊天消息列表
+            stream_monitor: 可选的流式监视函数，接收已生成文本，返回非空原因时立即断开连接中止生成
+            telemetry: 可选的 ServerTelemetry，记录本次请求的 timings 或失败；
+                常驻模式下多个视频共用同一个服务器，按请求传入而不是挂在管理器上
+            with_finish_reason: 为 True 时返回 (文本, finish_reason)，finish_reason 为 "length" 表示达到 n_predict 被截断；
+                流式中止时为 None
+
+        Returns:
+            生成文本；流式中止时返回中止前的部分文本；失败返回 None
+        """
         if not self.ensure_server_running():
             return None
 
@@ -320,23 +701,39 @@ class LlamaServerManager:
             "stop": kwargs.get("stop", []),
             "cache_prompt": True,
         }
+        if "id_slot" in kwargs:
+            params["id_slot"] = kwargs["id_slot"]
+        if kwargs.get("grammar"):
+            params["grammar"] = kwargs["grammar"]
+        if stream_monitor is not None:
+            params["stream"] = True
 
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
                 json=params,
-                timeout=kwargs.get("timeout", 120)
+                timeout=kwargs.get("timeout", 120),
+                stream=stream_monitor is not None
             )
 
-            if response.status_code == 200:
+            if response.status_code == 200 and stream_monitor is not None:
                 self.fail_count = 0
+                self._mark_ok()
+                text, finish_reason = self._read_stream(response, stream_monitor, telemetry)
+                return (text, finish_reason) if with_finish_reason else text
+            elif response.status_code == 200:
+                self.fail_count = 0
+                self._mark_ok()
                 data = response.json()
+                self._record_timings(data, telemetry)
                 choices = data.get("choices", [])
+                text, finish_reason = "", None
                 if choices:
-                    message = choices[0].get("message", {})
-                    return message.get("content", "")
-                print(f"[llama-server] Chat请求返回空choices")
-                return ""
+                    text = choices[0].get("message", {}).get("content", "")
+                    finish_reason = choices[0].get("finish_reason")
+                else:
+                    print(f"[llama-server] Chat请求返回空choices")
+                return (text, finish_reason) if with_finish_reason else text
             else:
                 self.fail_count += 1
                 try:
@@ -345,10 +742,12 @@ class LlamaServerManager:
                     print(f"[llama-server] 获取错误响应体失败")
                     error_body = ""
                 print(f"[llama-server] Chat请求失败: HTTP {response.status_code}, 响应: {error_body}")
+                self._record_failure(telemetry)
                 return None
 
         except requests.exceptions.Timeout:
             self.fail_count += 1
+            self._record_failure(telemetry)
             print(f"[llama-server] 请求超时")
             if self.fail_count >= self.max_failures:
                 print(f"[llama-server] 检测到 {self.fail_count} 次连续失败，尝试重启服务器")
@@ -358,9 +757,129 @@ class LlamaServerManager:
 
         except requests.exceptions.RequestException as e:
             self.fail_count += 1
+            # 连接失败时不再信任缓存的存活状态，下次请求前重新检查并在需要时重启
+            self.state = STATE_UNHEALTHY
+            self._record_failure(telemetry)
             print(f"[llama-server] 请求异常: {e}")
             return None
 
+    def reset_prompt_cache_stats(self):
+        with self._stats_lock:
+            self._prompt_stats = {'requests': 0, 'prompt_n': 0, 'cache_n': 0, 'predicted_n': 0,
+                                  'draft_n': 0, 'draft_n_accepted': 0}
+
+    def _record_timings(self, data: Dict[str, Any], telemetry=None):
+        """记录响应中的 prompt 计算量与 KV 缓存复用量（timings.prompt_n / timings.cache_n），
+        以及启用推测解码时的草稿 token 数与接受数（timings.draft_n / timings.draft_n_accepted）"""
+        timings = data.get("timings") or {}
+        prompt_n = timings.get("prompt_n")
+        cache_n = timings.get("cache_n", data.get("tokens_cached"))
+        if prompt_n is None and cache_n is None:
+            return
+        with self._stats_lock:
+            self._prompt_stats['requests'] += 1
+            self._prompt_stats['prompt_n'] += int(prompt_n or 0)
+            self._prompt_stats['cache_n'] += int(cache_n or 0)
+            self._prompt_stats['predicted_n'] += int(timings.get("predicted_n") or 0)
+            self._prompt_stats['draft_n'] += int(timings.get("draft_n") or 0)
+            self._prompt_stats['draft_n_accepted'] += int(timings.get("draft_n_accepted") or 0)
+        if telemetry is not None:
+            telemetry.record(timings)
+
+    @staticmethod
+    def _record_failure(telemetry):
+        if telemetry is not None:
+            telemetry.record_failure()
+
+    def scrape_metrics(self) -> Optional[Dict[str, Any]]:
+        """抓取 /metrics（Prometheus 文本）与 /slots，服务器未运行或均不可用时返回 None"""
+        if not self.is_live():
+            return None
+        metrics = {}
+        try:
+            response = self._http.get(f"http://{self.host}:{self.port}/metrics", timeout=2)
+            if response.status_code == 200:
+                for line in response.text.splitlines():
+                    if not line.startswith("llamacpp:"):
+                        continue
+                    name, _, value = line[len("llamacpp:"):].partition(" ")
+                    try:
+                        metrics[name] = float(value)
+                    except ValueError:
+                        continue
+        except requests.exceptions.RequestException:
+            pass
+        try:
+            response = self._http.get(f"http://{self.host}:{self.port}/slots", timeout=2)
+            if response.status_code == 200:
+                slots = response.json()
+                metrics['busy_slots'] = sum(1 for slot in slots if slot.get("is_processing"))
+                metrics['total_slots'] = len(slots)
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return metrics or None
+
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        """返回累计的 prompt 缓存复用统计，reuse_rate = cache_n / (cache_n + prompt_n)，
+        draft_acceptance = draft_n_accepted / draft_n"""
+        with self._stats_lock:
+            stats = dict(self._prompt_stats)
+        stats['prompt_total'] = stats['prompt_n'] + stats['cache_n']
+        stats['reuse_rate'] = stats['cache_n'] / stats['prompt_total'] if stats['prompt_total'] else 0.0
+        stats['draft_acceptance'] = stats['draft_n_accepted'] / stats['draft_n'] if stats['draft_n'] else 0.0
+        return stats
+
+    def tokenize(self, text: str) -> Optional[list]:
+        """调用 /tokenize 获取文本的 token 列表；服务器未启动或请求失败时返回 None（不会自动启动服务器）"""
+        if not self.is_live():
+            return None
+        url = f"http://{self.host}:{self.port}/tokenize"
+        try:
+            response = self._http.post(url, json={"content": text, "add_special": False}, timeout=10)
+            if response.status_code != 200:
+                return None
+            return response.json().get("tokens", [])
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def _read_stream(self, response, stream_monitor, telemetry=None) -> Tuple[str, Optional[str]]:
+        """逐个读取 SSE 数据块，监视函数要求中止时关闭连接（llama-server 检测到断开后停止该槽的生成）
+
+        Returns:
+            (已生成文本, finish_reason)；中止时 finish_reason 为 None
+        """
+        text = ""
+        finish_reason = None
+        try:
+            for raw_line in response.iter_lines():
+                if not raw_line or not raw_line.startswith(b"data: "):
+                    continue
+                payload = raw_line[len(b"data: "):].strip()
+                if payload == b"[DONE]":
+                    break
+                try:
+                    chunk = json.loads(payload.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+                if "timings" in chunk:
+                    self._record_timings(chunk, telemetry)
+                choices = chunk.get("choices", [])
+                if not choices:
+                    continue
+                finish_reason = choices[0].get("finish_reason") or finish_reason
+                delta = choices[0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                text += delta
+                reason = stream_monitor(text)
+                if reason:
+                    print(f"[llama-server] 流式生成提前中止: {reason} (已生成 {len(text)} 字符)")
+                    finish_reason = None
+                    break
+        finally:
+            response.close()
+        return text, finish_reason
+
 
 
 
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+llama-server 实例池模块
+在自动分配的端口上启动多个 llama-server 实例，线程数与并行槽数在实例间均分，线程按 CPU 核范围绑定，
+模型文件通过 mmap 共享页缓存；各实例独立做健康检测，请求分发给未完成请求数最少的实例。
+对翻译器提供与 LlamaServerManager 相同的接口
+"""
+
+import os
+import socket
+import threading
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import config, ServerParams
+from utils.llama_server_manager import LlamaServerManager
+
+
+def _find_free_port(host: str) -> int:
+    """向系统申请一个当前空闲的端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class LlamaServerPool:
+    def __init__(self, server_params: ServerParams = None):
+        if server_params is None:
+            server_params = ServerParams()
+        self._server_params = server_params
+        self.daemon = server_params.daemon
+        count = max(1, server_params.instances)
+        threads_per_instance = max(1, server_params.threads // count)
+        # 并行槽数同样是所有实例的总数，每个实例至少 1 个槽
+        slots_per_instance = max(1, server_params.parallel_slots // count)
+        cpu_count = os.cpu_count() or 1
+        # CPU 核足够时每个实例绑定一段互不重叠的核，否则交给系统调度
+        pin_cores = threads_per_instance * count <= cpu_count
+
+        self.instances: List[LlamaServerManager] = []
+        used_ports = set()
+        for k in range(count):
+            port = _find_free_port(server_params.host)
+            while port in used_ports:
+                port = _find_free_port(server_params.host)
+            used_ports.add(port)
+            cpu_range = (k * threads_per_instance, (k + 1) * threads_per_instance - 1) if pin_cores else None
+            self.instances.append(LlamaServerManager(
+                port=port, server_params=server_params, threads=threads_per_instance,
+                cpu_range=cpu_range, use_mmap=True, log_name=f"llama_server_{k}.log", auto_port=True,
+                parallel_slots=slots_per_instance
+            ))
+
+        first = self.instances[0]
+        self.host = first.host
+        self.model_path = first.model_path
+        self.server_path = first.server_path
+        self.slot_save_path = first.slot_save_path
+        self.slot_cache = first.slot_cache
+        self.parallel_slots = sum(m.parallel_slots for m in self.instances)
+        self._lock = threading.Lock()
+        self._outstanding = [0] * count
+        self._healthy = [False] * count
+        print(f"[llama-server池] {count} 个实例，每个 {threads_per_instance} 线程、{slots_per_instance} 个并行槽"
+              f"{'，已绑定CPU核' if pin_cores else ''}，端口: {self.port}")
+
+    @property
+    def port(self) -> str:
+        # 常驻模式接管已运行的实例时端口取自锁文件
+        return ", ".join(str(m.port) for m in self.instances)
+
+    @property
+    def slot_context_size(self) -> int:
+        return min(m.slot_context_size for m in self.instances)
+
+    def _for_each(self, fn: Callable[[LlamaServerManager], Any]) -> list:
+        """在所有实例上并行执行 fn（启动、重置等耗时操作）"""
+        with ThreadPoolExecutor(max_workers=len(self.instances), thread_name_prefix="llama-pool") as executor:
+            return list(executor.map(fn, self.instances))
+
+    def ensure_server_running(self) -> bool:
+        """确保各实例运行，至少一个实例可用即返回 True；各实例均存活时只做本地判断，不访问网络"""
+        if all(m.is_live() for m in self.instances):
+            self._healthy = [m.ensure_server_running() for m in self.instances]
+            return True
+        self._healthy = self._for_each(lambda m: m.ensure_server_running())
+        if not all(self._healthy):
+            down = [str(m.port) for m, ok in zip(self.instances, self._healthy) if not ok]
+            print(f"[llama-server池] 以下端口的实例不可用: {', '.join(down)}")
+        return any(self._healthy)
+
+    def start_server(self) -> bool:
+        return self.ensure_server_running()
+
+    def stop_server(self):
+        self._for_each(lambda m: m.stop_server())
+        self._healthy = [False] * len(self.instances)
+
+    def release(self):
+        for m in self.instances:
+            m.release()
+
+    def restart_server(self) -> bool:
+        self.stop_server()
+        return self.ensure_server_running()
+
+    def is_live(self) -> bool:
+        return any(m.is_live() for m in self.instances)
+
+    def is_server_running(self) -> bool:
+        return any(m.is_server_running() for m in self.instances)
+
+    def reset_session(self) -> bool:
+        self._healthy = self._for_each(lambda m: m.reset_session())
+        return any(self._healthy)
+
+    def erase_slots(self) -> bool:
+        return all(self._for_each(lambda m: m.erase_slots()))
+
+    def _acquire(self) -> int:
+        """选择未完成请求数最少的可用实例"""
+        with self._lock:
+            candidates = [k for k, ok in enumerate(self._healthy) if ok] or list(range(len(self.instances)))
+            k = min(candidates, key=lambda idx: self._outstanding[idx])
+            self._outstanding[k] += 1
+            return k
+
+    def _release(self, k: int):
+        with self._lock:
+            self._outstanding[k] -= 1
+
+    def send_chat_request(self, messages: list, stream_monitor: Optional[Callable[[str], Optional[str]]] = None, **kwargs):
+        # 指定 id_slot 的请求依赖该槽的 KV 状态（如前缀预热），固定发往第一个实例
+        if "id_slot" in kwargs:
+            return self.instances[0].send_chat_request(messages, stream_monitor=stream_monitor, **kwargs)
+        k = self._acquire()
+        try:
+            output = self.instances[k].send_chat_request(messages, stream_monitor=stream_monitor, **kwargs)
+        finally:
+            self._release(k)
+        if output is None and not self.instances[k].is_server_running():
+            self._healthy[k] = False
+            print(f"[llama-server池] 端口 {self.instances[k].port} 的实例不可用，后续请求分发到其他实例")
+        return output
+
+    def tokenize(self, text: str) -> Optional[list]:
+        for m, ok in zip(self.instances, self._healthy):
+            if ok:
+                return m.tokenize(text)
+        return None
+
+    def has_slot_state(self, filename: str) -> bool:
+        return self.instances[0].has_slot_state(filename)
+
+    def save_slot_state(self, filename: str, slot_id: int = 0) -> bool:
+        return self.instances[0].save_slot_state(filename, slot_id)
+
+    def restore_slot_state(self, filename: str) -> bool:
+        """所有实例共用同一个 --slot-save-path，逐个恢复"""
+        return all(self._for_each(lambda m: m.restore_slot_state(filename)))
+
+    def set_warm_state(self, filename: Optional[str]):
+        for m in self.instances:
+            m.set_warm_state(filename)
+
+    def scrape_metrics(self) -> Optional[Dict[str, Any]]:
+        """汇总各实例的指标：请求数与槽位数相加，KV 占用取平均"""
+        scraped = [m for m in (inst.scrape_metrics() for inst in self.instances) if m]
+        if not scraped:
+            return None
+        metrics = {}
+        for key in {k for m in scraped for k in m}:
+            values = [m[key] for m in scraped if key in m]
+            metrics[key] = sum(values) / len(values) if key == 'kv_cache_usage_ratio' else sum(values)
+        return metrics
+
+    def reset_prompt_cache_stats(self):
+        for m in self.instances:
+            m.reset_prompt_cache_stats()
+
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        stats = {'requests': 0, 'prompt_n': 0, 'cache_n': 0, 'predicted_n': 0, 'draft_n': 0, 'draft_n_accepted': 0}
+        for m in self.instances:
+            instance_stats = m.get_prompt_cache_stats()
+            for key in stats:
+                stats[key] += instance_stats[key]
+        stats['prompt_total'] = stats['prompt_n'] + stats['cache_n']
+        stats['reuse_rate'] = stats['cache_n'] / stats['prompt_total'] if stats['prompt_total'] else 0.0
+        stats['draft_acceptance'] = stats['draft_n_accepted'] / stats['draft_n'] if stats['draft_n'] else 0.0
+        return stats
+
+
+# 常驻模式下按 (服务器参数, 翻译模型) 复用的管理器，队列中的后续视频直接使用已加载的服务器
+_shared_managers: Dict[tuple, Any] = {}
+_shared_lock = threading.Lock()
+
+
+def _create(server_params):
+    if server_params is not None and server_params.instances > 1:
+        return LlamaServerPool(server_params)
+    return LlamaServerManager(server_params=server_params)
+
+
+def create_server_manager(server_params: ServerParams = None):
+    """按实例数创建单个 LlamaServerManager 或 LlamaServerPool；常驻模式下复用同一模型的管理器"""
+    if server_params is None or not server_params.daemon:
+        return _create(server_params)
+    key = (tuple(sorted(asdict(server_params).items())), config.get('translator'))
+    with _shared_lock:
+        manager = _shared_managers.get(key)
+        if manager is None:
+            # 单实例固定使用配置端口，换模型时先停止占用该端口的旧服务器
+            for other_key, other in list(_shared_managers.items()):
+                if isinstance(other, LlamaServerManager) and server_params.instances == 1 and other.port == server_params.port:
+                    other.stop_server()
+                    del _shared_managers[other_key]
+            manager = _create(server_params)
+            _shared_managers[key] = manager
+        return manager
+
+
+def stop_shared_managers():
+    """停止所有常驻模式下复用的服务器（仅为本进程临时开启常驻模式的调用方在退出时使用）"""
+    with _shared_lock:
+        managers = list(_shared_managers.values())
+        _shared_managers.clear()
+    for manager in managers:
+        try:
+            manager.stop_server()
+        except Exception as e:
+            print(f"[llama-server] 停止常驻服务器时出错: {e}")
+
+
+__all__ = ['LlamaServerPool', 'create_server_manager', 'stop_shared_managers']
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+"""
+llama-server 模拟服务器
+仅依赖标准库，实现翻译器用到的 /health、/v1/chat/completions（含流式）、/tokenize、/slots 与 /metrics，
+返回确定性的伪译文；可配置每个 prompt token / 生成 token 的延迟、模型加载时间、随机失败与超时、
+在第 N 个请求后崩溃，并可录制真实服务器的会话后离线回放。
+
+接受与 llama-server 相同的命令行参数（未用到的参数忽略），LlamaServerManager 在 llama_server_mock
+开启时以 `python utils/mock_llama_server.py <llama-server 参数> <llama_server_mock_args>` 启动它：
+
+    python utils/mock_llama_server.py --port 8080 -np 4 --mock-gen-latency 0.01 --mock-fail-rate 0.05
+    python utils/mock_llama_server.py --port 8081 --mock-upstream http://127.0.0.1:8080 --mock-record cache/session.jsonl
+    python utils/mock_llama_server.py --port 8080 --mock-replay cache/session.jsonl
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+_TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[A-Za-z]+|\d+|\s+|[^\sA-Za-z\d]')
+_LANG_PATTERN = re.compile(r'Translate (?:the following|each numbered) \w+ (?:text|line below) to (\w+)')
+_NUMBERED_LINE = re.compile(r'^\s*(\d+)\.\s*(.*)$')
+
+_VOCAB_SIZE = 32000
+_LATIN_WORDS = ("the", "a", "of", "and", "to", "in", "is", "it", "that", "was", "you", "for", "on", "are",
+                "with", "as", "this", "be", "at", "have", "from", "or", "one", "had", "by", "word", "but",
+                "not", "what", "all", "were", "we", "when", "your", "can", "said", "there", "use", "an")
+_CYRILLIC_WORDS = ("и", "в", "не", "на", "я", "быть", "он", "с", "что", "а", "по", "это", "она", "этот")
+_ARABIC_WORDS = ("في", "من", "على", "إلى", "هذا", "كان", "قد", "لا", "ما", "هو")
+_DEVANAGARI_WORDS = ("का", "के", "है", "में", "की", "और", "को", "से", "यह", "पर")
+
+
+def tokenize(text):
+    """确定性的伪分词：CJK 按字、拉丁字母按词、其余按字符，token id 取 crc32"""
+    return [zlib.crc32(piece.encode('utf-8')) % _VOCAB_SIZE for piece in _TOKEN_PATTERN.findall(text)]
+
+
+def _fake_word(target, seed):
+    if target == 'Chinese':
+        return chr(0x4e00 + seed % 0x5000)
+    if target == 'Japanese':
+        # 以假名为主，夹杂少量汉字，通过目标语言占比验证
+        return chr(0x4e00 + seed % 0x5000) if seed % 4 == 0 else chr(0x3041 + seed % 86)
+    if target == 'Korean':
+        return chr(0xac00 + seed % 11172)
+    if target == 'Russian':
+        return _CYRILLIC_WORDS[seed % len(_CYRILLIC_WORDS)] + " "
+    if target == 'Arabic':
+        return _ARABIC_WORDS[seed % len(_ARABIC_WORDS)] + " "
+    if target == 'Hindi':
+        return _DEVANAGARI_WORDS[seed % len(_DEVANAGARI_WORDS)] + " "
+    return _LATIN_WORDS[seed % len(_LATIN_WORDS)] + " "
+
+
+def fake_translation(text, target):
+    """按源文本逐 token 生成目标语言文字，相同输入总是得到相同输出，长度与源文本 token 数成正比"""
+    pieces = [p for p in _TOKEN_PATTERN.findall(text) if not p.isspace()]
+    if not pieces:
+        return ""
+    words = [_fake_word(target, zlib.crc32(p.encode('utf-8'))) for p in pieces]
+    out = "".join(words).strip()
+    if target not in ('Chinese', 'Japanese', 'Korean'):
+        out = out[:1].upper() + out[1:] + "."
+    else:
+        out += "。"
+    return out
+
+
+def _message_text(content):
+    if isinstance(content, list):
+        return "".join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def fake_reply(messages):
+    """从提示词中解析目标语言与待翻译文本（单条或编号打包），返回伪译文"""
+    system = "\n".join(_message_text(m.get('content')) for m in messages if m.get('role') == 'system')
+    user = next((_message_text(m.get('content')) for m in reversed(messages) if m.get('role') == 'user'), "")
+    match = _LANG_PATTERN.search(user) or _LANG_PATTERN.search(system)
+    target = match.group(1) if match else 'Chinese'
+
+    numbered = [m for m in (_NUMBERED_LINE.match(line) for line in user.splitlines()) if m]
+    if "numbered" in user and numbered:
+        return "\n".join(f"{m.group(1)}. {fake_translation(m.group(2), target)}" for m in numbered)
+    # 末段为 "<源语言>: 文本"，其前可能有 Context 与翻译指令
+    last_block = user.strip().split("\n\n")[-1]
+    source = last_block.split(": ", 1)[1] if ": " in last_block else last_block
+    return fake_translation(source, target)
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    k = 0
+    while k < n and a[k] == b[k]:
+        k += 1
+    return k
+
+
+class MockState:
+    """服务器共享状态：并行槽（各自缓存的 prompt token）、累计指标、故障注入与录制回放"""
+
+    def __init__(self, args):
+        self.args = args
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.slot_tokens = [[] for _ in range(args.parallel)]
+        self.slot_busy = [False] * args.parallel
+        self.slot_free = threading.Condition(self.lock)
+        self.requests = 0
+        self.deferred = 0
+        self.metrics = {
+            'prompt_tokens_total': 0, 'prompt_seconds_total': 0.0,
+            'tokens_predicted_total': 0, 'tokens_predicted_seconds_total': 0.0,
+            'n_decode_total': 0,
+        }
+        self.replay = {}
+        if args.mock_replay:
+            with open(args.mock_replay, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.replay[record['key']] = record['content']
+            print(f"[模拟服务器] 已加载 {len(self.replay)} 条回放记录: {args.mock_replay}", flush=True)
+        self.record_lock = threading.Lock()
+
+    @property
+    def loading(self):
+        return time.time() - self.started_at < self.args.mock_load_time
+
+    def next_request(self):
+        with self.lock:
+            self.requests += 1
+            return self.requests
+
+    def acquire_slot(self, prompt, id_slot=None):
+        """选择空闲槽：指定 id_slot 时等待该槽，否则选与缓存前缀重合最长的空闲槽；返回 (槽号, 复用 token 数)"""
+        with self.lock:
+            waited = False
+            while True:
+                if id_slot is not None and 0 <= id_slot < len(self.slot_busy):
+                    candidates = [id_slot] if not self.slot_busy[id_slot] else []
+                else:
+                    candidates = [k for k, busy in enumerate(self.slot_busy) if not busy]
+                if candidates:
+                    break
+                if not waited:
+                    self.deferred += 1
+                    waited = True
+                self.slot_free.wait()
+            if waited:
+                self.deferred -= 1
+            slot = max(candidates, key=lambda k: _common_prefix(self.slot_tokens[k], prompt))
+            self.slot_busy[slot] = True
+            # 至少重新计算最后一个 token，与 llama-server 一致
+            return slot, min(_common_prefix(self.slot_tokens[slot], prompt), max(0, len(prompt) - 1))
+
+    def release_slot(self, slot, tokens):
+        with self.lock:
+            self.slot_tokens[slot] = tokens
+            self.slot_busy[slot] = False
+            self.slot_free.notify_all()
+
+    def record_session(self, key, content):
+        with self.record_lock:
+            with open(self.args.mock_record, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'content': content}, ensure_ascii=False) + "\n")
+
+
+def _request_key(params):
+    """回放匹配键：消息列表与影响输出的采样参数"""
+    keyed = {k: params.get(k) for k in ('messages', 'n_predict', 'temperature', 'top_k', 'top_p', 'grammar')}
+    return format(zlib.crc32(json.dumps(keyed, ensure_ascii=False, sort_keys=True).encode('utf-8')), '08x')
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def log_message(self, fmt, *args):
+        if self.state.args.verbose:
+            sys.stderr.write("[模拟服务器] " + (fmt % args) + "\n")
+
+    # ---- 通用 ----
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_type="server_error"):
+        self._send_json(status, {"error": {"code": status, "message": message, "type": error_type}})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return None
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            if self.state.loading:
+                self._send_error(503, "Loading model", "unavailable_error")
+            else:
+                self._send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            self._handle_metrics()
+        elif path == "/slots":
+            with self.state.lock:
+                slots = [{"id": k, "is_processing": busy, "n_ctx": self.state.args.ctx_size // len(self.state.slot_busy),
+                          "n_cached": len(tokens)}
+                         for k, (busy, tokens) in enumerate(zip(self.state.slot_busy, self.state.slot_tokens))]
+            self._send_json(200, slots)
+        else:
+            self._send_error(404, "File Not Found", "not_found_error")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = self._read_json()
+        if params is None:
+            self._send_error(400, "Invalid JSON", "invalid_request_error")
+            return
+        if self.state.loading:
+            self._send_error(503, "Loading model", "unavailable_error")
+            return
+        if url.path in ("/v1/chat/completions", "/chat/completions"):
+            self._handle_chat(params)
+        elif url.path == "/tokenize":
+            self._send_json(200, {"tokens": tokenize(params.get("content", ""))})
+        elif url.path.startswith("/slots/"):
+            self._handle_slot_action(url, params)
+        else:
+            self._send_error(404, "File Not Found", "not_found_error")
+
+    # ---- /v1/chat/completions ----
+
+    def _inject_faults(self, request_no, rng):
+        """按配置注入崩溃、超时与失败，返回 True 表示已处理本次请求"""
+        args = self.state.args
+        if args.mock_crash_after and request_no > args.mock_crash_after:
+            print(f"[模拟服务器] 第 {request_no} 个请求触发模拟崩溃", flush=True)
+            os._exit(1)
+        if args.mock_timeout_rate and rng.random() < args.mock_timeout_rate:
+            time.sleep(args.mock_hang)
+        if args.mock_fail_rate and rng.random() < args.mock_fail_rate:
+            self._send_error(500, "Injected failure")
+            return True
+        return False
+
+    def _generate(self, params):
+        if self.state.replay:
+            content = self.state.replay.get(_request_key(params))
+            if content is not None:
+                return content
+        if self.state.args.mock_upstream:
+            return self._forward(params)
+        return fake_reply(params.get("messages", []))
+
+    def _forward(self, params):
+        """转发到真实服务器（非流式），录制模式下保存结果"""
+        upstream = dict(params)
+        upstream.pop("stream", None)
+        request = urllib.request.Request(
+            self.state.args.mock_upstream.rstrip("/") + "/v1/chat/completions",
+            data=json.dumps(upstream, ensure_ascii=False).encode('utf-8'),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=600) as response:
+            data = json.loads(response.read().decode('utf-8'))
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if self.state.args.mock_record:
+            self.state.record_session(_request_key(params), content)
+        return content
+
+    def _handle_chat(self, params):
+        state = self.state
+        args = state.args
+        request_no = state.next_request()
+        rng = random.Random(f"{args.mock_seed}:{_request_key(params)}:{request_no}")
+        if self._inject_faults(request_no, rng):
+            return
+
+        messages = params.get("messages", [])
+        prompt = tokenize("".join(_message_text(m.get('content')) for m in messages))
+        id_slot = params.get("id_slot")
+        slot, cache_n = state.acquire_slot(prompt, id_slot if isinstance(id_slot, int) and id_slot >= 0 else None)
+        try:
+            prompt_n = len(prompt) - cache_n
+            prompt_start = time.time()
+            time.sleep(prompt_n * args.mock_prompt_latency)
+            prompt_ms = (time.time() - prompt_start) * 1000
+
+            try:
+                content = self._generate(params)
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                self._send_error(502, f"Upstream request failed: {e}")
+                return
+            pieces = _TOKEN_PATTERN.findall(content)
+            n_predict = int(params.get("n_predict", params.get("max_tokens", -1)) or -1)
+            finish_reason = "stop"
+            if 0 <= n_predict < len(pieces):
+                pieces = pieces[:n_predict]
+                finish_reason = "length"
+
+            generate_start = time.time()
+            if params.get("stream"):
+                completed = self._stream(pieces, finish_reason, prompt_n, cache_n, prompt_ms, generate_start)
+            else:
+                time.sleep(len(pieces) * args.mock_gen_latency)
+                completed = len(pieces)
+                timings = self._timings(prompt_n, cache_n, prompt_ms, completed, generate_start)
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{request_no}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": args.model,
+                    "choices": [{"index": 0, "finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": "".join(pieces)}}],
+                    "usage": {"prompt_tokens": len(prompt), "completion_tokens": completed,
+                              "total_tokens": len(prompt) + completed},
+                    "timings": timings,
+                })
+            with state.lock:
+                state.metrics['prompt_tokens_total'] += prompt_n
+                state.metrics['prompt_seconds_total'] += prompt_ms / 1000
+                state.metrics['tokens_predicted_total'] += completed
+                state.metrics['tokens_predicted_seconds_total'] += time.time() - generate_start
+                state.metrics['n_decode_total'] += completed + (1 if prompt_n else 0)
+        finally:
+            state.release_slot(slot, prompt)
+
+    @staticmethod
+    def _timings(prompt_n, cache_n, prompt_ms, predicted_n, generate_start):
+        predicted_ms = (time.time() - generate_start) * 1000
+        return {
+            "cache_n": cache_n,
+            "prompt_n": prompt_n,
+            "prompt_ms": prompt_ms,
+            "prompt_per_second": prompt_n / prompt_ms * 1000 if prompt_ms else 0.0,
+            "predicted_n": predicted_n,
+            "predicted_ms": predicted_ms,
+            "predicted_per_second": predicted_n / predicted_ms * 1000 if predicted_ms else 0.0,
+        }
+
+    def _sse(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        chunk = f"data: {data}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(chunk):x}\r\n".encode('ascii') + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, pieces, finish_reason, prompt_n, cache_n, prompt_ms, generate_start):
+        """逐 token 发送 SSE 数据块；客户端断开（流式中止）时停止生成，返回已生成 token 数"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        generated = 0
+        try:
+            for piece in pieces:
+                time.sleep(self.state.args.mock_gen_latency)
+                self._sse({"choices": [{"index": 0, "finish_reason": None, "delta": {"content": piece}}],
+                           "object": "chat.completion.chunk"})
+                generated += 1
+            self._sse({"choices": [{"index": 0, "finish_reason": finish_reason, "delta": {}}],
+                       "object": "chat.completion.chunk",
+                       "timings": self._timings(prompt_n, cache_n, prompt_ms, generated, generate_start)})
+            self._sse("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        return generated
+
+    # ---- /slots 与 /metrics ----
+
+    def _handle_slot_action(self, url, params):
+        state = self.state
+        # 与 llama-server 一致：未指定 --slot-save-path 时所有槽位操作（包括 erase）都返回 501
+        if not state.args.slot_save_path:
+            self._send_error(501, "This server does not support slot action", "not_supported_error")
+            return
+        try:
+            slot = int(url.path.rsplit("/", 1)[1])
+        except ValueError:
+            self._send_error(400, "Invalid slot id", "invalid_request_error")
+            return
+        action = parse_qs(url.query).get("action", [""])[0]
+        if not 0 <= slot < len(state.slot_tokens):
+            self._send_error(400, "Invalid slot id", "invalid_request_error")
+            return
+        if action == "erase":
+            with state.lock:
+                n_erased = len(state.slot_tokens[slot])
+                state.slot_tokens[slot] = []
+            self._send_json(200, {"id_slot": slot, "n_erased": n_erased})
+            return
+        if action not in ("save", "restore"):
+            self._send_error(400, "Invalid action", "invalid_request_error")
+            return
+        filename = (params or {}).get("filename", "")
+        if not filename or os.path.basename(filename) != filename:
+            self._send_error(400, "Invalid filename", "invalid_request_error")
+            return
+        path = os.path.join(state.args.slot_save_path, filename)
+        start_time = time.time()
+        if action == "save":
+            with state.lock:
+                tokens = list(state.slot_tokens[slot])
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(tokens, f)
+            self._send_json(200, {"id_slot": slot, "filename": filename, "n_saved": len(tokens),
+                                  "timings": {"save_ms": (time.time() - start_time) * 1000}})
+        else:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    tokens = json.load(f)
+            except (OSError, ValueError):
+                self._send_error(400, "Unable to restore slot, no available space in KV cache or invalid slot save file",
+                                 "invalid_request_error")
+                return
+            with state.lock:
+                state.slot_tokens[slot] = tokens
+            self._send_json(200, {"id_slot": slot, "filename": filename, "n_restored": len(tokens),
+                                  "timings": {"restore_ms": (time.time() - start_time) * 1000}})
+
+    def _handle_metrics(self):
+        state = self.state
+        if not state.args.metrics:
+            self._send_error(501, "This server does not support metrics endpoint, start it with `--metrics`",
+                             "not_supported_error")
+            return
+        with state.lock:
+            m = dict(state.metrics)
+            busy = sum(state.slot_busy)
+            deferred = state.deferred
+            kv_tokens = sum(len(tokens) for tokens in state.slot_tokens)
+        lines = []
+        for name, kind, value, help_text in (
+            ("prompt_tokens_total", "counter", m['prompt_tokens_total'], "Number of prompt tokens processed."),
+            ("prompt_seconds_total", "counter", m['prompt_seconds_total'], "Prompt process time"),
+            ("tokens_predicted_total", "counter", m['tokens_predicted_total'], "Number of generation tokens processed."),
+            ("tokens_predicted_seconds_total", "counter", m['tokens_predicted_seconds_total'], "Predict process time"),
+            ("n_decode_total", "counter", m['n_decode_total'], "Total number of llama_decode() calls"),
+            ("prompt_tokens_seconds", "gauge",
+             m['prompt_tokens_total'] / m['prompt_seconds_total'] if m['prompt_seconds_total'] else 0.0,
+             "Average prompt throughput in tokens/s."),
+            ("predicted_tokens_seconds", "gauge",
+             m['tokens_predicted_total'] / m['tokens_predicted_seconds_total'] if m['tokens_predicted_seconds_total'] else 0.0,
+             "Average generation throughput in tokens/s."),
+            ("kv_cache_usage_ratio", "gauge", min(1.0, kv_tokens / state.args.ctx_size) if state.args.ctx_size else 0.0,
+             "KV-cache usage. 1 means 100 percent usage."),
+            ("kv_cache_tokens", "gauge", kv_tokens, "KV-cache tokens."),
+            ("requests_processing", "gauge", busy, "Number of requests processing."),
+            ("requests_deferred", "gauge", deferred, "Number of requests deferred."),
+        ):
+            lines += [f"# HELP llamacpp:{name} {help_text}", f"# TYPE llamacpp:{name} {kind}", f"llamacpp:{name} {value}"]
+        body = ("\n".join(lines) + "\n").encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="llama-server 模拟服务器（离线测试与压测）")
+    # 与 llama-server 相同的参数，其余 llama-server 参数忽略
+    parser.add_argument("-m", "--model", default="mock.gguf")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-c", "--ctx-size", dest="ctx_size", type=int, default=4096)
+    parser.add_argument("-np", "--parallel", type=int, default=1)
+    parser.add_argument("--slot-save-path", dest="slot_save_path", default=None)
+    parser.add_argument("--metrics", action="store_true")
+    # 模拟参数
+    parser.add_argument("--mock-prompt-latency", type=float, default=0.0002, help="每个 prompt token 的计算延迟（秒）")
+    parser.add_argument("--mock-gen-latency", type=float, default=0.002, help="每个生成 token 的延迟（秒）")
+    parser.add_argument("--mock-load-time", type=float, default=0.0, help="启动后 /health 返回 503 的时长（秒）")
+    parser.add_argument("--mock-fail-rate", type=float, default=0.0, help="聊天请求返回 HTTP 500 的概率")
+    parser.add_argument("--mock-timeout-rate", type=float, default=0.0, help="聊天请求挂起 --mock-hang 秒的概率")
+    parser.add_argument("--mock-hang", type=float, default=300.0, help="模拟超时的挂起时长（秒）")
+    parser.add_argument("--mock-crash-after", type=int, default=0, help="处理该数量的聊天请求后进程退出，0 表示不崩溃")
+    parser.add_argument("--mock-seed", type=int, default=0, help="故障注入的随机种子")
+    parser.add_argument("--mock-upstream", default=None, help="转发到真实 llama-server 的地址（配合 --mock-record 录制）")
+    parser.add_argument("--mock-record", default=None, help="录制转发结果的 JSONL 文件")
+    parser.add_argument("--mock-replay", default=None, help="回放录制的 JSONL 文件，未命中的请求返回伪译文")
+    parser.add_argument("--verbose", action="store_true")
+    args, _ = parser.parse_known_args(argv)
+    args.parallel = max(1, args.parallel)
+    if args.slot_save_path:
+        os.makedirs(args.slot_save_path, exist_ok=True)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    MockHandler.state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"[模拟服务器] 监听 {args.host}:{args.port}，{args.parallel} 个并行槽，模型 {args.model}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+模型注册表模块
+扫描一次 models/ 目录与 llama_cpp/ 目录，将模型目录、GGUF 文件（路径、大小、mtime、量化版本）
+和 llama-server 可执行文件写入清单；之后的查找都走内存索引，仅按目录 mtime 判断是否需要重新扫描，
+避免每次构建翻译器或处理视频时重复列目录和递归 glob（模型目录位于网络存储时尤其明显）
+
+本模块不依赖 config，供 config 在导入时创建；首次查询时才读取清单或扫描目录
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+MANIFEST_VERSION = 1
+
+SERVER_EXECUTABLES = ("llama-server.exe",)
+
+_QUANT_PATTERN = re.compile(r'(?i)(?:^|[-_.])(I?Q\d(?:_[A-Z0-9]+)*|BF16|F16|F32)(?=[-_.]|$)')
+
+
+def parse_quantization(filename: str) -> Optional[str]:
+    """从 GGUF 文件名中解析量化版本（如 Q8_0、Q4_K_M），无法识别时返回 None"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    matches = _QUANT_PATTERN.findall(stem)
+    return matches[-1].upper() if matches else None
+
+
+class ModelRegistry:
+    """模型注册表：清单持久化到磁盘，进程内按最小间隔复查目录 mtime"""
+
+    def __init__(self, models_dir: str, manifest_path: str, server_dir: Optional[str] = None,
+                 revalidate_interval: float = 10.0):
+        self.models_dir = models_dir
+        self.server_dir = server_dir
+        self.manifest_path = manifest_path
+        self.revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._validated_at = 0.0
+
+    # ---- 扫描与清单 ----
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _scan(self) -> Dict[str, Any]:
+        start_time = time.time()
+        dirs = {}
+        entries = []
+        for root in (self.models_dir, self.server_dir):
+            if not root or not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                dirs[dirpath] = self._mtime(dirpath)
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if root == self.models_dir and name.lower().endswith(".gguf"):
+                        entry_type = "gguf"
+                    elif root == self.server_dir and name in SERVER_EXECUTABLES:
+                        entry_type = "llama_server"
+                    else:
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append({
+                        'path': path,
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime,
+                        'type': entry_type,
+                        'quantization': parse_quantization(name) if entry_type == "gguf" else None,
+                    })
+
+        if self.models_dir and os.path.isdir(self.models_dir):
+            for name in sorted(os.listdir(self.models_dir)):
+                path = os.path.join(self.models_dir, name)
+                if os.path.isdir(path):
+                    entries.append({
+                        'path': path,
+                        'size': 0,
+                        'mtime': dirs.get(path, self._mtime(path)),
+                        'type': "model_dir",
+                        'quantization': None,
+                    })
+
+        entries.sort(key=lambda e: e['path'])
+        _logger.debug("[模型注册表] 扫描完成: %d 项, %d 个目录, 耗时 %.2fs", len(entries), len(dirs), time.time() - start_time)
+        return {
+            'version': MANIFEST_VERSION,
+            'models_dir': self.models_dir,
+            'server_dir': self.server_dir,
+            'dirs': dirs,
+            'entries': entries,
+        }
+
+    def _load_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get('version') != MANIFEST_VERSION or manifest.get('models_dir') != self.models_dir
+                or manifest.get('server_dir') != self.server_dir):
+            return None
+        return manifest
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"[模型注册表] 保存清单失败: {e}")
+
+    def _is_current(self, manifest: Dict[str, Any]) -> bool:
+        """目录中增删文件会改变该目录的 mtime，逐个比较清单记录的目录即可判断是否过期"""
+        for root in (self.models_dir, self.server_dir):
+            if root and os.path.isdir(root) and root not in manifest['dirs']:
+                return False
+        return all(self._mtime(path) == mtime for path, mtime in manifest['dirs'].items())
+
+    def _current(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            if self._manifest is not None and now - self._validated_at < self.revalidate_interval:
+                return self._manifest
+            manifest = self._manifest or self._load_manifest()
+            if manifest is None or not self._is_current(manifest):
+                manifest = self._scan()
+                self._save_manifest(manifest)
+            self._manifest = manifest
+            self._validated_at = now
+            return manifest
+
+    def refresh(self):
+        """强制重新扫描（例如下载模型后）"""
+        with self._lock:
+            self._manifest = self._scan()
+            self._save_manifest(self._manifest)
+            self._validated_at = time.time()
+
+    # ---- 查询 ----
+
+    def entries(self, entry_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [dict(e) for e in self._current()['entries'] if entry_type is None or e['type'] == entry_type]
+
+    def model_dir_names(self) -> List[str]:
+        """models/ 下的顶层目录名"""
+        return [os.path.basename(e['path']) for e in self.entries("model_dir")]
+
+    def find_dir(self, *parts: str) -> Optional[str]:
+        """models/ 下的相对目录存在时返回其完整路径"""
+        path = os.path.join(self.models_dir, *parts)
+        return path if path in self._current()['dirs'] else None
+
+    def subdirs(self, *parts: str) -> List[str]:
+        """models/ 下某目录的直接子目录（按名称排序）"""
+        parent = os.path.join(self.models_dir, *parts)
+        return sorted(p for p in self._current()['dirs'] if os.path.dirname(p) == parent)
+
+    def gguf_files(self, directory: Optional[str] = None) -> List[Dict[str, Any]]:
+        """GGUF 文件条目；指定 directory 时只返回该目录下（不递归）的文件"""
+        files = self.entries("gguf")
+        if directory is not None:
+            files = [e for e in files if os.path.dirname(e['path']) == directory]
+        return files
+
+    def find_gguf(self, name: str) -> Optional[str]:
+        """按路径、文件名或相对 models/ 的路径片段查找 GGUF 文件；多个匹配时取最小的文件"""
+        if os.path.isabs(name) and os.path.isfile(name):
+            return name
+        needle = name.replace("\\", "/").lower()
+        matches = [
+            e for e in self.entries("gguf")
+            if needle in os.path.relpath(e['path'], self.models_dir).replace("\\", "/").lower()
+        ]
+        if not matches:
+            return None
+        return min(matches, key=lambda e: e['size'])['path']
+
+    def find_server(self, preferred: Optional[List[str]] = None) -> Optional[str]:
+        servers = [e['path'] for e in self.entries("llama_server")]
+        for path in preferred or []:
+            if path in servers:
+                return path
+        return servers[0] if servers else None
+
+
+__all__ = ['ModelRegistry', 'parse_quantization']
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+翻译输出约束模块
+为 llama-server 请求生成 GBNF 语法：单行输出（打包请求为逐行编号格式），
+CJK 目标语言禁止以拉丁字母开头（杜绝 "Chinese:" 前缀与回显指令），
+并在可行时排除不属于目标语言的文字（如日译中时的假名）；
+同时累计有/无约束时的验证失败率，便于比较约束效果
+"""
+
+import os
+import json
+import threading
+
+from config import CACHE_DIR
+
+
+_HIRAGANA = "\\u3041-\\u3096"
+_KATAKANA = "\\u30a1-\\u30fa"
+_HANGUL = "\\uac00-\\ud7af\\u1100-\\u11ff\\u3130-\\u318f"
+_CJK_IDEOGRAPHS = "\\u4e00-\\u9fff"
+
+_CJK_TARGETS = {'zh', 'ja', 'ko'}
+_LATIN_TARGETS = {'en', 'fr', 'de', 'es', 'pt', 'it', 'nl', 'pl'}
+
+
+def _excluded_ranges(source_lang, target_lang):
+    """返回目标语言译文中不应出现的字符范围（GBNF 字符类写法）"""
+    if target_lang == 'zh':
+        return _HIRAGANA + _KATAKANA + (_HANGUL if source_lang == 'ko' else "")
+    if target_lang == 'ko':
+        return _HIRAGANA + _KATAKANA
+    if target_lang in _LATIN_TARGETS:
+        return _HIRAGANA + _KATAKANA + _HANGUL + _CJK_IDEOGRAPHS
+    return ""
+
+
+def _line_rules(source_lang, target_lang):
+    excluded = _excluded_ranges(source_lang, target_lang)
+    first_excluded = excluded + "\\t "
+    if target_lang in _CJK_TARGETS:
+        first_excluded += "a-zA-Z:："
+    return [
+        f"line ::= first rest*",
+        f"first ::= [^\\n\\r{first_excluded}]",
+        f"rest ::= [^\\n\\r{excluded}]",
+    ]
+
+
+def build_line_grammar(source_lang, target_lang):
+    """单条翻译：只允许输出一行目标语言文本"""
+    return "\n".join(["root ::= line"] + _line_rules(source_lang, target_lang))
+
+
+def build_packed_grammar(num_lines, source_lang, target_lang):
+    """打包翻译：严格输出 1..num_lines 编号行，每行一条译文"""
+    parts = []
+    for n in range(1, num_lines + 1):
+        parts.append(f'"{n}. " line')
+        if n < num_lines:
+            parts.append('"\\n"')
+    return "\n".join([f"root ::= {' '.join(parts)}"] + _line_rules(source_lang, target_lang))
+
+
+class ConstraintStats:
+    """按 有约束 / 无约束 累计验证次数与失败次数，同时保留本次运行与历史累计结果"""
+
+    MODES = ("constrained", "unconstrained")
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "output_constraint_stats.json")
+        self._lock = threading.Lock()
+        self.session = {mode: {'total': 0, 'failed': 0} for mode in self.MODES}
+        self.cumulative = {mode: {'total': 0, 'failed': 0} for mode in self.MODES}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for mode in self.MODES:
+                if mode in saved:
+                    self.cumulative[mode]['total'] = int(saved[mode].get('total', 0))
+                    self.cumulative[mode]['failed'] = int(saved[mode].get('failed', 0))
+        except (OSError, ValueError):
+            pass
+
+    def record(self, constrained: bool, valid: bool):
+        mode = "constrained" if constrained else "unconstrained"
+        with self._lock:
+            for bucket in (self.session, self.cumulative):
+                bucket[mode]['total'] += 1
+                if not valid:
+                    bucket[mode]['failed'] += 1
+
+    @staticmethod
+    def _rate(counts):
+        return counts['failed'] / counts['total'] if counts['total'] else 0.0
+
+    def summary(self) -> str:
+        lines = []
+        for mode, label in (("constrained", "有约束"), ("unconstrained", "无约束")):
+            s = self.session[mode]
+            c = self.cumulative[mode]
+            lines.append(
+                f"{label}: 本次 {s['failed']}/{s['total']} 失败 ({self._rate(s):.1%}), "
+                f"累计 {c['failed']}/{c['total']} 失败 ({self._rate(c):.1%})"
+            )
+        return "; ".join(lines)
+
+    def save(self):
+        with self._lock:
+            data = {mode: dict(self.cumulative[mode]) for mode in self.MODES}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"[输出约束] 保存统计失败: {e}")
+
+
+__all__ = ['build_line_grammar', 'build_packed_grammar', 'ConstraintStats']
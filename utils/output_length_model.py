@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+译文长度模型模块
+按（翻译模型, 语言对）记录验证通过的翻译的 输出/输入 token 比例（保留最近若干个样本），
+用高分位数加余量估计 n_predict：短句不再一律预留 64 token，
+CJK→拉丁语系的长句也不会被 2×字符数 的固定规则截断；样本持久化到 cache 目录。
+比例以模型 token 计，不同分词器的样本互不通用，因此按翻译模型分开保存
+"""
+
+import os
+import json
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from config import CACHE_DIR
+
+
+# 分位数上再乘的余量系数与附加 token 数，吸收比例估计误差与结尾标点
+_MARGIN_FACTOR = 1.15
+_MARGIN_TOKENS = 8
+
+
+class OutputLengthModel:
+    """每个（翻译模型, 语言对）保留最近 window 个比例样本，样本数达到 min_samples 前不做预测"""
+
+    def __init__(self, path=None, window=512, min_samples=20):
+        self.path = path or os.path.join(CACHE_DIR, "output_length_model.json")
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._sorted: Dict[str, list] = {}
+        self.session_records = 0
+        self.predictions = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for pair, ratios in saved.items():
+                # 旧版本只按语言对保存，样本可能混有不同分词器的比例，直接丢弃
+                if "|" not in pair:
+                    continue
+                self._samples[pair] = deque((float(r) for r in ratios), maxlen=window)
+        except (OSError, ValueError, TypeError):
+            pass
+
+    @staticmethod
+    def _pair(source_lang, target_lang, model=""):
+        return f"{model}|{source_lang}->{target_lang}"
+
+    def record(self, source_lang, target_lang, input_tokens: int, output_tokens: int, model: str = ""):
+        if input_tokens <= 0 or output_tokens <= 0:
+            return
+        pair = self._pair(source_lang, target_lang, model)
+        with self._lock:
+            samples = self._samples.get(pair)
+            if samples is None:
+                samples = self._samples[pair] = deque(maxlen=self.window)
+            samples.append(output_tokens / input_tokens)
+            self._sorted.pop(pair, None)
+            self.session_records += 1
+
+    def quantile(self, source_lang, target_lang, q: float, model: str = "") -> Optional[float]:
+        """比例样本的 q 分位数，样本不足时返回 None"""
+        pair = self._pair(source_lang, target_lang, model)
+        with self._lock:
+            samples = self._samples.get(pair)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = self._sorted.get(pair)
+            if ordered is None:
+                ordered = self._sorted[pair] = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def predict(self, source_lang, target_lang, input_tokens: int, q: float = 0.95, model: str = "") -> Optional[int]:
+        """估计译文 token 数上限：input_tokens × 比例分位数 × 余量 + 附加 token"""
+        ratio = self.quantile(source_lang, target_lang, q, model)
+        if ratio is None:
+            return None
+        self.predictions += 1
+        return int(math.ceil(max(1, input_tokens) * ratio * _MARGIN_FACTOR)) + _MARGIN_TOKENS
+
+    def summary(self, source_lang, target_lang, q: float = 0.95, model: str = "") -> str:
+        pair = self._pair(source_lang, target_lang, model)
+        with self._lock:
+            count = len(self._samples.get(pair, ()))
+        ratio = self.quantile(source_lang, target_lang, q, model)
+        if ratio is None:
+            return f"{pair}: 样本 {count}/{self.min_samples}，暂用固定规则"
+        return (f"{pair}: 样本 {count}, {q:.0%} 分位比例 {ratio:.2f}, "
+                f"本次新增 {self.session_records} 个样本, 预测 {self.predictions} 次")
+
+    def save(self):
+        with self._lock:
+            data = {pair: [round(r, 4) for r in samples] for pair, samples in self._samples.items()}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"[长度模型] 保存样本失败: {e}")
+
+
+__all__ = ['OutputLengthModel']
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+翻译提示词构建模块
+classic 布局保持原有提示词；prefix_cache 布局面向 llama-server 的 prompt 缓存：
+固定的系统提示词与翻译指令放在最前，聊天历史只追加、满块后整体重置，
+上下文与待翻译文本等可变部分放在末尾，使相邻请求共享尽可能长的前缀
+"""
+
+
+PROMPT_LAYOUTS = ("classic", "prefix_cache")
+
+
+class PromptBuilder:
+    def __init__(self, system_prompt: str, layout: str = "classic"):
+        self.base_system_prompt = system_prompt
+        self.layout = layout if layout in PROMPT_LAYOUTS else "classic"
+
+    @staticmethod
+    def instruction(source_lang_name, target_lang_name):
+        return f"Translate the following {source_lang_name} text to {target_lang_name}. Only output the translation, nothing else."
+
+    def system_content(self, source_lang_name, target_lang_name):
+        if self.layout == "prefix_cache":
+            return f"{self.base_system_prompt}\n\n{self.instruction(source_lang_name, target_lang_name)}"
+        return self.base_system_prompt
+
+    def user_content(self, processed_text, source_lang_name, target_lang_name, context=None):
+        if self.layout == "prefix_cache":
+            if context:
+                return f"Context: {context}\n\n{source_lang_name}: {processed_text}"
+            return f"{source_lang_name}: {processed_text}"
+        instruction = self.instruction(source_lang_name, target_lang_name)
+        if context:
+            return f"Context: {context}\n\n{instruction}\n\n{source_lang_name}: {processed_text}"
+        return f"{instruction}\n\n{source_lang_name}: {processed_text}"
+
+    @staticmethod
+    def history_entry(processed_text, translation, source_lang_name):
+        return [
+            {"role": "user", "content": f"{source_lang_name}: {processed_text}"},
+            {"role": "assistant", "content": translation},
+        ]
+
+    def trim_history(self, history, max_pairs):
+        """限制聊天历史长度
+
+        classic 每次滑动保留最近 max_pairs 对；prefix_cache 允许增长到 2 * max_pairs 对后
+        一次性截断为最近 max_pairs 对，两次截断之间的请求前缀保持不变
+        """
+        max_messages = max_pairs * 2
+        if max_messages <= 0:
+            return []
+        if self.layout == "prefix_cache":
+            if len(history) > max_messages * 2:
+                return history[-max_messages:]
+            return history
+        if len(history) > max_messages:
+            return history[-max_messages:]
+        return history
+
+
+__all__ = ['PromptBuilder', 'PROMPT_LAYOUTS']
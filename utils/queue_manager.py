@@ -5,6 +5,8 @@ import os
 import time
 import gc
 import threading
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, List, Optional, Tuple
 try:
     import torch
 except ImportError:
@@ -12,14 +14,18 @@ except ImportError:
 
 
 
-from config import MODEL_OPTIONS, TEMP_DIR, OUTPUT_DIR, config, CdParams, TransParams, ServerParams, PARAM_DEFINITIONS
+from config import get_available_models, TEMP_DIR, OUTPUT_DIR, PROJECT_ROOT, config, CdParams, TransParams, ServerParams, PARAM_DEFINITIONS
 from utils.video_processor import extract_audio
 from utils.speech_recognizer import recognize_speech_enhanced, clear_model_cache
-from utils.translator import translate_text, clear_translator_cache
+from utils.translator import translate_text, clear_translator_cache, PipelinedTranslation
 from utils.subtitle_generator import generate_subtitle, generate_translated_subtitle, generate_bilingual_subtitle
+from utils.server_telemetry import ServerTelemetry
+from utils.stage_scheduler import StageScheduler
+from utils.recognition_worker import get_worker_pool
 
 VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.mpg', '.mpeg', '.ts']
 MAX_FILE_SIZE = 10 * 1024 * 1024 * 1024
+TELEMETRY_DIR = os.path.join(PROJECT_ROOT, "logs", "telemetry")
 
 def _cleanup_gpu_memory():
     gc.collect()
@@ -41,13 +47,32 @@ def convert_numpy(obj):
         return obj
 
 
+@dataclass
+class VideoJob:
+    """单个视频在各处理阶段之间传递的状态；result 非空表示任务已结束（成功、失败或取消）"""
+    video_file: str
+    params: Dict[str, Any]
+    index: int = 0
+    output_dir: str = OUTPUT_DIR
+    temp_files: List[str] = field(default_factory=list)
+    telemetry: Optional[ServerTelemetry] = None
+    outcome: str = "失败"
+    start: float = 0.0
+    recognize_config: Optional[Dict[str, Any]] = None
+    translate_config: Optional[Dict[str, Any]] = None
+    audio_path: Optional[str] = None
+    recognized: Any = None
+    pipeline: Optional[PipelinedTranslation] = None
+    result: Optional[Tuple[bool, str, Optional[List[str]]]] = None
+
+
 class VideoProcessorPipeline:
     """视频处理管线：负责单个视频的完整处理流程"""
 
     def __init__(self, add_print_callback=None, check_cancelled_fn=None, cleanup_fn=None):
         self._add_print = add_print_callback or (lambda msg: None)
         self._check_cancelled = check_cancelled_fn or (lambda: False)
-        self._cleanup = cleanup_fn or (lambda device='cpu': None)
+        self._cleanup = cleanup_fn or (lambda device='cpu': _cleanup_gpu_memory())
 
     def _step_extract_audio(self, video_path, output_dir, progress_cb):
         print("[阶段] 1. 提取音频")
@@ -57,7 +82,7 @@ class VideoProcessorPipeline:
         progress_cb(f"音频提取完成，耗时: {time.time() - start:.2f}s")
         return audio_path, start
 
-    def _step_recognize(self, audio_path, config, progress_cb):
+    def _step_recognize(self, audio_path, config, progress_cb, segment_callback=None):
         print("[阶段] 2. 语音识别")
         progress_cb("2. 语音识别...")
 
@@ -71,15 +96,31 @@ class VideoProcessorPipeline:
             elif isinstance(progress, (int, float)):
                 progress_cb(f"语音识别进度: {int(progress)}%")
 
-        recognized = recognize_speech_enhanced(
-            audio_path, config.get('model', 'large-v3'),
-            detected_language=config.get('src_lang', 'en'),
-            device_choice=config.get('device', 'auto'),
-            progress_callback=recognition_progress_callback,
-            word_timestamps=True,
-            cd_params=config.get('cd_params', {}),
-            enable_alignment=config.get('enable_forced_alignment', False)
-        )
+        if config.get('worker_process', False):
+            pool = get_worker_pool(
+                size=config.get('worker_pool_size', 1),
+                max_jobs=config.get('worker_max_jobs', 20),
+                max_memory_mb=config.get('worker_max_memory_mb', 0),
+            )
+            recognized = pool.recognize(
+                audio_path, config,
+                progress_callback=recognition_progress_callback,
+                segment_callback=segment_callback
+            )
+        else:
+            recognized = recognize_speech_enhanced(
+                audio_path, config.get('model', 'large-v3'),
+                detected_language=config.get('src_lang', 'en'),
+                device_choice=config.get('device', 'auto'),
+                progress_callback=recognition_progress_callback,
+                word_timestamps=True,
+                cd_params=config.get('cd_params', {}),
+                enable_alignment=config.get('enable_forced_alignment', False),
+                alignment_cache=config.get('alignment_emission_cache', False),
+                timestamp_mode=config.get('word_timestamp_mode', 'wav2vec2'),
+                segment_callback=segment_callback,
+                keep_models_loaded=config.get('keep_models_loaded', False)
+            )
 
         progress_cb(f"语音识别完成，语言: {recognized.get('language', 'en')}")
         if use_enhanced:
@@ -90,7 +131,7 @@ class VideoProcessorPipeline:
 
         try:
             base_name = os.path.splitext(os.path.basename(config.get('video_file', '')))[0]
-            aligned_recognition_path = os.path.join(OUTPUT_DIR, f"{base_name}_aligned_recognition.json")
+            aligned_recognition_path = os.path.join(config.get('output_dir', OUTPUT_DIR), f"{base_name}_aligned_recognition.json")
             import json
             def remove_printits_recursive(obj):
                 if isinstance(obj, dict):
@@ -109,12 +150,40 @@ class VideoProcessorPipeline:
         except Exception as e:
             progress_cb(f"保存强制对齐后的语音识别结果失败: {str(e)}")
 
-        clear_model_cache()
+        if not config.get('keep_models_loaded', False):
+            clear_model_cache()
         self._cleanup(config.get('device', 'auto'))
 
         return recognized_serializable
 
-    def _step_translate(self, segments, config, progress_cb):
+    def _step_recognize_pipelined(self, audio_path, recognize_config, translate_config, progress_cb):
+        """边识别边翻译：识别阶段定稿的片段经有界队列送入后台翻译线程
+
+        Returns:
+            (识别结果, 已在识别期间运行的 PipelinedTranslation)
+        """
+        print("[阶段] 2. 语音识别（边识别边翻译）")
+        pipeline = PipelinedTranslation(
+            translate_config.get('src_lang', 'en'), translate_config.get('tgt_lang', 'zh'),
+            trans_params=translate_config.get('trans_params', TransParams()),
+            server_params=translate_config.get('server_params', ServerParams()),
+            telemetry=translate_config.get('telemetry')
+        )
+        pipeline.start()
+        try:
+            recognized = self._step_recognize(audio_path, recognize_config, progress_cb, segment_callback=pipeline.put)
+        except Exception:
+            pipeline.cancel()
+            raise
+        if self._check_cancelled():
+            pipeline.cancel()
+            return recognized, None
+        start = time.time()
+        pipeline.finish()
+        progress_cb(f"识别完成，等待翻译线程处理剩余片段，耗时: {time.time() - start:.2f}s")
+        return recognized, pipeline
+
+    def _step_translate(self, segments, config, progress_cb, pipeline=None):
         translated = segments
         actual_src_lang = config.get('src_lang', 'en')
         tgt_lang = config.get('tgt_lang', 'zh')
@@ -132,7 +201,9 @@ class VideoProcessorPipeline:
                     target_language=tgt_lang,
                     trans_params=config.get('trans_params', TransParams()),
                     server_params=config.get('server_params', ServerParams()),
-                    progress_callback=translation_progress_callback
+                    progress_callback=translation_progress_callback,
+                    pipeline=pipeline,
+                    telemetry=config.get('telemetry')
                 )
                 progress_cb("翻译完成")
             except Exception as e:
@@ -148,7 +219,8 @@ class VideoProcessorPipeline:
                         target_language=tgt_lang,
                         trans_params=retry_params,
                         server_params=retry_server_params,
-                        progress_callback=translation_progress_callback
+                        progress_callback=translation_progress_callback,
+                        telemetry=config.get('telemetry')
                     )
                 else:
                     raise
@@ -194,94 +266,193 @@ class VideoProcessorPipeline:
         missing = [f for f in [original_subtitle_path, translated_subtitle_path, bilingual_subtitle_path] if not os.path.exists(f)]
         return False, f"字幕文件未生成，缺失: {missing}", None
 
-    def process_video(self, video_file, params):
-        temp_files = []
-        try:
-            if not video_file or not os.path.exists(video_file):
-                return False, "文件不存在", None, []
-
-            if os.path.splitext(video_file)[1].lower() not in VIDEO_EXTENSIONS:
-                return False, "不支持的格式", None, []
-
-            if params.get('model', 'large-v3') not in MODEL_OPTIONS:
-                return False, "模型选择错误", None, []
-
-            translator = params.get('translator', 'llama-server')
-            if translator not in PARAM_DEFINITIONS['translator']['options']:
-                return False, f"翻译模型错误: {translator} 不在支持的模型列表中", None, []
-
-            output_path = params.get('output_path') or os.path.join(OUTPUT_DIR, f"{os.path.splitext(os.path.basename(video_file))[0]}_subtitles.srt")
-            src_lang = params.get('source_language', 'ja')
-            tgt_lang = params.get('target_language', 'zh')
-            cd_params = CdParams.from_dict(params)
-            trans_params = TransParams.from_dict(params)
-            server_params = ServerParams.from_dict(params)
-
-            self._add_print(f"开始处理: {video_file}")
-            os.makedirs(TEMP_DIR, exist_ok=True)
-
-            audio_path, start = self._step_extract_audio(video_file, TEMP_DIR, self._add_print)
-            temp_files.append(audio_path)
-
-            if self._check_cancelled():
-                self._add_print("处理已被用户取消")
-                return False, "处理已取消", None, None
-
-            recognize_config = {
-                'model': params.get('model', 'large-v3'),
-                'src_lang': src_lang,
-                'device': params.get('device', 'auto'),
-                'cd_params': cd_params,
-                'enable_forced_alignment': params.get('enable_forced_alignment', False),
-                'video_file': video_file,
-            }
-            recognized_serializable = self._step_recognize(audio_path, recognize_config, self._add_print)
-
-            if self._check_cancelled():
-                self._add_print("处理已被用户取消")
-                return False, "处理已取消", None, None
-
-            translate_config = {
-                'translator': translator,
-                'tgt_lang': tgt_lang,
-                'src_lang': src_lang,
-                'trans_params': trans_params,
-                'server_params': server_params,
-                'device': params.get('device', 'auto'),
-                'params': params,
-            }
-            translated = self._step_translate(recognized_serializable, translate_config, self._add_print)
-
-            if self._check_cancelled():
-                self._add_print("处理已被用户取消")
-                return False, "处理已取消", None, None
-
-            base_name = os.path.splitext(os.path.basename(video_file))[0]
-            subtitle_config = {
-                'start': start,
-            }
-            success, msg, outputs = self._step_generate_subtitles(
-                recognized_serializable, translated, OUTPUT_DIR, base_name, subtitle_config
+    def _write_telemetry_report(self, telemetry, video_file, params, trans_params, server_params, outcome):
+        """写出单个视频的 llama-server 性能报告"""
+        base_name = os.path.splitext(os.path.basename(video_file))[0]
+        path = os.path.join(TELEMETRY_DIR, f"{base_name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        info = {
+            'video': video_file,
+            'outcome': outcome,
+            'source_language': params.get('source_language'),
+            'target_language': params.get('target_language'),
+            'translator': params.get('translator'),
+            'server_params': asdict(server_params),
+            'trans_params': asdict(trans_params),
+        }
+        if telemetry.write_report(path, info):
+            self._add_print(f"{telemetry.summary_line()}，报告: {path}")
+
+    def prepare_job(self, video_file, params, index=0, staged=False):
+        """校验输入并构建各阶段配置；校验失败时返回的任务已带有结果
+
+        staged 为 True 表示任务由 StageScheduler 跨视频调度
+        """
+        job = VideoJob(video_file=video_file, params=params, index=index,
+                       output_dir=params.get('output_dir') or OUTPUT_DIR)
+        if not video_file or not os.path.exists(video_file):
+            job.result = (False, "文件不存在", None)
+            return job
+
+        if os.path.splitext(video_file)[1].lower() not in VIDEO_EXTENSIONS:
+            job.result = (False, "不支持的格式", None)
+            return job
+
+        if params.get('model', 'large-v3') not in get_available_models():
+            job.result = (False, "模型选择错误", None)
+            return job
+
+        translator = params.get('translator', 'llama-server')
+        if translator not in PARAM_DEFINITIONS['translator']['options']:
+            job.result = (False, f"翻译模型错误: {translator} 不在支持的模型列表中", None)
+            return job
+
+        src_lang = params.get('source_language', 'ja')
+        tgt_lang = params.get('target_language', 'zh')
+        cd_params = CdParams.from_dict(params)
+        trans_params = TransParams.from_dict(params)
+        server_params = ServerParams.from_dict(params)
+        if server_params.telemetry:
+            job.telemetry = ServerTelemetry(progress_callback=self._add_print)
+
+        job.recognize_config = {
+            'model': params.get('model', 'large-v3'),
+            'src_lang': src_lang,
+            'device': params.get('device', 'auto'),
+            'cd_params': cd_params,
+            'enable_forced_alignment': params.get('enable_forced_alignment', False),
+            'alignment_emission_cache': params.get('alignment_emission_cache', False),
+            'word_timestamp_mode': params.get('word_timestamp_mode', 'wav2vec2'),
+            'video_file': video_file,
+            'output_dir': job.output_dir,
+            'keep_models_loaded': params.get('keep_models_loaded', False),
+            'worker_process': params.get('recognition_worker_process', False),
+            'worker_pool_size': params.get('queue_recognize_workers', 1),
+            'worker_max_jobs': params.get('recognition_worker_max_jobs', 20),
+            'worker_max_memory_mb': params.get('recognition_worker_max_memory_mb', 0),
+        }
+        job.translate_config = {
+            'translator': translator,
+            'tgt_lang': tgt_lang,
+            'src_lang': src_lang,
+            'trans_params': trans_params,
+            'server_params': server_params,
+            'device': params.get('device', 'auto'),
+            'params': params,
+            'telemetry': job.telemetry,
+        }
+        if staged and trans_params.pipelined and not server_params.daemon:
+            # 非常驻模式下每次翻译各自启动服务器，识别阶段的边识别边翻译会与上一个视频的翻译争用端口
+            self._add_print(f"{os.path.basename(video_file)}: 阶段流水线需开启常驻模式才能边识别边翻译，改为识别后翻译")
+            job.translate_config['trans_params'] = replace(trans_params, pipelined=False)
+        return job
+
+    def _cancel_job(self, job):
+        if self._check_cancelled():
+            self._add_print("处理已被用户取消")
+            job.outcome = "已取消"
+            job.result = (False, "处理已取消", None)
+            return True
+        return False
+
+    def _run_extract(self, job):
+        self._add_print(f"开始处理: {job.video_file}")
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        job.audio_path, job.start = self._step_extract_audio(job.video_file, TEMP_DIR, self._add_print)
+        job.temp_files.append(job.audio_path)
+        if job.telemetry is not None:
+            job.telemetry.mark_stage('extract_audio', time.time() - job.start)
+        self._cancel_job(job)
+
+    def _run_recognize(self, job):
+        trans_params = job.translate_config['trans_params']
+        src_lang = job.translate_config['src_lang']
+        tgt_lang = job.translate_config['tgt_lang']
+        stage_start = time.time()
+        if trans_params.pipelined and src_lang and src_lang != 'auto' and src_lang != tgt_lang:
+            job.recognized, job.pipeline = self._step_recognize_pipelined(
+                job.audio_path, job.recognize_config, job.translate_config, self._add_print
             )
+        else:
+            job.recognized = self._step_recognize(job.audio_path, job.recognize_config, self._add_print)
+        if job.telemetry is not None:
+            job.telemetry.mark_stage('recognize', time.time() - stage_start)
+        if self._cancel_job(job) and job.pipeline is not None:
+            job.pipeline.cancel()
+            job.pipeline = None
+
+    def _run_translate(self, job):
+        """翻译并生成字幕"""
+        stage_start = time.time()
+        translated = self._step_translate(job.recognized, job.translate_config, self._add_print, pipeline=job.pipeline)
+        job.pipeline = None
+        if job.telemetry is not None:
+            job.telemetry.mark_stage('translate', time.time() - stage_start)
+
+        if self._cancel_job(job):
+            return
 
-            if success:
-                return True, msg, outputs, None
-            return False, msg, outputs, None
+        base_name = os.path.splitext(os.path.basename(job.video_file))[0]
+        subtitle_config = {
+            'start': job.start,
+        }
+        success, msg, outputs = self._step_generate_subtitles(
+            job.recognized, translated, job.output_dir, base_name, subtitle_config
+        )
+        if success:
+            job.outcome = "成功"
+        job.result = (success, msg, outputs)
 
+    def run_stage(self, job, stage):
+        """执行一个阶段（extract / recognize / translate）；异常记录为任务失败"""
+        if job.result is not None:
+            return
+        try:
+            {'extract': self._run_extract, 'recognize': self._run_recognize,
+             'translate': self._run_translate}[stage](job)
         except Exception as e:
             import traceback
             print(f"[错误] 处理失败: {e}\n{traceback.format_exc()}")
             self._add_print(f"处理失败: {e}")
+            job.result = (False, f"处理错误: {e}", None)
+            if job.pipeline is not None:
+                job.pipeline.cancel()
+                job.pipeline = None
+
+    def finish_job(self, job):
+        """写出遥测报告并清理临时文件与设备内存；未完成全部阶段的任务记为失败"""
+        if job.result is None:
+            job.result = (False, "处理未完成", None)
+        if job.telemetry is not None:
+            job.telemetry.stop()
+            self._write_telemetry_report(
+                job.telemetry, job.video_file, job.params,
+                job.translate_config['trans_params'], job.translate_config['server_params'], job.outcome
+            )
+        for f in job.temp_files:
+            try:
+                if os.path.exists(f):
+                    os.remove(f)
+            except Exception:
+                print(f"[清理] 临时文件删除失败: {f}")
+                pass
+        if job.recognize_config is not None:
+            self._cleanup(job.params.get('device', 'cpu'))
+
+    def process_video(self, video_file, params):
+        try:
+            job = self.prepare_job(video_file, params)
+        except Exception as e:
+            print(f"[错误] 处理失败: {e}")
+            self._add_print(f"处理失败: {e}")
             return False, f"处理错误: {e}", None, None
+        if job.result is not None:
+            return job.result + ([],)
+        try:
+            for stage in ('extract', 'recognize', 'translate'):
+                self.run_stage(job, stage)
         finally:
-            for f in temp_files:
-                try:
-                    if os.path.exists(f):
-                        os.remove(f)
-                except Exception:
-                    print(f"[清理] 临时文件删除失败: {f}")
-                    pass
-            self._cleanup(params.get('device', 'cpu'))
+            self.finish_job(job)
+        return job.result + (None,)
 
 
 class QueueManager:
@@ -296,6 +467,12 @@ class QueueManager:
             check_cancelled_fn=self._check_cancelled,
             cleanup_fn=self._cleanup,
         )
+        # 阶段流水线中多个视频同时检查取消状态，不能在检查时清除事件
+        self._staged_pipeline = VideoProcessorPipeline(
+            add_print_callback=self.add_print,
+            check_cancelled_fn=self._cancel_event.is_set,
+            cleanup_fn=self._cleanup,
+        )
     
     def cancel_processing(self):
         self._cancel_event.set()
@@ -392,6 +569,34 @@ class QueueManager:
         success, msg, outputs, _ = self._pipeline.process_video(video_file, params)
         return success, msg, outputs, self.prints
     
+    def _process_queue_staged(self):
+        """跨视频阶段流水线：各阶段并行处理不同视频，状态变化时刷新队列"""
+        stage_status = {'extract': '提取音频', 'recognize': '识别中', 'translate': '翻译中'}
+        jobs = [
+            self._staged_pipeline.prepare_job(item['file_path'], item['params'], index=i, staged=True)
+            for i, item in enumerate(self.video_queue)
+        ]
+
+        scheduler = StageScheduler(
+            self._staged_pipeline,
+            extract_workers=config.get('queue_extract_workers', 1),
+            recognize_workers=config.get('queue_recognize_workers', 1),
+            cancelled_fn=self._cancel_event.is_set,
+        )
+        print(f"[队列] 阶段流水线: 提取 {scheduler.workers['extract']} / 识别 {scheduler.workers['recognize']} / 翻译 1 个工作线程")
+        for job, event in scheduler.run(jobs):
+            item = self.video_queue[job.index]
+            if event == 'done':
+                success, msg, _ = job.result
+                print(f"[队列] {item['filename']} 结果: {msg}")
+                status = '已完成' if success else ('已取消' if job.outcome == '已取消' else '失败')
+            else:
+                status = stage_status[event]
+            with self._lock:
+                item['status'] = status
+            yield [[j['filename'], j['status']] for j in self.video_queue], "", "\n".join(self.prints), 0, ""
+        self._cancel_event.clear()
+
     def process_queue(self):
         print(f"\n{'='*80}\n[队列] 开始处理，共 {len(self.video_queue)} 个文件")
         
@@ -407,6 +612,12 @@ class QueueManager:
         self._cancel_event.clear()
         
         try:
+            if config.get('queue_stage_pipelined', False):
+                yield from self._process_queue_staged()
+                print(f"[队列] 处理完成，共 {len(self.video_queue)} 个文件")
+                yield [[i['filename'], i['status']] for i in self.video_queue], "", "\n".join(self.prints), 100, ""
+                return
+
             for i, item in enumerate(self.video_queue):
                 with self._lock:
                     self.video_queue[i]['status'] = '处理中'
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+语音识别子进程模块
+语音识别与强制对齐在常驻子进程中运行，torch 与 GIL 不再和界面进程争用；
+音频在父进程解码一次后放入 multiprocessing.shared_memory，子进程按名称映射，不经 pickle 传输大数组，
+识别结果转换为纯 Python 类型后传回。子进程完成指定数量的任务或内存占用超过阈值后退出并按需重启，
+长时间运行时内存碎片不会累积
+
+子进程入口: python -m utils.recognition_worker --address HOST:PORT（认证密钥经环境变量传递）
+"""
+
+import os
+import sys
+import time
+import secrets
+import argparse
+import threading
+import traceback
+import subprocess
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+_AUTHKEY_ENV = "RECOGNITION_WORKER_AUTHKEY"
+# 子进程启动（导入 torch / transformers）并连回父进程的最长等待时间
+_CONNECT_TIMEOUT = 120.0
+
+
+def _to_builtin(obj):
+    """将 numpy / torch 数值与数组转换为纯 Python 类型，父进程解包时无需导入 torch"""
+    if isinstance(obj, dict):
+        return {k: _to_builtin(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_builtin(v) for v in obj]
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return obj
+
+
+def _process_memory_mb() -> float:
+    """当前进程的常驻内存（MB）；无法获取时返回 0"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+# ---- 共享内存音频 ----
+
+def share_audio(audio_path: str):
+    """在父进程中解码音频（16kHz 单声道，与强制对齐的读取方式一致）并写入共享内存
+
+    采样数据与 ForcedAligner 自行读取文件时逐位相同，发射缓存的音频哈希在两条路径之间通用
+
+    Returns:
+        (SharedMemory, 描述信息)；调用方在任务结束后负责 close 与 unlink
+    """
+    import numpy as np
+    from utils.forced_aligner import load_audio
+
+    audio, sr = load_audio(audio_path)
+    audio = np.ascontiguousarray(audio, dtype=np.float32).reshape(-1)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, audio.nbytes))
+    buffer = np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)
+    buffer[:] = audio
+    del buffer
+    return shm, {'name': shm.name, 'samples': int(audio.shape[0]), 'sr': int(sr)}
+
+
+def _attach_audio(spec: Dict[str, Any]):
+    """在子进程中按名称映射共享内存音频，返回 (SharedMemory, 采样数组)"""
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    if os.name == "posix":
+        # 共享内存由父进程创建和释放，子进程的 resource_tracker 不应在退出时将其删除
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    audio = np.ndarray((spec['samples'],), dtype=np.float32, buffer=shm.buf)
+    return shm, audio
+
+
+# ---- 子进程 ----
+
+def _run_job(conn, job: Dict[str, Any]):
+    from utils.speech_recognizer import recognize_speech_enhanced
+
+    config = job['config']
+    shm = None
+    samples = None
+    audio = None
+    try:
+        if job.get('audio') is not None:
+            shm, samples = _attach_audio(job['audio'])
+            audio = (samples, job['audio']['sr'])
+
+        def progress_callback(progress, message=""):
+            conn.send(('progress', _to_builtin(progress), message))
+
+        segment_callback = None
+        if job.get('stream_segments'):
+            def segment_callback(segment):
+                conn.send(('segment', _to_builtin(segment)))
+
+        recognized = recognize_speech_enhanced(
+            job['audio_path'], config.get('model', 'large-v3'),
+            detected_language=config.get('src_lang', 'en'),
+            device_choice=config.get('device', 'auto'),
+            progress_callback=progress_callback,
+            word_timestamps=True,
+            cd_params=config.get('cd_params'),
+            enable_alignment=config.get('enable_forced_alignment', False),
+            alignment_cache=config.get('alignment_emission_cache', False),
+            timestamp_mode=config.get('word_timestamp_mode', 'wav2vec2'),
+            segment_callback=segment_callback,
+            audio=audio,
+            keep_models_loaded=config.get('keep_models_loaded', False),
+        )
+        result = _to_builtin(recognized)
+    finally:
+        # 结果已转换为纯 Python 类型，释放对共享内存的引用后才能关闭映射
+        audio = None
+        samples = None
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                # 仍有对象引用共享内存时保留映射，由父进程 unlink 后随子进程释放
+                pass
+
+    stats = {'rss_mb': _process_memory_mb()}
+    try:
+        import torch
+        if torch.cuda.is_available():
+            stats['gpu_reserved_mb'] = torch.cuda.memory_reserved() / 1024 ** 2
+    except ImportError:
+        pass
+    conn.send(('result', result, stats))
+
+
+def worker_main(address: str, authkey: bytes):
+    host, port = address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=authkey)
+    print(f"[识别子进程] 已启动，PID: {os.getpid()}")
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            try:
+                _run_job(conn, job)
+            except Exception as e:
+                conn.send(('error', str(e), traceback.format_exc()))
+    finally:
+        conn.close()
+    print(f"[识别子进程] 退出，PID: {os.getpid()}")
+
+
+# ---- 父进程 ----
+
+class _Worker:
+    def __init__(self, process: subprocess.Popen, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self, timeout: float = 30.0):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+
+
+class RecognitionWorkerPool:
+    """常驻识别子进程池：按需启动至多 size 个子进程，每个子进程同一时间只处理一个任务"""
+
+    def __init__(self, size: int = 1, max_jobs: int = 20, max_memory_mb: int = 0):
+        self.size = max(1, size)
+        self.max_jobs = max(1, max_jobs)
+        self.max_memory_mb = max_memory_mb
+        self._cond = threading.Condition()
+        self._idle: List[_Worker] = []
+        self._count = 0
+
+    def _spawn(self) -> _Worker:
+        from config import PROJECT_ROOT
+
+        authkey = secrets.token_bytes(32)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        host, port = listener.address
+        env = dict(os.environ)
+        env[_AUTHKEY_ENV] = authkey.hex()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "utils.recognition_worker", "--address", f"{host}:{port}"],
+            cwd=PROJECT_ROOT, env=env
+        )
+        accepted = {}
+
+        def accept():
+            try:
+                accepted['conn'] = listener.accept()
+            except Exception as e:
+                accepted['error'] = e
+
+        thread = threading.Thread(target=accept, name="recognition-worker-accept", daemon=True)
+        thread.start()
+        deadline = time.time() + _CONNECT_TIMEOUT
+        while thread.is_alive() and process.poll() is None and time.time() < deadline:
+            thread.join(timeout=0.5)
+        listener.close()
+        if 'conn' not in accepted:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            raise RuntimeError(f"识别子进程启动失败: {accepted.get('error') or '未在限定时间内连接'}")
+        print(f"[识别子进程] 已连接，PID: {process.pid}")
+        return _Worker(process, accepted['conn'])
+
+    def _acquire(self) -> _Worker:
+        with self._cond:
+            while True:
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive():
+                        return worker
+                    self._count -= 1
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                self._cond.wait()
+        try:
+            return self._spawn()
+        except BaseException:
+            # 包括等待启动时被中断，归还占用的名额
+            self._discard()
+            raise
+
+    def _discard(self):
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def _release(self, worker: _Worker, stats: Optional[Dict[str, Any]]):
+        worker.jobs += 1
+        reason = None
+        if worker.jobs >= self.max_jobs:
+            reason = f"已完成 {worker.jobs} 个任务"
+        elif self.max_memory_mb and stats and stats.get('rss_mb', 0) > self.max_memory_mb:
+            reason = f"内存占用 {stats['rss_mb']:.0f}MB 超过 {self.max_memory_mb}MB"
+        if reason is not None:
+            print(f"[识别子进程] {reason}，回收 PID {worker.process.pid}")
+            worker.stop()
+            self._discard()
+            return
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def recognize(self, audio_path: str, config: Dict[str, Any],
+                  progress_callback: Optional[Callable] = None,
+                  segment_callback: Optional[Callable] = None) -> Dict[str, Any]:
+        """在子进程中识别 audio_path，回调在调用线程中执行"""
+        shm = None
+        audio_spec = None
+        try:
+            shm, audio_spec = share_audio(audio_path)
+        except Exception as e:
+            # 无法在父进程解码时由子进程自行读取文件
+            print(f"[识别子进程] 音频写入共享内存失败，改由子进程读取文件: {e}")
+
+        worker = None
+        stats = None
+        in_sync = False
+        try:
+            # 在 try 内获取子进程：启动失败或等待被打断时 finally 仍会释放共享内存
+            worker = self._acquire()
+            worker.conn.send({
+                'audio_path': audio_path,
+                'audio': audio_spec,
+                'config': config,
+                'stream_segments': segment_callback is not None,
+            })
+            while True:
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, OSError):
+                    raise RuntimeError(f"识别子进程异常退出，退出码: {worker.process.poll()}")
+                kind = message[0]
+                if kind == 'progress':
+                    if progress_callback is not None:
+                        progress_callback(message[1], message[2])
+                elif kind == 'segment':
+                    if segment_callback is not None:
+                        segment_callback(message[1])
+                elif kind == 'result':
+                    in_sync = True
+                    stats = message[2]
+                    return message[1]
+                elif kind == 'error':
+                    in_sync = True
+                    print(f"[识别子进程] 识别失败:\n{message[2]}")
+                    raise RuntimeError(message[1])
+        finally:
+            if worker is not None and in_sync:
+                self._release(worker, stats)
+            elif worker is not None:
+                # 子进程已退出，或任务中途被打断（连接中还有未读消息），直接结束该子进程
+                if worker.alive():
+                    worker.process.kill()
+                    worker.process.wait()
+                worker.conn.close()
+                self._discard()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def shutdown(self):
+        with self._cond:
+            workers, self._idle = self._idle, []
+            self._count -= len(workers)
+        for worker in workers:
+            worker.stop()
+
+
+_pool: Optional[RecognitionWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(size: int = 1, max_jobs: int = 20, max_memory_mb: int = 0) -> RecognitionWorkerPool:
+    """进程内共享的识别子进程池；参数变化时更新上限，已运行的子进程继续使用"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import atexit
+            _pool = RecognitionWorkerPool(size, max_jobs, max_memory_mb)
+            atexit.register(_pool.shutdown)
+        else:
+            _pool.size = max(1, size)
+            _pool.max_jobs = max(1, max_jobs)
+            _pool.max_memory_mb = max_memory_mb
+        return _pool
+
+
+def shutdown_worker_pool():
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="语音识别子进程")
+    parser.add_argument("--address", required=True, help="父进程监听地址 HOST:PORT")
+    args = parser.parse_args()
+    worker_main(args.address, bytes.fromhex(os.environ.pop(_AUTHKEY_ENV, "")))
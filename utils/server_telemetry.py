@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+llama-server 性能遥测模块
+按视频汇总每个翻译请求响应中的 timings（prompt / 缓存 / 生成 token 数与耗时），
+后台线程定期抓取 /metrics 与 /slots（KV 缓存占用、处理中与排队请求数），
+摘要经处理管线的进度回调输出，任务结束时写出 JSON 报告，用于依据数据调整
+ctx_size、batch_size 与 parallel_slots
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * (len(ordered) - 1) + 0.5))]
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': _percentile(values, 0.5),
+        'p95': _percentile(values, 0.95),
+        'max': max(values) if values else 0.0,
+    }
+
+
+class ServerTelemetry:
+    """单个任务的遥测：请求 timings 由 LlamaServerManager 写入，服务器指标由采样线程定期抓取"""
+
+    def __init__(self, interval: float = 5.0, progress_callback: Optional[Callable[[str], Any]] = None,
+                 max_samples: int = 2000):
+        self.interval = interval
+        self.progress_callback = progress_callback
+        self.max_samples = max_samples
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._totals = {'requests': 0, 'failures': 0, 'prompt_n': 0, 'cache_n': 0, 'predicted_n': 0,
+                        'prompt_ms': 0.0, 'predicted_ms': 0.0, 'draft_n': 0, 'draft_n_accepted': 0}
+        self._prompt_tps: List[float] = []
+        self._predicted_tps: List[float] = []
+        self._request_ms: List[float] = []
+        self._samples: List[Dict[str, Any]] = []
+        self._stages: Dict[str, float] = {}
+        self._server_manager = None
+        self._stop = None
+        self._thread = None
+
+    # ---- 请求 timings ----
+
+    def record(self, timings: Dict[str, Any]):
+        prompt_n = int(timings.get("prompt_n") or 0)
+        predicted_n = int(timings.get("predicted_n") or 0)
+        prompt_ms = float(timings.get("prompt_ms") or 0.0)
+        predicted_ms = float(timings.get("predicted_ms") or 0.0)
+        with self._lock:
+            t = self._totals
+            t['requests'] += 1
+            t['prompt_n'] += prompt_n
+            t['cache_n'] += int(timings.get("cache_n") or 0)
+            t['predicted_n'] += predicted_n
+            t['prompt_ms'] += prompt_ms
+            t['predicted_ms'] += predicted_ms
+            t['draft_n'] += int(timings.get("draft_n") or 0)
+            t['draft_n_accepted'] += int(timings.get("draft_n_accepted") or 0)
+            if prompt_n and prompt_ms > 0:
+                self._prompt_tps.append(prompt_n / prompt_ms * 1000)
+            if predicted_n and predicted_ms > 0:
+                self._predicted_tps.append(predicted_n / predicted_ms * 1000)
+            self._request_ms.append(prompt_ms + predicted_ms)
+
+    def record_failure(self):
+        with self._lock:
+            self._totals['failures'] += 1
+
+    def mark_stage(self, name: str, seconds: float):
+        """记录处理阶段耗时（音频提取、识别、翻译等）"""
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    # ---- /metrics 与 /slots 采样 ----
+
+    def start(self, server_manager):
+        """开始定期抓取服务器指标；重复调用只更新被采样的服务器"""
+        self._server_manager = server_manager
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, args=(self._stop,),
+                                        name="llama-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        self._thread = None
+
+    def _sample_loop(self, stop_event: threading.Event):
+        while not stop_event.wait(self.interval):
+            manager = self._server_manager
+            metrics = manager.scrape_metrics() if manager is not None else None
+            if metrics is not None:
+                metrics['t'] = round(time.time() - self.started_at, 2)
+                with self._lock:
+                    self._samples.append(metrics)
+                    if len(self._samples) > self.max_samples:
+                        # 超出上限时隔一取一，保留整个任务的时间跨度
+                        self._samples = self._samples[::2]
+            if self.progress_callback is not None and (metrics is not None or self._totals['requests']):
+                self.progress_callback(self.summary_line(metrics))
+
+    # ---- 汇总 ----
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+            prompt_tps = list(self._prompt_tps)
+            predicted_tps = list(self._predicted_tps)
+            request_ms = list(self._request_ms)
+            samples = list(self._samples)
+            stages = dict(self._stages)
+        prompt_total = totals['prompt_n'] + totals['cache_n']
+        summary = dict(totals)
+        summary['cache_reuse_rate'] = totals['cache_n'] / prompt_total if prompt_total else 0.0
+        summary['prompt_tokens_per_second'] = totals['prompt_n'] / totals['prompt_ms'] * 1000 if totals['prompt_ms'] else 0.0
+        summary['predicted_tokens_per_second'] = totals['predicted_n'] / totals['predicted_ms'] * 1000 if totals['predicted_ms'] else 0.0
+        summary['draft_acceptance'] = totals['draft_n_accepted'] / totals['draft_n'] if totals['draft_n'] else 0.0
+        server = {}
+        for key in ('kv_cache_usage_ratio', 'requests_processing', 'requests_deferred', 'busy_slots'):
+            values = [s[key] for s in samples if s.get(key) is not None]
+            if values:
+                server[key] = _distribution(values)
+        return {
+            'elapsed': round(time.time() - self.started_at, 2),
+            'stages': stages,
+            'requests': summary,
+            'per_request': {
+                'prompt_tokens_per_second': _distribution(prompt_tps),
+                'predicted_tokens_per_second': _distribution(predicted_tps),
+                'server_ms': _distribution(request_ms),
+            },
+            'server': server,
+            'samples': samples,
+        }
+
+    def summary_line(self, metrics: Optional[Dict[str, Any]] = None) -> str:
+        with self._lock:
+            t = dict(self._totals)
+        prompt_total = t['prompt_n'] + t['cache_n']
+        parts = [f"请求 {t['requests']} 次"]
+        if t['failures']:
+            parts.append(f"失败 {t['failures']} 次")
+        if t['predicted_ms']:
+            parts.append(f"生成 {t['predicted_n'] / t['predicted_ms'] * 1000:.1f} tok/s")
+        if t['prompt_ms']:
+            parts.append(f"prompt {t['prompt_n'] / t['prompt_ms'] * 1000:.0f} tok/s")
+        if prompt_total:
+            parts.append(f"缓存复用 {t['cache_n'] / prompt_total:.0%}")
+        if metrics:
+            if metrics.get('kv_cache_usage_ratio') is not None:
+                parts.append(f"KV 占用 {metrics['kv_cache_usage_ratio']:.0%}")
+            if metrics.get('requests_processing') is not None:
+                parts.append(f"处理中 {int(metrics['requests_processing'])}")
+            if metrics.get('requests_deferred') is not None:
+                parts.append(f"排队 {int(metrics['requests_deferred'])}")
+        return "[llama-server性能] " + ", ".join(parts)
+
+    def write_report(self, path: str, info: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """写出 JSON 报告，info 为任务信息（视频、服务器与翻译参数等）"""
+        report = dict(info or {})
+        report['started_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))
+        report.update(self.snapshot())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"[llama-server性能] 写出报告失败: {e}")
+            return None
+        return path
+
+
+__all__ = ['ServerTelemetry']
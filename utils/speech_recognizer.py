@@ -7,41 +7,54 @@
 
 import os
 import gc
+import threading
+from dataclasses import asdict
 try:
     import torch
 except ImportError:
     torch = None
 import warnings
 
-from config import MODEL_CACHE_DIR, CdParams
+from config import CdParams, model_registry
 from utils.forced_aligner import ForcedAligner
 
 
 
+# 保持加载模式下复用的 Whisper-CD 处理器与强制对齐器，键为模型与解码参数；
+# 使用期间从缓存中取出，多个识别线程不会同时使用同一个实例
+_whispercd_cache = {}
+_aligner_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _take_cached(cache, key):
+    with _cache_lock:
+        return cache.pop(key, None)
+
+
+def _put_cached(cache, key, model) -> bool:
+    """放回缓存；同键已有实例（其他线程同时加载）时返回 False，由调用方释放"""
+    with _cache_lock:
+        if key in cache:
+            return False
+        cache[key] = model
+        return True
+
+
 # 公共工具函数
 
 
 def check_local_model(model_name):
     """检查本地模型文件是否存在"""
-    model_paths = [
-        os.path.join(MODEL_CACHE_DIR, model_name),
-        os.path.join(MODEL_CACHE_DIR, f"openai--whisper-{model_name}"),
-        os.path.join(MODEL_CACHE_DIR, f"models--openai--whisper-{model_name}", "snapshots"),
-    ]
-    
-    for path in model_paths:
-        if os.path.exists(path):
-            if "snapshots" in path and os.path.isdir(path):
-                try:
-                    snapshot_dirs = [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
-                    if snapshot_dirs:
-                        return os.path.join(path, snapshot_dirs[0])
-                except Exception:
-                    print(f"[模型检查] 列出快照目录失败: {path}")
-                    pass
-            elif os.path.isdir(path):
-                return path
-    
+    for dir_name in (model_name, f"openai--whisper-{model_name}"):
+        path = model_registry.find_dir(dir_name)
+        if path:
+            return path
+
+    snapshot_dirs = model_registry.subdirs(f"models--openai--whisper-{model_name}", "snapshots")
+    if snapshot_dirs:
+        return snapshot_dirs[0]
+
     return None
 
 
@@ -143,24 +156,31 @@ def _extract_segment_texts(cd_result):
     return segments
 
 
-def _apply_forced_alignment(segments, audio_path, language, device):
+def _apply_forced_alignment(segments, audio_path, language, device, use_emission_cache=False, audio=None,
+                            keep_loaded=False):
     """应用强制对齐"""
     if not segments:
         return segments
 
-    aligner = None
+    aligner = _take_cached(_aligner_cache, (language, device)) if keep_loaded else None
+    loaded = aligner is not None
     try:
         print("[强制对齐] 启用强制对齐...")
-        aligner = ForcedAligner(device=device)
-        if aligner.load_alignment_model(language):
-            segments = aligner.align(segments, audio_path, return_char_alignments=True)
+        if loaded:
+            print("[强制对齐] 复用已加载的对齐模型")
+        else:
+            aligner = ForcedAligner(device=device)
+            loaded = aligner.load_alignment_model(language)
+        if loaded:
+            segments = aligner.align(segments, audio_path, return_char_alignments=True,
+                                     use_emission_cache=use_emission_cache, audio=audio)
             print("[强制对齐] 强制对齐完成")
         else:
             print("[强制对齐] 强制对齐模型加载失败，跳过对齐")
     except Exception as e:
         print(f"[强制对齐] 强制对齐失败: {str(e)}")
     finally:
-        if aligner is not None:
+        if aligner is not None and not (keep_loaded and loaded and _put_cached(_aligner_cache, (language, device), aligner)):
             aligner.cleanup()
             print("[内存管理] 强制对齐模型已卸载，清理显存")
             if torch is not None and torch.cuda.is_available():
@@ -192,13 +212,16 @@ def _build_final_segments(segments, audio_path, language=''):
     return result
 
 
-def _process_cd_segments(cd_result, audio_path, language=None, device="auto", enable_alignment=True):
+def _process_cd_segments(cd_result, audio_path, language=None, device="auto", enable_alignment=True,
+                         alignment_cache=False, audio=None, keep_loaded=False):
     """处理 Whisper-CD 结果的共享函数"""
     detected_language = language or cd_result.get('language', '')
     segments = _extract_segment_texts(cd_result)
 
     if enable_alignment:
-        segments = _apply_forced_alignment(segments, audio_path, detected_language or 'ja', device)
+        segments = _apply_forced_alignment(segments, audio_path, detected_language or 'ja', device,
+                                           use_emission_cache=alignment_cache, audio=audio,
+                                           keep_loaded=keep_loaded)
 
     result = _build_final_segments(segments, audio_path, detected_language)
     return result
@@ -215,7 +238,12 @@ def _cleanup_memory():
 def recognize_speech_enhanced(audio_path, model_path, detected_language=None, device_choice="auto",
                     progress_callback=None, word_timestamps=True,
                     cd_params: CdParams = None,
-                    enable_alignment=True):
+                    enable_alignment=True,
+                    alignment_cache=False,
+                    timestamp_mode="wav2vec2",
+                    segment_callback=None,
+                    audio=None,
+                    keep_models_loaded=False):
     """增强版语音识别
 
     Args:
@@ -227,6 +255,11 @@ def recognize_speech_enhanced(audio_path, model_path, detected_language=None, de
         word_timestamps: 是否启用单词时间戳
         cd_params: CdParams对象，包含所有对比解码参数
         enable_alignment: 是否启用强制对齐
+        alignment_cache: 是否缓存强制对齐的发射矩阵，供后续重新对齐
+        timestamp_mode: 词级时间戳来源（wav2vec2 / whisper_dtw / auto）
+        segment_callback: 片段定稿回调，解码过程中逐条接收已定稿的字幕片段（用于边识别边翻译）
+        audio: 已解码的 16kHz 单声道 (采样数据, 采样率)，提供时识别与强制对齐都不再读取 audio_path
+        keep_models_loaded: 识别结束后保留 Whisper 与对齐模型，供后续视频直接复用（需调用 clear_model_cache 释放）
 
     Returns:
         识别结果字典
@@ -240,26 +273,48 @@ def recognize_speech_enhanced(audio_path, model_path, detected_language=None, de
 
     from config import config
     from utils.whisper_cd_original import WhisperCDOriginal
+    from utils.forced_aligner import has_alignment_model
+
+    use_dtw = False
+    if enable_alignment:
+        if timestamp_mode == "whisper_dtw":
+            use_dtw = True
+        elif timestamp_mode == "auto":
+            use_dtw = bool(detected_language) and not has_alignment_model(detected_language)
+    if use_dtw:
+        print("[语音识别] 词级时间戳使用 Whisper 交叉注意力 DTW，跳过 Wav2Vec2 强制对齐")
 
     print("[Whisper-CD] 启用 Whisper-CD 处理器...")
 
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=UserWarning)
-        whispercd_processor = WhisperCDOriginal(
-            model_path=model_path,
-            device=device,
-            cd_params=cd_params,
-            enable_alignment=enable_alignment,
-        )
+        cache_key = (model_path, device, tuple(asdict(cd_params).items()), enable_alignment and not use_dtw, use_dtw)
+        whispercd_processor = _take_cached(_whispercd_cache, cache_key) if keep_models_loaded else None
+        if whispercd_processor is not None:
+            print("[Whisper-CD] 复用已加载的 Whisper 模型")
+        else:
+            if keep_models_loaded:
+                # 参数变化后旧处理器不会再被命中，先释放其显存
+                _release_cached_models(keep_aligners=True)
+            whispercd_processor = WhisperCDOriginal(
+                model_path=model_path,
+                device=device,
+                cd_params=cd_params,
+                enable_alignment=enable_alignment and not use_dtw,
+                dtw_timestamps=use_dtw,
+            )
 
         print("[Whisper-CD] 应用对比解码...")
         cd_result = whispercd_processor.transcribe(
             audio_path,
             detected_language,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            segment_callback=segment_callback,
+            audio=audio
         )
 
-    whispercd_processor.cleanup()
+    if not (keep_models_loaded and _put_cached(_whispercd_cache, cache_key, whispercd_processor)):
+        whispercd_processor.cleanup()
     del whispercd_processor
     _cleanup_memory()
 
@@ -271,7 +326,10 @@ def recognize_speech_enhanced(audio_path, model_path, detected_language=None, de
     if progress_callback:
         progress_callback(80)
 
-    result = _process_cd_segments(cd_result, audio_path, detected_language, device, enable_alignment)
+    result = _process_cd_segments(cd_result, audio_path, detected_language, device,
+                                  enable_alignment and not use_dtw,
+                                  alignment_cache=alignment_cache, audio=audio,
+                                  keep_loaded=keep_models_loaded)
 
     print("[内存管理] 转录完成，执行最终内存清理...")
     gc.collect()
@@ -285,8 +343,78 @@ def recognize_speech_enhanced(audio_path, model_path, detected_language=None, de
     return result
 
 
+def realign_recognition_result(recognition_json_path, media_path, device_choice="auto"):
+    """根据编辑后的 _aligned_recognition.json 重新计算时间戳
+
+    优先使用强制对齐时缓存的发射矩阵，仅运行 Viterbi 对齐；
+    缓存不存在时回退为完整的 Wav2Vec2 强制对齐。
+
+    Args:
+        recognition_json_path: 编辑后的识别结果 JSON 路径
+        media_path: 原始视频或音频路径
+        device_choice: 设备选择
+
+    Returns:
+        重新对齐后的识别结果字典（同时写回 JSON 文件）
+    """
+    import json
+    from utils.video_processor import extract_audio
+
+    with open(recognition_json_path, 'r', encoding='utf-8') as f:
+        recognized = json.load(f)
+
+    segments = recognized.get('segments', [])
+    language = recognized.get('language') or 'ja'
+    device = "cuda" if device_choice != "cpu" else "cpu"
+    if device == "cuda" and (torch is None or not torch.cuda.is_available()):
+        device = "cpu"
+
+    audio_path = media_path
+    temp_audio = None
+    if os.path.splitext(media_path)[1].lower() != '.wav':
+        temp_audio = extract_audio(media_path)
+        audio_path = temp_audio
+
+    aligner = ForcedAligner(device=device)
+    try:
+        realigned = None
+        if aligner.load_alignment_model(language, processor_only=True):
+            realigned = aligner.realign(segments, audio_path, return_char_alignments=True)
+        if realigned is None:
+            print("[强制对齐] 无可用缓存，执行完整强制对齐")
+            if aligner.load_alignment_model(language):
+                realigned = aligner.align(segments, audio_path, return_char_alignments=True,
+                                          use_emission_cache=True)
+            else:
+                realigned = segments
+    finally:
+        aligner.cleanup()
+        if temp_audio and os.path.exists(temp_audio):
+            os.remove(temp_audio)
+
+    result = _build_final_segments(realigned, audio_path, language)
+    for key, value in recognized.items():
+        result.setdefault(key, value)
+    with open(recognition_json_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[强制对齐] 重新对齐结果已写回: {recognition_json_path}")
+    return result
+
+
+def _release_cached_models(keep_aligners=False):
+    with _cache_lock:
+        models = list(_whispercd_cache.values())
+        _whispercd_cache.clear()
+        if not keep_aligners:
+            models.extend(_aligner_cache.values())
+            _aligner_cache.clear()
+    for model in models:
+        model.cleanup()
+
+
 def clear_model_cache():
-    """清理模型缓存"""
+    """清理模型缓存（包括保持加载模式下保留的模型）"""
+    _release_cached_models()
     gc.collect()
     if torch is not None and torch.cuda.is_available():
         torch.cuda.synchronize()
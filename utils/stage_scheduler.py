@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+跨视频阶段流水线调度模块
+每个处理阶段（音频提取 / 语音识别 / 翻译与字幕）各有一组工作线程，阶段之间以有界队列交接：
+第 N 个视频翻译时第 N+1 个视频已在提取音频和识别，GPU 与 llama-server 不再轮流空闲。
+有界队列限制了提前完成、等待下一阶段的视频数，临时音频文件与识别结果不会无限堆积
+"""
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+STAGES = ('extract', 'recognize', 'translate')
+
+
+class StageScheduler:
+    """按阶段调度 VideoJob；翻译阶段共用同一个 llama-server，固定单线程"""
+
+    def __init__(self, pipeline, extract_workers: int = 1, recognize_workers: int = 1, queue_size: int = 1,
+                 cancelled_fn: Optional[Callable[[], bool]] = None):
+        self.pipeline = pipeline
+        self.workers = {
+            'extract': max(1, extract_workers),
+            'recognize': max(1, recognize_workers),
+            'translate': 1,
+        }
+        self.queue_size = max(1, queue_size)
+        self._cancelled = cancelled_fn or (lambda: False)
+        self._abandoned = False
+
+    def _worker(self, stage, in_queue, out_queue, events):
+        while True:
+            job = in_queue.get()
+            if job is None:
+                return
+            if job.result is None and (self._abandoned or self._cancelled()):
+                job.outcome = "已取消"
+                job.result = (False, "处理已取消", None)
+            if job.result is None:
+                events.put((job, stage))
+                self.pipeline.run_stage(job, stage)
+            if job.result is None and out_queue is not None:
+                # 下一阶段繁忙且队列已满时在此阻塞，形成背压
+                out_queue.put(job)
+                continue
+            try:
+                self.pipeline.finish_job(job)
+            finally:
+                events.put((job, 'done'))
+
+    def run(self, jobs: Iterable) -> Iterator[Tuple[object, str]]:
+        """依次产出 (任务, 事件)，事件为进入的阶段名或 'done'；全部任务结束后返回"""
+        jobs = list(jobs)
+        events: "queue.Queue" = queue.Queue()
+        queues = {
+            'extract': queue.Queue(),
+            'recognize': queue.Queue(maxsize=self.queue_size),
+            'translate': queue.Queue(maxsize=self.queue_size),
+        }
+        threads = []
+        for k, stage in enumerate(STAGES):
+            out_queue = queues[STAGES[k + 1]] if k + 1 < len(STAGES) else None
+            for n in range(self.workers[stage]):
+                thread = threading.Thread(target=self._worker, args=(stage, queues[stage], out_queue, events),
+                                          name=f"stage-{stage}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        self._abandoned = False
+        # 校验未通过的任务不进入流水线
+        rejected = [job for job in jobs if job.result is not None]
+        pending = 0
+        for job in jobs:
+            if job.result is None:
+                queues['extract'].put(job)
+                pending += 1
+
+        try:
+            for job in rejected:
+                yield job, 'done'
+            while pending:
+                job, event = events.get()
+                if event == 'done':
+                    pending -= 1
+                yield job, event
+        finally:
+            if pending:
+                # 调用方提前停止迭代：剩余任务按取消处理，结束后在后台停止工作线程
+                self._abandoned = True
+                threading.Thread(target=self._drain, args=(events, pending, queues),
+                                 name="stage-drain", daemon=True).start()
+            else:
+                self._stop_workers(queues)
+                for thread in threads:
+                    thread.join()
+
+    def _stop_workers(self, queues):
+        """全部任务已结束时各阶段队列为空，逐个放入结束标记"""
+        for stage in STAGES:
+            for _ in range(self.workers[stage]):
+                queues[stage].put(None)
+
+    def _drain(self, events, pending, queues):
+        while pending:
+            if events.get()[1] == 'done':
+                pending -= 1
+        self._stop_workers(queues)
+
+
+__all__ = ['StageScheduler', 'STAGES']
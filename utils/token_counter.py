@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+token 计数模块
+优先使用 llama-server 的 /tokenize 接口精确计数，结果按字符串做 LRU 缓存；
+服务器不可用时回退到按字符类别估算，供翻译器的上下文与输出预算统一使用
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+_TOKEN_ESTIMATOR_CONFIGS = {
+    "qwen2": {"cjk_ratio": 1.5, "latin_ratio": 0.3, "punct_ratio": 0.5},
+    "default": {"cjk_ratio": 2.0, "latin_ratio": 0.25, "punct_ratio": 0.5},
+}
+
+_CJK_PUNCT = set('。！？、；：""''【】《》…—・～♪★♡※○●◎◇◆□■△▽')
+
+# 聊天模板为每条消息附加的角色标记与分隔符 token 数
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_token_count(text, model_family="default"):
+    """按字符类别估算 token 数"""
+    cfg = _TOKEN_ESTIMATOR_CONFIGS.get(model_family, _TOKEN_ESTIMATOR_CONFIGS["default"])
+    cjk_count = 0
+    punct_count = 0
+    for c in text:
+        if '\u4e00' <= c <= '\u9fff' or '\u3040' <= c <= '\u30ff' or '\uac00' <= c <= '\ud7af':
+            cjk_count += 1
+        elif c in _CJK_PUNCT:
+            punct_count += 1
+    latin_count = len(text) - cjk_count - punct_count
+    return int(cjk_count * cfg["cjk_ratio"] + latin_count * cfg["latin_ratio"] + punct_count * cfg["punct_ratio"])
+
+
+class TokenCounter:
+    """带 LRU 缓存的 token 计数器
+
+    只缓存服务器返回的精确计数；估算值不缓存，服务器恢复后即可得到精确结果。
+    """
+
+    def __init__(self, server_manager=None, model_family="default", cache_size=8192, max_failures=3):
+        self._server_manager = server_manager
+        self._model_family = model_family
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_failures = max_failures
+        self._failures = 0
+        self.hits = 0
+        self.server_calls = 0
+        self.estimates = 0
+
+    def count(self, text: str) -> int:
+        exact = self.count_exact(text)
+        if exact is None:
+            self.estimates += 1
+            return estimate_token_count(text, self._model_family)
+        return exact
+
+    def count_exact(self, text: str) -> Optional[int]:
+        """服务器 /tokenize 的精确 token 数；服务器不可用（会回退为字符估算）时返回 None"""
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return cached
+
+        exact = self._count_with_server(text)
+        if exact is None:
+            return None
+
+        with self._lock:
+            self._cache[text] = exact
+            self._cache.move_to_end(text)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return exact
+
+    def count_messages(self, messages) -> int:
+        """计算聊天消息列表的 prompt token 数（含模板开销）"""
+        return sum(self.count(m.get('content', '')) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+    def _count_with_server(self, text):
+        if self._server_manager is None or self._failures >= self._max_failures:
+            return None
+        tokens = self._server_manager.tokenize(text)
+        if tokens is None:
+            self._failures += 1
+            if self._failures >= self._max_failures:
+                print(f"[token计数] /tokenize 连续失败 {self._failures} 次，回退为字符估算")
+            return None
+        self._failures = 0
+        self.server_calls += 1
+        return len(tokens)
+
+    def reset_failures(self):
+        """服务器重启后重新尝试精确计数"""
+        self._failures = 0
+
+    def reset_stats(self):
+        """清零命中 / 请求 / 估算计数，缓存的精确计数保留"""
+        with self._lock:
+            self.hits = 0
+            self.server_calls = 0
+            self.estimates = 0
+
+    def stats(self) -> dict:
+        return {
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'server_calls': self.server_calls,
+            'estimates': self.estimates,
+        }
+
+
+__all__ = ['TokenCounter', 'estimate_token_count', 'MESSAGE_OVERHEAD_TOKENS']
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+翻译记忆模块
+以 SQLite 持久化已验证的翻译结果，键为 预处理后的原文 + 源/目标语言 + 翻译模型 + 影响输出的翻译参数，
+剧集中反复出现的口头禅、OP/ED 歌词、感叹词等可直接命中而无需再次请求 llama-server
+"""
+
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+
+from config import CACHE_DIR
+
+
+# 影响翻译输出或验证结果的 TransParams 字段，任一变化都会使旧记录失效
+_KEY_PARAM_FIELDS = ('temperature', 'top_k', 'top_p', 'rep_penalty', 'validation_threshold', 'kana_ratio_threshold')
+
+
+class TranslationMemory:
+    """基于 SQLite 的翻译记忆缓存，超过容量时按最近使用时间淘汰"""
+
+    def __init__(self, db_path: str = None, max_entries: int = 50000):
+        self.db_path = db_path or os.path.join(CACHE_DIR, "translation_memory.sqlite3")
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "key TEXT PRIMARY KEY, source TEXT NOT NULL, translation TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL, use_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_last_used ON memory(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+
+    @staticmethod
+    def make_key(processed_text, source_lang, target_lang, model_name, trans_params=None) -> str:
+        """根据预处理后的原文、语言方向、模型与翻译参数生成记忆键"""
+        params = {name: getattr(trans_params, name, None) for name in _KEY_PARAM_FIELDS} if trans_params else {}
+        payload = json.dumps(
+            [processed_text, source_lang, target_lang, model_name, params],
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """查询翻译记忆，命中时返回译文并更新使用时间，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT translation FROM memory WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE memory SET last_used = ?, use_count = use_count + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, source, translation):
+        """写入已验证的翻译，超出容量时淘汰最久未使用的记录"""
+        if not translation:
+            return
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM memory WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memory (key, source, translation, created, last_used, use_count) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, source, translation, now, now)
+            )
+            if not exists:
+                self._count += 1
+            self.stores += 1
+            if self._count > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        # 一次淘汰到容量的 90%，避免每次写入都触发删除
+        target = int(self.max_entries * 0.9)
+        excess = self._count - target
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM memory WHERE key IN (SELECT key FROM memory ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        self._count -= excess
+        self.evictions += excess
+        print(f"[翻译记忆] 超出容量 {self.max_entries}，已淘汰 {excess} 条最久未使用的记录")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._count,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+__all__ = ['TranslationMemory']
@@ -5,6 +5,11 @@ import os
 import gc
 import re
 import time
+import queue
+import hashlib
+import threading
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import torch
@@ -12,18 +17,25 @@ except ImportError:
     torch = None
 
 from utils.llama_server_manager import LlamaServerManager
-from utils.language_ratio_detector import check_translation_success, is_translation_valid
+from utils.llama_server_pool import create_server_manager
+from utils.language_ratio_detector import check_translation_success, is_translation_valid, is_partial_translation_failing, validate_translations
+from utils.translation_memory import TranslationMemory
+from utils.token_counter import TokenCounter
+from utils.prompt_builder import PromptBuilder
+from utils.output_constraints import build_line_grammar, build_packed_grammar, ConstraintStats
+from utils.output_length_model import OutputLengthModel
 
 
 from config import MODEL_CACHE_DIR, config, TransParams, ServerParams
 
 
 def clear_translator_cache(server_manager=None):
-    """清空翻译模型缓存以释放内存并停止服务器进程"""
+    """清空翻译模型缓存以释放内存并释放服务器进程（常驻模式下保持运行直到空闲超时）"""
     try:
         if server_manager is not None:
-            server_manager.stop_server()
-            print("[llama-server] 已通过 server_manager 停止服务器进程")
+            server_manager.release()
+            if not server_manager.daemon:
+                print("[llama-server] 已通过 server_manager 停止服务器进程")
     except Exception as e:
         print(f"[llama-server] 停止服务器时出错: {e}")
 
@@ -33,27 +45,6 @@ def clear_translator_cache(server_manager=None):
     print("[内存管理] 已执行垃圾回收和显存清理")
 
 
-_TOKEN_ESTIMATOR_CONFIGS = {
-    "qwen2": {"cjk_ratio": 1.5, "latin_ratio": 0.3, "punct_ratio": 0.5},
-    "default": {"cjk_ratio": 2.0, "latin_ratio": 0.25, "punct_ratio": 0.5},
-}
-
-_CJK_PUNCT = set('。！？、；：""''【】《》…—・～♪★♡※○●◎◇◆□■△▽')
-
-
-def _estimate_token_count(text, model_family="default"):
-    cfg = _TOKEN_ESTIMATOR_CONFIGS.get(model_family, _TOKEN_ESTIMATOR_CONFIGS["default"])
-    cjk_count = 0
-    punct_count = 0
-    for c in text:
-        if '\u4e00' <= c <= '\u9fff' or '\u3040' <= c <= '\u30ff' or '\uac00' <= c <= '\ud7af':
-            cjk_count += 1
-        elif c in _CJK_PUNCT:
-            punct_count += 1
-    latin_count = len(text) - cjk_count - punct_count
-    return int(cjk_count * cfg["cjk_ratio"] + latin_count * cfg["latin_ratio"] + punct_count * cfg["punct_ratio"])
-
-
 _ALLOWED_LANGUAGES = {
     'zh': 'Chinese', 'chinese': 'Chinese', '中文': 'Chinese',
     'en': 'English', 'english': 'English', '英语': 'English',
@@ -74,6 +65,49 @@ _ALLOWED_LANGUAGES = {
 _LANG_MAP = {k: v for k, v in _ALLOWED_LANGUAGES.items() if len(k) == 2}
 
 
+class _StreamAbortMonitor:
+    """流式生成监视器：输出超长、出现循环重复或目标语言占比明显失败时返回中止原因"""
+
+    def __init__(self, source_text, source_lang, target_lang, trans_params):
+        self.source_text = source_text
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.trans_params = trans_params
+        self.max_chars = max(32, int(len(source_text) * trans_params.abort_length_ratio))
+        repeat_count = max(2, trans_params.abort_repeat_threshold)
+        self._repeat_pattern = re.compile(r'(.{1,20}?)\1{%d,}$' % (repeat_count - 1), re.S)
+        self.abort_reason = None
+
+    def __call__(self, text):
+        reason = None
+        if len(text) > self.max_chars:
+            reason = f"输出长度 {len(text)} 超过预期上限 {self.max_chars}"
+        elif self._repeat_pattern.search(text[-200:]):
+            reason = "检测到循环重复"
+        elif is_partial_translation_failing(text, self.source_text, self.source_lang, self.target_lang,
+                                            trans_params=self.trans_params):
+            reason = "目标语言占比过低"
+        if reason:
+            self.abort_reason = reason
+        return reason
+
+
+_PACKED_LINE_PATTERN = re.compile(r'^\s*(\d+)\s*[.．。、:：)）]\s*(.*)$')
+
+
+def _parse_packed_output(output):
+    """解析打包翻译的编号输出，返回 {编号: 译文}，重复编号保留首次出现"""
+    parsed = {}
+    for line in output.splitlines():
+        match = _PACKED_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        if number not in parsed:
+            parsed[number] = match.group(2).strip()
+    return parsed
+
+
 def _sanitize_language(lang_input, default='English'):
     if not lang_input:
         return default
@@ -90,14 +124,35 @@ class LlamaCppTranslator:
         self.system_prompt = "You are a translator. Your only task is to translate the given text from the source language to the target language. Output only the translation, nothing else. Do not include any instructions or explanations in your response."
         if server_params is None:
             server_params = ServerParams.from_dict(config.get_all())
-        self._server_manager = LlamaServerManager(server_params=server_params)
+        self._server_manager = create_server_manager(server_params)
         self.chat_history = []
         translator = config.get('translator', 'tencent/HY-MT1.5-1.8B-GGUF-Q8_0')
+        self._translator_name = translator
         self._model_family = "qwen2" if "qwen" in translator.lower() else "default"
+        self._memory = None
+        self._telemetry = None
+        self._token_counter = TokenCounter(self._server_manager, self._model_family)
+        self._history_lock = threading.Lock()
+        # 同时在途的翻译请求不超过服务器并行槽数：多候选与并发翻译叠加时多余的请求在本地排队，
+        # 不会在服务器端排队，也不会超出 HTTP 连接池
+        self._request_gate = threading.BoundedSemaphore(max(1, self._server_manager.parallel_slots))
+        self._constraint_stats = None
+        self._length_model = OutputLengthModel()
+        # 按长度模型预算请求后验证失败的文本，重试时改用固定规则，避免因预算偏小被反复截断
+        self._length_fallback = set()
         
         print(f"[llama-server翻译] 使用 HTTP API: {self._server_manager.host}:{self._server_manager.port}")
         print(f"[llama-server翻译] 模型: {self._server_manager.model_path}")
 
+    def attach_telemetry(self, telemetry):
+        """本翻译器发出的请求 timings 写入 telemetry，并开始定期抓取服务器指标；None 表示停止
+
+        常驻模式下多个视频共用同一个服务器管理器，telemetry 随每个请求传入，不会记到其他视频的报告中
+        """
+        self._telemetry = telemetry
+        if telemetry is not None:
+            telemetry.start(self._server_manager)
+
     def compress_repeated_sequences(self, text: str, keep_count: int = 1) -> str:
         if not text:
             return text
@@ -152,8 +207,12 @@ class LlamaCppTranslator:
         result = self._translate_multi_fallback(text, source_lang, target_lang, trans_params)
         return result[0] if isinstance(result, tuple) else result
 
-    def _translate_multi_fallback(self, text, source_lang="en", target_lang="zh", trans_params=None, context=None):
-        """使用 Chat API 进行翻译，保留翻译历史以利用 KV cache"""
+    def _translate_multi_fallback(self, text, source_lang="en", target_lang="zh", trans_params=None, context=None, use_history=True, temperature=None):
+        """使用 Chat API 进行翻译，保留翻译历史以利用 KV cache
+
+        use_history 为 False 时请求不携带共享聊天历史，可在多个并行槽上并发调用；
+        temperature 用于覆盖 trans_params.temperature（多候选采样）
+        """
         if trans_params is None:
             trans_params = TransParams()
         processed_text = self.preprocess_text(text)
@@ -161,125 +220,353 @@ class LlamaCppTranslator:
         source_lang_name = _sanitize_language(source_lang, default='English')
         target_lang_name = _sanitize_language(target_lang, default='Chinese')
 
-        if context:
-            user_content = f"Context: {context}\n\nTranslate the following {source_lang_name} text to {target_lang_name}. Only output the translation, nothing else.\n\n{source_lang_name}: {processed_text}"
-        else:
-            user_content = f"Translate the following {source_lang_name} text to {target_lang_name}. Only output the translation, nothing else.\n\n{source_lang_name}: {processed_text}"
+        prompt_builder = self._prompt_builder(trans_params)
+        system_content = prompt_builder.system_content(source_lang_name, target_lang_name)
+        user_content = prompt_builder.user_content(processed_text, source_lang_name, target_lang_name, context)
 
         try:
-            temperature = trans_params.temperature
-            top_k = trans_params.top_k
-            top_p = trans_params.top_p
-            repetition_penalty = trans_params.rep_penalty
-
-            if not self._server_manager.ensure_server_running():
-                raise RuntimeError("llama-server 启动失败，无法进行翻译")
-            text_len = len(processed_text)
-            if text_len <= trans_params.short_text_threshold:
-                n_predict = 64
-            elif text_len <= 20:
-                n_predict = max(32, text_len * 2)
-            else:
-                n_predict = max(64, text_len * 2)
-            max_context_tokens = getattr(self._server_manager, 'context_size', 4096)
-            system_prompt_tokens = _estimate_token_count(self.system_prompt, self._model_family)
-            estimated_prompt_tokens = system_prompt_tokens + _estimate_token_count(user_content, self._model_family) + sum(_estimate_token_count(m['content'], self._model_family) for m in self.chat_history)
-            if estimated_prompt_tokens > max_context_tokens:
-                while self.chat_history and estimated_prompt_tokens > max_context_tokens:
-                    removed = self.chat_history.pop(0)
-                    estimated_prompt_tokens -= _estimate_token_count(removed['content'])
-            max_n_predict = max_context_tokens - estimated_prompt_tokens - 200
-            if max_n_predict > 0:
-                n_predict = min(n_predict, max_n_predict)
-            else:
-                n_predict = min(n_predict, 256)
-            # 使用 trans_params.max_output_tokens 限制最大输出
-            n_predict = min(n_predict, trans_params.max_output_tokens)
-            n_predict = max(n_predict, 64)
-
-            messages = [{"role": "system", "content": self.system_prompt}]
-            messages.extend(self.chat_history)
-            messages.append({"role": "user", "content": user_content})
-
-            output = self._server_manager.send_chat_request(
-                messages,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                repeat_penalty=repetition_penalty,
-                n_predict=n_predict,
-                timeout=trans_params.request_timeout
-            )
-            
-            if output is None:
-                raise RuntimeError("llama-server 请求返回为空")
+            monitor = _StreamAbortMonitor(processed_text, source_lang, target_lang, trans_params) if trans_params.stream_abort else None
+            grammar = build_line_grammar(source_lang, target_lang) if trans_params.grammar else None
+            output_budget = self._output_budget([processed_text], source_lang, target_lang, trans_params)
+            output, truncated = self._send_translation_request(user_content, len(processed_text), trans_params,
+                                                               use_history=use_history, stream_monitor=monitor,
+                                                               system_content=system_content, temperature=temperature,
+                                                               grammar=grammar, output_budget=output_budget)
+            if monitor is not None and monitor.abort_reason:
+                # 提前中止的部分输出视为翻译失败，交由验证与重试流程处理
+                return "", processed_text
+            if truncated and output_budget is not None:
+                # 长度模型的预算偏紧，截断的译文可能仍通过验证；视为失败，重试时该文本改用固定规则
+                print(f"[长度模型] 输出达到预算上限被截断，改用固定规则重试: {processed_text[:50]}")
+                return "", processed_text
 
             if output == "":
                 print(f"[翻译] 警告：翻译返回为空，原文: {processed_text[:50]}")
 
-            output = output.strip()
-            
-            special_tokens = [
-                "<|startoftext|>", "</s>", "<|eos|>", 
-                "<|extra_0|>", "<|extra_4|>", "<|pad|>",
-                " [end of text]", "[end of text]"
-            ]
-            for token in special_tokens:
-                output = output.replace(token, "")
-            
-            translation = output.strip()
-            translation = " ".join(translation.split())
+            translation = " ".join(output.split())
 
             return translation, processed_text
 
         except Exception as e:
             raise RuntimeError(f"llama-server 翻译失败: {str(e)}") from e
 
-    def _translate_and_validate(self, text, source_lang, target_lang, trans_params, context, source_lang_name):
+    def _warm_up_prefix(self, trans_params, source_lang_name, target_lang_name):
+        """恢复或生成固定提示词前缀的 KV 状态，并登记为服务器重启后自动恢复的预热状态"""
+        manager = self._server_manager
+        if not manager.slot_cache:
+            return
+        system_content = self._prompt_builder(trans_params).system_content(source_lang_name, target_lang_name)
+        model_stem = os.path.splitext(os.path.basename(manager.model_path or "model"))[0]
+        digest = hashlib.sha1(system_content.encode('utf-8')).hexdigest()[:12]
+        filename = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{model_stem}-{digest}.bin")
+
+        start_time = time.time()
+        if manager.has_slot_state(filename) and manager.restore_slot_state(filename):
+            manager.set_warm_state(filename)
+            print(f"[llama-server翻译] 已恢复提示词前缀KV状态，耗时: {(time.time() - start_time) * 1000:.0f}ms")
+            return
+
+        output = manager.send_chat_request(
+            [{"role": "system", "content": system_content}, {"role": "user", "content": f"{source_lang_name}:"}],
+            n_predict=1, temperature=0.0, id_slot=0, timeout=trans_params.request_timeout,
+            telemetry=self._telemetry
+        )
+        if output is None or not manager.save_slot_state(filename, slot_id=0):
+            print(f"[llama-server翻译] 提示词前缀预热保存失败，跳过")
+            return
+        manager.set_warm_state(filename)
+        if manager.parallel_slots > 1:
+            manager.restore_slot_state(filename)
+        print(f"[llama-server翻译] 提示词前缀已预热并保存: {filename}，耗时: {(time.time() - start_time) * 1000:.0f}ms")
+
+    def _prompt_builder(self, trans_params):
+        return PromptBuilder(self.system_prompt, trans_params.prompt_layout)
+
+    def _send_translation_request(self, user_content, text_len, trans_params, use_history=True, num_lines=1, stream_monitor=None, system_content=None, temperature=None, grammar=None, output_budget=None):
+        """发送翻译请求，返回 (清理特殊 token 后的输出, 是否因达到 n_predict 被截断)
+
+        num_lines 大于 1 时为多行打包请求，输出预算按行数放大；
+        提供 stream_monitor 时以流式方式请求，监视器可提前中止生成；
+        output_budget 为长度模型估计的输出 token 数，提供时代替按字符数的固定规则
+        """
+        if not self._server_manager.ensure_server_running():
+            raise RuntimeError("llama-server 启动失败，无法进行翻译")
+        min_predict = 64
+        if output_budget is not None:
+            n_predict = output_budget
+            min_predict = 16
+        elif text_len <= trans_params.short_text_threshold:
+            n_predict = 64
+        elif text_len <= 20:
+            n_predict = max(32, text_len * 2)
+        else:
+            n_predict = max(64, text_len * 2)
+        max_output_tokens = trans_params.max_output_tokens
+        if num_lines > 1:
+            # 每行编号前缀与换行约占 4 个 token
+            n_predict += num_lines * 4
+            max_output_tokens *= num_lines
+        max_context_tokens = getattr(self._server_manager, 'slot_context_size', 4096)
+        system_content = system_content or self.system_prompt
+        counter = self._token_counter
+        with self._history_lock:
+            history = self.chat_history if use_history else []
+            estimated_prompt_tokens = counter.count_messages([{"content": system_content}, {"content": user_content}]) + counter.count_messages(history)
+            if estimated_prompt_tokens > max_context_tokens:
+                while history and estimated_prompt_tokens > max_context_tokens:
+                    removed = history.pop(0)
+                    estimated_prompt_tokens -= counter.count_messages([removed])
+            history = list(history)
+        max_n_predict = max_context_tokens - estimated_prompt_tokens - 200
+        if max_n_predict > 0:
+            n_predict = min(n_predict, max_n_predict)
+        else:
+            n_predict = min(n_predict, 256)
+        # 使用 trans_params.max_output_tokens 限制最大输出
+        n_predict = min(n_predict, max_output_tokens)
+        n_predict = max(n_predict, min_predict)
+
+        messages = [{"role": "system", "content": system_content}]
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_content})
+
+        with self._request_gate:
+            output = self._server_manager.send_chat_request(
+                messages,
+                temperature=trans_params.temperature if temperature is None else temperature,
+                top_k=trans_params.top_k,
+                top_p=trans_params.top_p,
+                repeat_penalty=trans_params.rep_penalty,
+                n_predict=n_predict,
+                timeout=trans_params.request_timeout,
+                stream_monitor=stream_monitor,
+                grammar=grammar,
+                telemetry=self._telemetry,
+                with_finish_reason=True
+            )
+
+        if output is None:
+            raise RuntimeError("llama-server 请求返回为空")
+
+        output, finish_reason = output
+        output = output.strip()
+
+        special_tokens = [
+            "<|startoftext|>", "</s>", "<|eos|>", 
+            "<|extra_0|>", "<|extra_4|>", "<|pad|>",
+            " [end of text]", "[end of text]"
+        ]
+        for token in special_tokens:
+            output = output.replace(token, "")
+
+        return output.strip(), finish_reason == "length"
+
+    def _translate_candidates(self, text, source_lang, target_lang, trans_params, context, use_history=True):
+        """同一提示词以不同温度并发采样多个候选，本地验证后保留目标语言占比最高的有效译文
+
+        Returns:
+            (translation, processed_text, is_valid)
+        """
+        count = trans_params.candidates
+        temperatures = [trans_params.temperature + k * trans_params.candidate_temperature_step for k in range(count)]
+        workers = min(count, self._server_manager.parallel_slots)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate-candidate") as executor:
+            futures = [
+                executor.submit(self._translate_multi_fallback, text, source_lang, target_lang, trans_params,
+                                context, use_history, temperature)
+                for temperature in temperatures
+            ]
+            results = []
+            errors = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+        if not results:
+            raise errors[0]
+
+        processed_text = results[0][1]
+        best = None
+        verdicts = validate_translations([(text, translation) for translation, _ in results],
+                                         source_lang, target_lang, trans_params=trans_params)
+        for k, ((translation, _), (valid, ratio)) in enumerate(zip(results, verdicts)):
+            if valid and (best is None or ratio > best[1]):
+                best = (translation, ratio, k)
+        if best is None:
+            fallback = next((t for t, _ in results if t), "")
+            return fallback, processed_text, False
+        if best[2] > 0:
+            print(f"[多候选] 采用第{best[2]+1}/{len(results)}个候选 (temperature={temperatures[best[2]]:.2f})")
+        return best[0], processed_text, True
+
+    def _translate_and_validate(self, text, source_lang, target_lang, trans_params, context, source_lang_name, use_history=True):
         """翻译并验证单个片段，验证通过时更新聊天历史"""
-        translation, processed_text = self._translate_multi_fallback(text, source_lang, target_lang, trans_params, context)
-        is_valid = is_translation_valid(text, translation, source_lang, target_lang, trans_params=trans_params)[0]
+        if trans_params.candidates > 1:
+            translation, processed_text, is_valid = self._translate_candidates(
+                text, source_lang, target_lang, trans_params, context, use_history=use_history
+            )
+        else:
+            translation, processed_text = self._translate_multi_fallback(text, source_lang, target_lang, trans_params, context, use_history=use_history)
+            is_valid = is_translation_valid(text, translation, source_lang, target_lang, trans_params=trans_params)[0]
 
+        self._record_constraint_result(trans_params, is_valid)
+        self._record_output_length(processed_text, translation, is_valid, source_lang, target_lang, trans_params)
         if is_valid:
+            self._remember(processed_text, translation, source_lang, target_lang, trans_params)
+
+        if is_valid and use_history:
             if processed_text.strip():
-                user_content = f"{source_lang_name}: {processed_text}"
-                self.chat_history.append({"role": "user", "content": user_content})
-                self.chat_history.append({"role": "assistant", "content": translation})
-                max_history_pairs = trans_params.seg_ctx_window
-                max_history_messages = max_history_pairs * 2
-                if len(self.chat_history) > max_history_messages:
-                    self.chat_history = self.chat_history[-max_history_messages:]
+                prompt_builder = self._prompt_builder(trans_params)
+                with self._history_lock:
+                    self.chat_history.extend(prompt_builder.history_entry(processed_text, translation, source_lang_name))
+                    self.chat_history = prompt_builder.trim_history(self.chat_history, trans_params.seg_ctx_window)
 
         return translation, processed_text, is_valid
 
-    def _translate_initial(self, segments, source_lang, target_lang, trans_params, progress_callback):
-        total_segments = len(segments)
-        source_lang_name = _sanitize_language(source_lang, default='English')
-
-        context_cache = []
+    def _record_constraint_result(self, trans_params, is_valid):
+        if self._constraint_stats is not None:
+            self._constraint_stats.record(trans_params.grammar, is_valid)
+
+    def _output_budget(self, texts, source_lang, target_lang, trans_params):
+        """按长度模型估计若干行文本的输出 token 总预算；未启用、样本不足或需回退固定规则时返回 None"""
+        if not trans_params.adaptive_output:
+            return None
+        total = 0
+        for text in texts:
+            if text in self._length_fallback:
+                return None
+            predicted = self._length_model.predict(source_lang, target_lang, self._token_counter.count(text),
+                                                   trans_params.output_length_quantile, model=self._translator_name)
+            if predicted is None:
+                return None
+            total += predicted
+        return total
+
+    def _record_output_length(self, processed_text, translation, is_valid, source_lang, target_lang, trans_params):
+        """验证通过的译文计入长度模型；失败的文本之后改用固定规则的输出预算"""
+        if not trans_params.adaptive_output or not processed_text.strip():
+            return
+        if is_valid:
+            # 比例以模型 token 计，/tokenize 不可用、只能字符估算时不记录样本
+            input_tokens = self._token_counter.count_exact(processed_text)
+            output_tokens = self._token_counter.count_exact(translation)
+            if input_tokens is not None and output_tokens is not None:
+                self._length_model.record(source_lang, target_lang, input_tokens, output_tokens,
+                                          model=self._translator_name)
+        else:
+            self._length_fallback.add(processed_text)
+
+    def _remember(self, processed_text, translation, source_lang, target_lang, trans_params):
+        """将已验证的翻译写入翻译记忆"""
+        if self._memory is None or not processed_text.strip():
+            return
+        key = TranslationMemory.make_key(processed_text, source_lang, target_lang, self._translator_name, trans_params)
+        self._memory.put(key, processed_text, translation)
+
+    def _open_memory(self, trans_params):
+        if trans_params.memory:
+            self._memory = TranslationMemory(max_entries=trans_params.memory_max_entries)
+            print(f"[翻译记忆] 已启用: {self._memory.db_path} (现有 {self._memory.stats()['entries']} 条)")
+
+    def _close_memory(self):
+        if self._memory is not None:
+            stats = self._memory.stats()
+            print(f"[翻译记忆] 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']:.1%}, "
+                  f"新增 {stats['stores']} 条, 淘汰 {stats['evictions']} 条, 共 {stats['entries']} 条")
+            self._memory.close()
+            self._memory = None
+
+    def _apply_translation_memory(self, segments, pending, source_lang, target_lang, trans_params):
+        """查询翻译记忆，命中的片段直接使用记忆译文，返回仍需请求模型的片段索引"""
+        if self._memory is None:
+            return pending
+        remaining = []
+        for i in pending:
+            seg = segments[i]
+            processed_text = self.preprocess_text(seg.get('text', ''))
+            key = TranslationMemory.make_key(processed_text, source_lang, target_lang, self._translator_name, trans_params)
+            translation = self._memory.get(key) if processed_text else None
+            if translation is None:
+                remaining.append(i)
+                continue
+            seg["translated"] = translation
+            seg["_validated"] = True
+        hit_count = len(pending) - len(remaining)
+        if hit_count:
+            print(f"[翻译记忆] 命中 {hit_count}/{len(pending)} 条，跳过模型请求")
+        return remaining
+
+    def _build_context(self, segments, start, end, trans_params):
+        """构建 segments[start:end] 前后片段的上下文"""
         max_ctx_tokens = trans_params.max_context_tokens
-        for i in range(total_segments):
-            current_text = segments[i].get('text', '')
-            if not current_text.strip() or max_ctx_tokens <= 0:
+        if max_ctx_tokens <= 0:
+            return ""
+        ctx_parts = []
+        ctx_token_count = 0
+        for j in range(max(0, start - trans_params.seg_ctx_window), start):
+            part = f"Previous: {segments[j].get('text', '')}"
+            part_tokens = self._token_counter.count(part)
+            if ctx_token_count + part_tokens > max_ctx_tokens:
+                break
+            ctx_parts.insert(0, part)
+            ctx_token_count += part_tokens
+        for j in range(end, min(len(segments), end + trans_params.seg_ctx_window)):
+            part = f"Next: {segments[j].get('text', '')}"
+            part_tokens = self._token_counter.count(part)
+            if ctx_token_count + part_tokens > max_ctx_tokens:
+                break
+            ctx_parts.append(part)
+            ctx_token_count += part_tokens
+        return " ".join(ctx_parts)
+
+    def _build_context_cache(self, segments, trans_params):
+        """为每个片段预先构建前后片段上下文"""
+        context_cache = []
+        for i in range(len(segments)):
+            if not segments[i].get('text', '').strip():
                 context_cache.append("")
                 continue
-            ctx_parts = []
-            ctx_token_count = 0
-            for j in range(max(0, i - trans_params.seg_ctx_window), i):
-                part = f"Previous: {segments[j].get('text', '')}"
-                part_tokens = _estimate_token_count(part, self._model_family)
-                if ctx_token_count + part_tokens > max_ctx_tokens:
-                    break
-                ctx_parts.insert(0, part)
-                ctx_token_count += part_tokens
-            for j in range(i + 1, min(len(segments), i + trans_params.seg_ctx_window + 1)):
-                part = f"Next: {segments[j].get('text', '')}"
-                part_tokens = _estimate_token_count(part, self._model_family)
-                if ctx_token_count + part_tokens > max_ctx_tokens:
-                    break
-                ctx_parts.append(part)
-                ctx_token_count += part_tokens
-            context_cache.append(" ".join(ctx_parts))
+            context_cache.append(self._build_context(segments, i, i + 1, trans_params))
+        return context_cache
+
+    def _use_concurrent(self, trans_params):
+        return trans_params.concurrent and self._server_manager.parallel_slots > 1
+
+    def _translate_segment(self, i, seg, total_segments, source_lang, target_lang, trans_params, context, source_lang_name, use_history=True):
+        """翻译单个片段（含单条重试），结果直接写回 seg"""
+        text = seg.get("text", "")
+        max_retries = trans_params.max_retries
+        retry_count = 0
+        seg_start_time = time.time()
+
+        while retry_count < max_retries:
+            try:
+                translation, processed_text, is_valid = self._translate_and_validate(
+                    text, source_lang, target_lang, trans_params, context, source_lang_name, use_history=use_history
+                )
+
+                if is_valid:
+                    seg["translated"] = translation
+                    seg["_validated"] = True
+                else:
+                    seg["translated"] = text
+                    seg["_validated"] = False
+
+                seg_elapsed = time.time() - seg_start_time
+                print(f'[翻译] 第{i+1}/{total_segments}条 ({seg_elapsed:.1f}s): "{text[:30]}..." → "{translation[:30]}..."')
+                break
+            except Exception as e:
+                retry_count += 1
+                self._server_manager.ensure_server_running()
+                print(f"[llama-server翻译] 翻译失败，第{retry_count}次重试: {str(e)}")
+                if retry_count >= max_retries:
+                    seg["translated"] = text
+                    print(f"[llama-server翻译] 多次重试失败，使用原文")
+
+    def _translate_initial(self, segments, source_lang, target_lang, trans_params, progress_callback):
+        total_segments = len(segments)
+        source_lang_name = _sanitize_language(source_lang, default='English')
 
         reset_session = trans_params.reset_session
         if reset_session:
@@ -288,53 +575,160 @@ class LlamaCppTranslator:
             self._server_manager.reset_session()
         else:
             self._server_manager.ensure_server_running()
+        self._token_counter.reset_failures()
+        self._warm_up_prefix(trans_params, source_lang_name, _sanitize_language(target_lang, default='Chinese'))
+
+        context_cache = self._build_context_cache(segments, trans_params)
 
-        processed_count = 0
+        pending = []
+        prefilled_count = 0
         for i, seg in enumerate(segments):
-            original_text = seg.get('text', '').strip()
-            if not original_text:
+            if not seg.get('text', '').strip():
                 seg['translated'] = ''
                 continue
+            if seg.get('_validated'):
+                # 边识别边翻译阶段已完成的片段
+                prefilled_count += 1
+                continue
+            pending.append(i)
 
-            text = seg.get("text", "")
-            context = context_cache[i]
-            max_retries = trans_params.max_retries
-            retry_count = 0
-            translation = None
-            seg_start_time = time.time()
+        processed_count = len(pending)
+        pending = self._apply_translation_memory(segments, pending, source_lang, target_lang, trans_params)
+        processed_count = processed_count - len(pending) + prefilled_count
+        if progress_callback and total_segments > 0 and processed_count:
+            progress_callback(int(processed_count / total_segments * 100))
 
-            while retry_count < max_retries:
-                try:
-                    translation, processed_text, is_valid = self._translate_and_validate(
-                        text, source_lang, target_lang, trans_params, context, source_lang_name
-                    )
+        if trans_params.pack_size > 1 and pending:
+            pending, processed_count = self._translate_packed(segments, pending, source_lang, target_lang, trans_params,
+                                                              source_lang_name, progress_callback, processed_count)
 
-                    if is_valid:
-                        seg["translated"] = translation
-                        seg["_validated"] = True
-                    else:
-                        seg["translated"] = text
-                        seg["_validated"] = False
-
-                    seg_elapsed = time.time() - seg_start_time
-                    print(f'[翻译] 第{i+1}/{total_segments}条 ({seg_elapsed:.1f}s): "{text[:30]}..." → "{translation[:30]}..."')
-                    break
-                except Exception as e:
-                    retry_count += 1
-                    self._server_manager.ensure_server_running()
-                    print(f"[llama-server翻译] 翻译失败，第{retry_count}次重试: {str(e)}")
-                    if retry_count >= max_retries:
-                        seg["translated"] = text
-                        print(f"[llama-server翻译] 多次重试失败，使用原文")
-
-            processed_count += 1
-            if progress_callback and total_segments > 0:
-                progress_callback(int(processed_count / total_segments * 100))
+        if self._use_concurrent(trans_params):
+            self._translate_initial_concurrent(segments, pending, source_lang, target_lang, trans_params,
+                                               context_cache, source_lang_name, progress_callback, processed_count)
+        else:
+            for i in pending:
+                self._translate_segment(i, segments[i], total_segments, source_lang, target_lang,
+                                        trans_params, context_cache[i], source_lang_name)
+                processed_count += 1
+                if progress_callback and total_segments > 0:
+                    progress_callback(int(processed_count / total_segments * 100))
 
         success_count = sum(1 for seg in segments if seg.get("_validated", False))
         untranslated_indices = [i for i, seg in enumerate(segments) if not seg.get("_validated", False) and seg.get('text', '').strip()]
         return segments, success_count, untranslated_indices, context_cache
 
+    def _translate_initial_concurrent(self, segments, pending, source_lang, target_lang, trans_params,
+                                      context_cache, source_lang_name, progress_callback, processed_count=0):
+        """按并行槽数并发翻译，结果按索引写回，保证顺序与原片段一致"""
+        total_segments = len(segments)
+        workers = self._server_manager.parallel_slots
+        print(f"[llama-server翻译] 并发翻译模式: {workers} 个并行槽")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate") as executor:
+            futures = [
+                executor.submit(self._translate_segment, i, segments[i], total_segments, source_lang, target_lang,
+                                trans_params, context_cache[i], source_lang_name, False)
+                for i in pending
+            ]
+            for future in as_completed(futures):
+                future.result()
+                processed_count += 1
+                if progress_callback and total_segments > 0:
+                    progress_callback(int(processed_count / total_segments * 100))
+
+    def _translate_packed_group(self, segments, group, source_lang, target_lang, trans_params, source_lang_name):
+        """将连续多个片段编号打包为一次请求，逐行解析并验证，返回未通过的片段索引"""
+        target_lang_name = _sanitize_language(target_lang, default='Chinese')
+        processed_lines = [self.preprocess_text(segments[idx].get('text', '')) for idx in group]
+        packed_text = "\n".join(f"{n}. {line}" for n, line in enumerate(processed_lines, 1))
+        instruction = (
+            f"Translate each numbered {source_lang_name} line below to {target_lang_name}. "
+            f"Output exactly {len(group)} lines, each starting with the same number followed by a period, "
+            f"one translation per line, nothing else."
+        )
+        context = self._build_context(segments, group[0], group[-1] + 1, trans_params)
+        if context:
+            user_content = f"Context: {context}\n\n{instruction}\n\n{packed_text}"
+        else:
+            user_content = f"{instruction}\n\n{packed_text}"
+
+        group_start_time = time.time()
+        try:
+            grammar = build_packed_grammar(len(group), source_lang, target_lang) if trans_params.grammar else None
+            output_budget = self._output_budget(processed_lines, source_lang, target_lang, trans_params)
+            output, truncated = self._send_translation_request(user_content, len(packed_text), trans_params,
+                                                               use_history=False, num_lines=len(group), grammar=grammar,
+                                                               output_budget=output_budget)
+        except Exception as e:
+            print(f"[llama-server翻译] 打包翻译失败，回退逐条翻译: {str(e)}")
+            return list(group)
+
+        parsed = _parse_packed_output(output)
+        translations = [" ".join(parsed.get(n, '').split()) for n in range(1, len(group) + 1)]
+        if truncated and output_budget is not None:
+            # 按长度模型预算截断时最后一行可能不完整，视为失败（未输出的行本就为空）
+            last = max((n for n, translation in enumerate(translations) if translation), default=None)
+            if last is not None:
+                print(f"[长度模型] 打包输出达到预算上限被截断，第{group[last]+1}条改用固定规则重试")
+                translations[last] = ""
+        verdicts = validate_translations([(segments[idx].get('text', ''), translation) for idx, translation in zip(group, translations)],
+                                         source_lang, target_lang, trans_params=trans_params)
+        failed = []
+        for idx, processed_text, translation, (valid, _) in zip(group, processed_lines, translations, verdicts):
+            seg = segments[idx]
+            is_valid = bool(translation) and valid
+            self._record_constraint_result(trans_params, is_valid)
+            self._record_output_length(processed_text, translation, is_valid, source_lang, target_lang, trans_params)
+            if is_valid:
+                seg["translated"] = translation
+                seg["_validated"] = True
+                self._remember(processed_text, translation, source_lang, target_lang, trans_params)
+            else:
+                failed.append(idx)
+
+        group_elapsed = time.time() - group_start_time
+        print(f"[打包翻译] 第{group[0]+1}-{group[-1]+1}条 ({group_elapsed:.1f}s): 通过 {len(group) - len(failed)}/{len(group)}")
+        return failed
+
+    def _translate_packed(self, segments, pending, source_lang, target_lang, trans_params, source_lang_name, progress_callback, processed_count=0):
+        """打包翻译模式：每 pack_size 条连续片段合并为一次请求
+
+        Returns:
+            (需要逐条翻译的片段索引, 已完成的片段数)
+        """
+        total_segments = len(segments)
+        pack_size = trans_params.pack_size
+        groups = [pending[k:k + pack_size] for k in range(0, len(pending), pack_size)]
+        print(f"[llama-server翻译] 打包翻译模式: 每组 {pack_size} 条，共 {len(groups)} 组")
+
+        fallback = []
+
+        def _collect(group, failed):
+            nonlocal processed_count
+            fallback.extend(failed)
+            processed_count += len(group) - len(failed)
+            if progress_callback and total_segments > 0:
+                progress_callback(int(processed_count / total_segments * 100))
+
+        if self._use_concurrent(trans_params):
+            with ThreadPoolExecutor(max_workers=self._server_manager.parallel_slots, thread_name_prefix="translate-packed") as executor:
+                futures = {
+                    executor.submit(self._translate_packed_group, segments, group, source_lang, target_lang,
+                                    trans_params, source_lang_name): group
+                    for group in groups
+                }
+                for future in as_completed(futures):
+                    _collect(futures[future], future.result())
+        else:
+            for group in groups:
+                _collect(group, self._translate_packed_group(segments, group, source_lang, target_lang,
+                                                             trans_params, source_lang_name))
+
+        fallback.sort()
+        if fallback:
+            print(f"[llama-server翻译] 打包翻译有 {len(fallback)} 条解析或验证失败，回退逐条翻译")
+        return fallback, processed_count
+
     def _validate_translations(self, segments, source_lang, target_lang):
         success_count = sum(1 for seg in segments if seg.get("_validated", False))
         failed_indices = [i for i, seg in enumerate(segments) if not seg.get("_validated", False) and seg.get('text', '').strip()]
@@ -342,50 +736,68 @@ class LlamaCppTranslator:
         print(f"[llama-server翻译] 验证完成: 成功 {success_count} 个, 失败 {fail_count} 个")
         return segments, failed_indices
 
-    def _retry_untranslated(self, segments, remaining_indices, source_lang, target_lang, trans_params, context_cache):
+    def _retry_segment(self, idx, segments, retry_count, source_lang, target_lang, trans_params, context_cache, source_lang_name, use_history=True):
+        """重新翻译单个片段，返回是否翻译成功"""
         total_segments = len(segments)
-        source_lang_name = _sanitize_language(source_lang, default='English')
-        max_total_retries = trans_params.max_total_retries
-        current_retries = {idx: 0 for idx in remaining_indices}
+        segment = segments[idx]
+        text = segment.get("text", "")
+        if len(text) <= trans_params.short_text_threshold:
+            context = ""
+        else:
+            context = context_cache[idx]
 
-        while remaining_indices and max(current_retries.values()) < max_total_retries:
-            current_batch = remaining_indices.copy()
-            remaining_indices = []
+        print(f"[llama-server翻译] 重新翻译片段 {idx+1}/{total_segments} (第{retry_count}次): {text[:30]}...")
 
-            for idx in current_batch:
-                segment = segments[idx]
-                text = segment.get("text", "")
-                if len(text) <= trans_params.short_text_threshold:
-                    context = ""
-                else:
-                    context = context_cache[idx]
-
-                current_retries[idx] += 1
-                retry_count = current_retries[idx]
+        retry_start_time = time.time()
+        try:
+            translation, processed_text, is_valid = self._translate_and_validate(
+                text, source_lang, target_lang, trans_params, context, source_lang_name, use_history=use_history
+            )
 
-                if retry_count > max_total_retries:
-                    segment["translated"] = text
-                    print(f"[llama-server翻译] 片段 {idx+1} 达到最大重试次数 {max_total_retries}，使用原文")
-                    continue
+            if is_valid:
+                segment["translated"] = translation
+                retry_elapsed = time.time() - retry_start_time
+                print(f'[翻译] 第{idx+1}/{total_segments}条 ({retry_elapsed:.1f}s): "{text[:30]}..." → "{translation[:30]}..."')
+            return is_valid
+        except Exception as e:
+            self._server_manager.ensure_server_running()
+            print(f"[llama-server翻译] 重新翻译失败，第{retry_count}次重试: {str(e)}")
+            return False
 
-                print(f"[llama-server翻译] 重新翻译片段 {idx+1}/{total_segments} (第{retry_count}次): {text[:30]}...")
+    def _retry_untranslated(self, segments, remaining_indices, source_lang, target_lang, trans_params, context_cache):
+        source_lang_name = _sanitize_language(source_lang, default='English')
+        max_total_retries = trans_params.max_total_retries
+        current_retries = {idx: 0 for idx in remaining_indices}
+        concurrent = self._use_concurrent(trans_params)
+        executor = ThreadPoolExecutor(max_workers=self._server_manager.parallel_slots, thread_name_prefix="translate-retry") if concurrent else None
 
-                retry_start_time = time.time()
-                try:
-                    translation, processed_text, is_valid = self._translate_and_validate(
-                        text, source_lang, target_lang, trans_params, context, source_lang_name
-                    )
-
-                    if is_valid:
-                        segment["translated"] = translation
-                        retry_elapsed = time.time() - retry_start_time
-                        print(f'[翻译] 第{idx+1}/{total_segments}条 ({retry_elapsed:.1f}s): "{text[:30]}..." → "{translation[:30]}..."')
-                    else:
-                        remaining_indices.append(idx)
-                except Exception as e:
-                    self._server_manager.ensure_server_running()
-                    print(f"[llama-server翻译] 重新翻译失败，第{retry_count}次重试: {str(e)}")
-                    remaining_indices.append(idx)
+        try:
+            while remaining_indices and max(current_retries.values()) < max_total_retries:
+                current_batch = []
+                for idx in remaining_indices:
+                    current_retries[idx] += 1
+                    if current_retries[idx] > max_total_retries:
+                        segments[idx]["translated"] = segments[idx].get("text", "")
+                        print(f"[llama-server翻译] 片段 {idx+1} 达到最大重试次数 {max_total_retries}，使用原文")
+                        continue
+                    current_batch.append(idx)
+
+                if executor is not None:
+                    results = list(executor.map(
+                        lambda idx: self._retry_segment(idx, segments, current_retries[idx], source_lang, target_lang,
+                                                        trans_params, context_cache, source_lang_name, use_history=False),
+                        current_batch
+                    ))
+                else:
+                    results = [
+                        self._retry_segment(idx, segments, current_retries[idx], source_lang, target_lang,
+                                            trans_params, context_cache, source_lang_name)
+                        for idx in current_batch
+                    ]
+                remaining_indices = [idx for idx, ok in zip(current_batch, results) if not ok]
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
 
         if remaining_indices:
             print(f"[llama-server翻译] 仍有 {len(remaining_indices)} 个片段翻译失败，使用原文")
@@ -395,6 +807,86 @@ class LlamaCppTranslator:
         print(f"[llama-server翻译] 重新翻译完成")
         return segments
 
+    def _translate_stream_group(self, segments, group, source_lang, target_lang, trans_params, source_lang_name, use_history):
+        """翻译流式接收的一组连续片段：翻译记忆 → 打包请求 → 逐条翻译"""
+        pending = []
+        for i in group:
+            if not segments[i].get('text', '').strip():
+                segments[i]['translated'] = ''
+                continue
+            pending.append(i)
+        pending = self._apply_translation_memory(segments, pending, source_lang, target_lang, trans_params)
+        if len(pending) > 1:
+            pending = self._translate_packed_group(segments, pending, source_lang, target_lang, trans_params, source_lang_name)
+        for i in pending:
+            context = self._build_context(segments, i, i + 1, trans_params)
+            self._translate_segment(i, segments[i], len(segments), source_lang, target_lang,
+                                    trans_params, context, source_lang_name, use_history)
+
+    def translate_stream(self, channel, source_lang="en", target_lang="zh", trans_params: TransParams = None, cancelled=None):
+        """从队列逐条接收识别定稿的片段并翻译，收到 None 表示识别结束
+
+        片段 i 在收到其后 seg_ctx_window 条片段（或识别结束）后才开始翻译，上下文与整批翻译一致；
+        验证失败的片段保留 _validated=False，由随后的整批翻译重试。
+
+        Returns:
+            已接收的片段列表（含 translated / _validated）
+        """
+        if trans_params is None:
+            trans_params = TransParams()
+        source_lang_name = _sanitize_language(source_lang, default='English')
+        lookahead = max(0, trans_params.seg_ctx_window)
+        group_size = max(1, trans_params.pack_size)
+        concurrent = self._use_concurrent(trans_params)
+
+        if trans_params.reset_session:
+            self.chat_history = []
+            self._server_manager.reset_session()
+        else:
+            self._server_manager.ensure_server_running()
+        self._token_counter.reset_failures()
+        self._warm_up_prefix(trans_params, source_lang_name, _sanitize_language(target_lang, default='Chinese'))
+        print(f"[边识别边翻译] 翻译线程就绪，前瞻 {lookahead} 条片段后开始翻译")
+
+        segments = []
+        next_index = 0
+        finished = False
+        futures = []
+        self._open_memory(trans_params)
+        executor = ThreadPoolExecutor(max_workers=self._server_manager.parallel_slots, thread_name_prefix="translate-stream") if concurrent else None
+        try:
+            while not finished:
+                item = channel.get()
+                if item is None:
+                    finished = True
+                else:
+                    segments.append(item)
+                if cancelled is not None and cancelled():
+                    continue
+
+                ready_end = len(segments) if finished else len(segments) - lookahead
+                while next_index < ready_end:
+                    if not finished and ready_end - next_index < group_size:
+                        break
+                    group = list(range(next_index, min(next_index + group_size, ready_end)))
+                    next_index = group[-1] + 1
+                    if executor is not None:
+                        futures.append(executor.submit(self._translate_stream_group, segments, group, source_lang,
+                                                       target_lang, trans_params, source_lang_name, False))
+                    else:
+                        self._translate_stream_group(segments, group, source_lang, target_lang,
+                                                     trans_params, source_lang_name, True)
+            for future in futures:
+                future.result()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self._close_memory()
+
+        validated = sum(1 for seg in segments if seg.get('_validated'))
+        print(f"[边识别边翻译] 识别期间接收 {len(segments)} 条片段，翻译通过 {validated} 条")
+        return segments
+
     def translate_batch(self, segments, source_lang="en", target_lang="zh", progress_callback=None, trans_params: TransParams = None):
         if trans_params is None:
             trans_params = TransParams()
@@ -405,19 +897,35 @@ class LlamaCppTranslator:
 
         batch_start_time = time.time()
 
-        segments, translated_count, untranslated_indices, context_cache = self._translate_initial(
-            segments, source_lang, target_lang, trans_params, progress_callback
-        )
+        self._constraint_stats = ConstraintStats()
+        self._length_fallback.clear()
+        # 结束时打印的 token 计数、KV 缓存与推测解码统计只反映本批次
+        self._token_counter.reset_stats()
+        self._server_manager.reset_prompt_cache_stats()
+        if trans_params.grammar:
+            print(f"[输出约束] 已启用 GBNF 语法约束（单行输出/目标语言文字）")
+        if trans_params.candidates > self._server_manager.parallel_slots:
+            print(f"[多候选] 警告：每条 {trans_params.candidates} 个候选超过并行槽数 {self._server_manager.parallel_slots}，"
+                  f"超出的候选排队依次生成，每条片段的生成量为单候选的 {trans_params.candidates} 倍")
 
-        print(f"[llama-server翻译] 单条翻译完成，共翻译 {total_segments} 个片段")
+        self._open_memory(trans_params)
 
-        segments, failed_indices = self._validate_translations(segments, source_lang, target_lang)
+        try:
+            segments, translated_count, untranslated_indices, context_cache = self._translate_initial(
+                segments, source_lang, target_lang, trans_params, progress_callback
+            )
 
-        if failed_indices:
-            print(f"[llama-server翻译] 发现 {len(failed_indices)} 个片段未翻译或翻译失败，开始重新翻译...")
-            segments = self._retry_untranslated(segments, failed_indices, source_lang, target_lang, trans_params, context_cache)
-        else:
-            print(f"[llama-server翻译] 所有片段翻译成功，无需重新翻译")
+            print(f"[llama-server翻译] 单条翻译完成，共翻译 {total_segments} 个片段")
+
+            segments, failed_indices = self._validate_translations(segments, source_lang, target_lang)
+
+            if failed_indices:
+                print(f"[llama-server翻译] 发现 {len(failed_indices)} 个片段未翻译或翻译失败，开始重新翻译...")
+                segments = self._retry_untranslated(segments, failed_indices, source_lang, target_lang, trans_params, context_cache)
+            else:
+                print(f"[llama-server翻译] 所有片段翻译成功，无需重新翻译")
+        finally:
+            self._close_memory()
 
         for seg in segments:
             seg.pop("_validated", None)
@@ -425,6 +933,21 @@ class LlamaCppTranslator:
         batch_elapsed = time.time() - batch_start_time
         avg_time = batch_elapsed / total_segments if total_segments > 0 else 0
         print(f"[llama-server翻译] 翻译统计: 共 {total_segments} 条, 总耗时 {batch_elapsed:.1f}s, 平均 {avg_time:.2f}s/条")
+        token_stats = self._token_counter.stats()
+        print(f"[token计数] /tokenize 请求 {token_stats['server_calls']} 次, 缓存命中 {token_stats['hits']} 次, 估算 {token_stats['estimates']} 次")
+        print(f"[输出约束] 验证失败率 — {self._constraint_stats.summary()}")
+        self._constraint_stats.save()
+        self._constraint_stats = None
+        if trans_params.adaptive_output:
+            print(f"[长度模型] {self._length_model.summary(source_lang, target_lang, trans_params.output_length_quantile, model=self._translator_name)}")
+            self._length_model.save()
+        cache_stats = self._server_manager.get_prompt_cache_stats()
+        if cache_stats['requests']:
+            print(f"[KV缓存] 请求 {cache_stats['requests']} 次, prompt 共 {cache_stats['prompt_total']} tokens, "
+                  f"其中复用缓存 {cache_stats['cache_n']} tokens, 重新计算 {cache_stats['prompt_n']} tokens, 复用率 {cache_stats['reuse_rate']:.1%}")
+        if cache_stats['draft_n']:
+            print(f"[推测解码] 草稿 {cache_stats['draft_n']} tokens, 接受 {cache_stats['draft_n_accepted']} tokens, "
+                  f"接受率 {cache_stats['draft_acceptance']:.1%}, 共生成 {cache_stats['predicted_n']} tokens")
 
         return segments
 
@@ -439,20 +962,26 @@ def get_local_model_path(model_path):
 
 
 def translate_text(recognized_result, model_path, progress_callback=None,
-                   target_language="zh", trans_params: TransParams = None, server_params: ServerParams = None):
-    """翻译识别结果"""
+                   target_language="zh", trans_params: TransParams = None, server_params: ServerParams = None,
+                   pipeline=None, telemetry=None):
+    """翻译识别结果
+
+    pipeline 为识别期间已运行的 PipelinedTranslation 时，复用其翻译器与已完成的译文，只补充翻译其余片段；
+    telemetry 为 ServerTelemetry 时记录翻译期间的请求 timings 与服务器指标
+    """
     if trans_params is None:
         trans_params = TransParams()
     if not target_language:
         target_language = "zh"
+    server_params = server_params or ServerParams.from_dict(config.get_all())
 
-    local_model_path = get_local_model_path(model_path)
+    local_model_path = "mock" if server_params.mock else get_local_model_path(model_path)
     if not local_model_path:
         error_msg = f"本地模型不存在: {model_path}，请确保模型已在models目录中"
         print(f"[错误信息] {error_msg}")
         raise FileNotFoundError(error_msg)
 
-    translated_result = translate_with_llama_server(recognized_result, progress_callback, target_language, trans_params, server_params)
+    translated_result = translate_with_llama_server(recognized_result, progress_callback, target_language, trans_params, server_params, pipeline, telemetry)
     
     if 'segments' in translated_result:
         has_translation = any('translated' in seg for seg in translated_result['segments'])
@@ -461,7 +990,7 @@ def translate_text(recognized_result, model_path, progress_callback=None,
     return translated_result
 
 
-def translate_with_llama_server(recognized_result, progress_callback, target_language, trans_params=None, server_params=None):
+def translate_with_llama_server(recognized_result, progress_callback, target_language, trans_params=None, server_params=None, pipeline=None, telemetry=None):
     """使用 llama-server HTTP API 运行 GGUF 模型进行翻译"""
     if trans_params is None:
         trans_params = TransParams()
@@ -495,8 +1024,14 @@ def translate_with_llama_server(recognized_result, progress_callback, target_lan
             original_text = seg.get('text', '')
             seg['original_text'] = original_text
     
-    server_params = server_params or ServerParams.from_dict(config.get_all())
-    translator = LlamaCppTranslator(server_params=server_params)
+    if pipeline is not None:
+        translator = pipeline.translator
+        _apply_streamed_translations(segments, pipeline.segments)
+    else:
+        server_params = server_params or ServerParams.from_dict(config.get_all())
+        translator = LlamaCppTranslator(server_params=server_params)
+    if telemetry is not None:
+        translator.attach_telemetry(telemetry)
 
     try:
         translated_segments = translator.translate_batch(
@@ -516,4 +1051,100 @@ def translate_with_llama_server(recognized_result, progress_callback, target_lan
         
         return recognized_result
     finally:
+        if telemetry is not None:
+            telemetry.stop()
+            translator.attach_telemetry(None)
         clear_translator_cache(translator._server_manager)
+
+
+def _apply_streamed_translations(segments, streamed):
+    """将边识别边翻译得到的译文按文本序列对齐写回最终片段
+
+    识别后处理（强制对齐等）不改变断句时两者逐条一致；个别片段不一致时只有这些片段留给整批翻译
+    """
+    final_texts = [seg.get('text', '').strip() for seg in segments]
+    streamed_texts = [seg.get('text', '').strip() for seg in streamed]
+    matcher = SequenceMatcher(None, final_texts, streamed_texts, autojunk=False)
+    reused = 0
+    for block in matcher.get_matching_blocks():
+        for k in range(block.size):
+            done = streamed[block.b + k]
+            if done.get('_validated') and done.get('translated'):
+                seg = segments[block.a + k]
+                seg['translated'] = done['translated']
+                seg['_validated'] = True
+                reused += 1
+    print(f"[边识别边翻译] 复用识别期间的译文 {reused}/{len(segments)} 条，其余片段补充翻译")
+
+
+class PipelinedTranslation:
+    """边识别边翻译：识别定稿的片段经有界队列送入后台翻译线程
+
+    put() 作为识别的 segment_callback；队列满时阻塞识别，避免翻译落后过多时片段无限堆积
+    """
+
+    def __init__(self, source_lang, target_lang, trans_params: TransParams = None, server_params: ServerParams = None, queue_size=64,
+                 telemetry=None):
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.trans_params = trans_params or TransParams()
+        self.translator = LlamaCppTranslator(server_params=server_params or ServerParams.from_dict(config.get_all()))
+        self.telemetry = telemetry
+        self.segments = []
+        self._channel = queue.Queue(maxsize=max(1, queue_size))
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def start(self):
+        if self.telemetry is not None:
+            self.translator.attach_telemetry(self.telemetry)
+        self._thread = threading.Thread(target=self._run, name="translate-pipeline", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.segments = self.translator.translate_stream(
+                self._channel, self.source_lang, self.target_lang, self.trans_params,
+                cancelled=self._cancelled.is_set
+            )
+        except Exception as e:
+            self._error = e
+            print(f"[边识别边翻译] 翻译线程失败，识别结束后将整批翻译: {e}")
+            # 继续取空队列，避免识别线程阻塞在已满的队列上
+            while True:
+                try:
+                    if self._channel.get(timeout=1.0) is None:
+                        break
+                except queue.Empty:
+                    if self._finished.is_set():
+                        break
+
+    def put(self, segment):
+        """推送一条定稿片段（队列已满时等待翻译线程取走）"""
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self._channel.put(segment, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        """通知识别结束并等待翻译线程完成，返回识别期间完成的片段列表"""
+        self._finished.set()
+        self.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        if self._error is not None:
+            self.segments = []
+        return self.segments
+
+    def cancel(self):
+        """放弃尚未开始的翻译并停止 llama-server"""
+        self._cancelled.set()
+        self.finish()
+        if self.telemetry is not None:
+            self.telemetry.stop()
+            self.translator.attach_telemetry(None)
+        clear_translator_cache(self.translator._server_manager)
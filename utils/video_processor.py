@@ -20,6 +20,13 @@ def _get_allowed_dirs():
 
 _ALLOWED_DIRS = _get_allowed_dirs()
 
+def allow_directory(path):
+    """将目录加入允许访问的范围（命令行批处理原地读取视频、写出字幕时使用）"""
+    resolved = os.path.realpath(path)
+    if resolved not in _ALLOWED_DIRS:
+        _ALLOWED_DIRS.append(resolved)
+    return resolved
+
 def validate_path(file_path):
     if not file_path or not isinstance(file_path, str):
         raise ValueError("路径不能为空且必须为字符串")
@@ -27,7 +27,8 @@ from typing import List, Dict, Any, Optional, Tuple, Callable
 
 
 from utils.video_processor import find_ffmpeg
-from config import config, CdParams
+from utils.dtw_aligner import compute_token_timestamps, attach_alignments, TIME_PRECISION
+from config import config, CdParams, model_registry
 
 _GLOBAL_PUNCT_CACHE = None
 _GLOBAL_PUNCT_CACHE_KEY = None
@@ -475,6 +476,9 @@ class SegmentProcessor:
                 prev['end'] = seg['end']
                 if '_token_ids' in prev and '_token_ids' in seg:
                     prev['_token_ids'] = prev.get('_token_ids', []) + seg.get('_token_ids', [])
+                if seg.get('words') or seg.get('chars'):
+                    prev['words'] = prev.get('words', []) + seg.get('words', [])
+                    prev['chars'] = prev.get('chars', []) + seg.get('chars', [])
             else:
                 result.append(seg.copy())
 
@@ -501,6 +505,9 @@ class SegmentProcessor:
                 prev['end'] = seg['end']
                 if '_token_ids' in prev and '_token_ids' in seg:
                     prev['_token_ids'] = prev.get('_token_ids', []) + seg.get('_token_ids', [])
+                if seg.get('words') or seg.get('chars'):
+                    prev['words'] = prev.get('words', []) + seg.get('words', [])
+                    prev['chars'] = prev.get('chars', []) + seg.get('chars', [])
             else:
                 result.append(seg.copy())
 
@@ -690,7 +697,7 @@ class WhisperCDOriginal:
 
     def __init__(self, model_path: str, device: str = "auto",
                  cd_params: CdParams = None, enable_alignment: bool = True,
-                 enable_cd_comparison: bool = False):
+                 enable_cd_comparison: bool = False, dtw_timestamps: bool = False):
         """初始化Whisper-CD处理器
 
         Args:
@@ -698,6 +705,7 @@ class WhisperCDOriginal:
             device: 设备
             cd_params: 对比解码参数
             enable_alignment: 是否启用强制对齐
+            dtw_timestamps: 是否在解码时通过交叉注意力 DTW 生成词级/字符级时间戳
         """
         os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True'
         self.model_path = model_path
@@ -711,6 +719,7 @@ class WhisperCDOriginal:
         self.temporal_shift = cd_params.temporal_shift
         self.enable_alignment = enable_alignment
         self.enable_cd_comparison = enable_cd_comparison
+        self.dtw_timestamps = dtw_timestamps
         self.context_max_tokens = cd_params.ctx_tokens
         self._segment_processor = SegmentProcessor(cd_params)
         self._timestamp_parser = TimestampParser(cd_params, self._segment_processor)
@@ -732,12 +741,12 @@ class WhisperCDOriginal:
             }
 
             if model_path in model_patterns:
-                potential_path = os.path.join("models", f"openai--whisper-{model_patterns[model_path]}")
-                if os.path.isdir(potential_path):
+                potential_path = model_registry.find_dir(f"openai--whisper-{model_patterns[model_path]}")
+                if potential_path:
                     local_model_path = potential_path
         elif "large-v3-turbo" in model_path:
-            local_v3_turbo_path = os.path.join("models", "openai--whisper-large-v3-turbo")
-            if os.path.exists(os.path.join(local_v3_turbo_path, "model.safetensors")):
+            local_v3_turbo_path = model_registry.find_dir("openai--whisper-large-v3-turbo")
+            if local_v3_turbo_path and os.path.exists(os.path.join(local_v3_turbo_path, "model.safetensors")):
                 local_model_path = local_v3_turbo_path
 
         if not os.path.isdir(local_model_path):
@@ -1242,13 +1251,51 @@ class WhisperCDOriginal:
         self._collect_decoded_tokens(ctx, outputs, prompt_ids, effective_alpha, attention_mask, sot_id)
         return outputs, prompt_ids, contrastive_processor
 
-    def _extract_results(self, outputs, prompt_ids, original_audio_length=0, language=None, temperature=0.0):
+    def _attach_dtw_alignments(self, segments, sequences, encoder_output, original_audio_length, language):
+        """通过对齐头交叉注意力 + DTW 为段落填充 words / chars（片段内相对时间）"""
+        tokenizer = self.whisper_processor.tokenizer
+        first_seq = sequences[0]
+        token_ids = first_seq.cpu().tolist() if hasattr(first_seq, 'cpu') else list(first_seq)
+        timestamp_begin = getattr(self._segment_processor, '_timestamp_begin_cache', 50364)
+        special_ids = set(tokenizer.all_special_ids)
+
+        prefix_len = 0
+        while (prefix_len < len(token_ids)
+               and token_ids[prefix_len] in special_ids
+               and token_ids[prefix_len] < timestamp_begin
+               and token_ids[prefix_len] != tokenizer.eos_token_id):
+            prefix_len += 1
+        if prefix_len == 0:
+            return
+
+        try:
+            timestamps = compute_token_timestamps(
+                self.whisper_model, encoder_output, token_ids, prefix_len,
+                num_frames=original_audio_length / TIME_PRECISION
+            )
+        except Exception as e:
+            print(f"[DTW对齐] 交叉注意力时间戳计算失败: {e}")
+            return
+        if timestamps is None:
+            return
+
+        timed_tokens = [
+            (tid, start, end)
+            for tid, (start, end) in zip(token_ids[prefix_len:], timestamps)
+            if tid < timestamp_begin and tid not in special_ids
+        ]
+        attach_alignments(segments, timed_tokens, tokenizer, language, special_ids)
+        print(f"[DTW对齐] 交叉注意力对齐完成，token数: {len(timed_tokens)}")
+
+    def _extract_results(self, outputs, prompt_ids, original_audio_length=0, language=None, temperature=0.0, encoder_output=None):
         if isinstance(outputs, dict) and "sequences" in outputs:
             sequences = outputs["sequences"]
             sequences = self._trim_prompt_tokens(sequences, prompt_ids)
             transcription = self.whisper_processor.batch_decode(sequences, skip_special_tokens=True)[0]
 
             segments = self._timestamp_parser.parse_timestamps_from_sequence(sequences, original_audio_length, tokenizer=self.whisper_processor.tokenizer, language=language)
+            if self.dtw_timestamps and encoder_output is not None and segments:
+                self._attach_dtw_alignments(segments, sequences, encoder_output, original_audio_length, language)
             avg_logprob = self._compute_avg_logprob_from_outputs(outputs, sequences)
             print(f"[DEBUG] [指标提取] avg_logprob={avg_logprob:.4f}, scores数量={len(outputs.get('scores', [])) if isinstance(outputs, dict) else len(getattr(outputs, 'scores', []))}, segments数={len(segments)}")
 
@@ -1303,7 +1350,7 @@ class WhisperCDOriginal:
         )
         outputs, prompt_ids, contrastive_processor = self._run_decoding(ctx)
 
-        segments, info = self._extract_results(outputs, prompt_ids, original_audio_length=original_audio_length, language=language, temperature=temperature)
+        segments, info = self._extract_results(outputs, prompt_ids, original_audio_length=original_audio_length, language=language, temperature=temperature, encoder_output=clean_encoder_output)
 
         if contrastive_processor.past_key_values is not None:
             del contrastive_processor.past_key_values
@@ -1446,6 +1493,9 @@ class WhisperCDOriginal:
             if isinstance(segment, dict):
                 segment['start'] = abs_start
                 segment['end'] = abs_end
+                for item in segment.get('words', []) + segment.get('chars', []):
+                    item['start'] = start_time + item['start']
+                    item['end'] = start_time + item['end']
             else:
                 segment.start = abs_start
                 segment.end = abs_end
@@ -1457,13 +1507,8 @@ class WhisperCDOriginal:
             result_segments.append(segment)
         return result_segments
 
-    def _postprocess_segments(self, processed_segments, detected_language):
-        """全局后处理：清理临时字段、过滤空文本、合并片段、构建结果"""
-        language_probability = 1.0
-
-        for seg in processed_segments:
-            seg.pop('_token_count', None)
-
+    def _merge_segments(self, processed_segments, detected_language):
+        """过滤空文本并执行跨边界合并与短片段合并（合并结果为副本，不修改输入片段）"""
         final_segments = []
         for seg in processed_segments:
             text = seg.get('text', '') if isinstance(seg, dict) else getattr(seg, 'text', '')
@@ -1471,6 +1516,31 @@ class WhisperCDOriginal:
                 final_segments.append(seg)
         final_segments = self._segment_processor.merge_cross_boundary_segments(final_segments, gap_threshold=self.cd_params.gap_threshold, max_duration=self.cd_params.merge_max_duration, language=detected_language)
         final_segments = self._segment_processor.merge_short_segments(final_segments, min_duration=self.cd_params.min_duration, max_duration=self.cd_params.merge_max_duration, language=detected_language)
+        return final_segments
+
+    def _emit_finalized_segments(self, segments, emitted_count, segment_callback, final=False):
+        """将新定稿的片段推送给 segment_callback，返回已推送的片段数
+
+        两种合并都是从左到右的折叠，新解码的内容只可能并入最后一个片段，
+        因此除最后一个外的片段都已定稿；final 为 True 时全部推送
+        """
+        ready = len(segments) if final else len(segments) - 1
+        for seg in segments[emitted_count:ready]:
+            segment_callback({
+                'start': seg.get('start', 0),
+                'end': seg.get('end', 0),
+                'text': seg.get('text', ''),
+            })
+        return max(emitted_count, ready)
+
+    def _postprocess_segments(self, processed_segments, detected_language):
+        """全局后处理：清理临时字段、过滤空文本、合并片段、构建结果"""
+        language_probability = 1.0
+
+        for seg in processed_segments:
+            seg.pop('_token_count', None)
+
+        final_segments = self._merge_segments(processed_segments, detected_language)
 
         for seg in final_segments:
             seg.pop('_token_ids', None)
@@ -1495,7 +1565,9 @@ class WhisperCDOriginal:
         return result
 
     def contrastive_decoding(self, audio_path: str, language: Optional[str] = None,
-                           progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
+                           progress_callback: Optional[Callable] = None,
+                           segment_callback: Optional[Callable] = None,
+                           audio: Optional[Tuple[np.ndarray, int]] = None) -> Dict[str, Any]:
         """执行对比解码
 
         按顺序：加载音频 → 分段 → 逐段处理 → 全局后处理 → 返回结果。
@@ -1504,6 +1576,8 @@ class WhisperCDOriginal:
             audio_path: 音频路径
             language: 语言代码
             progress_callback: 进度回调函数
+            segment_callback: 片段定稿回调，每个30秒分段解码后以合并后的字幕片段（start/end/text）逐条调用
+            audio: 已解码的 16kHz 单声道 (采样数据, 采样率)，提供时不再读取 audio_path
 
         Returns:
             解码结果
@@ -1511,7 +1585,7 @@ class WhisperCDOriginal:
         if progress_callback:
             progress_callback(10, "加载原始音频...")
 
-        original_audio, sr = self._load_audio(audio_path)
+        original_audio, sr = audio if audio is not None else self._load_audio(audio_path)
         audio_duration = len(original_audio) / sr
         total_start_time = time.time()
 
@@ -1540,6 +1614,7 @@ class WhisperCDOriginal:
             print(f"[DEBUG] [分段] 将音频按30秒分为 {total_segments} 个片段")
 
             print("[DEBUG] 进入对比解码核心处理...")
+            emitted_count = 0
 
             if progress_callback:
                 progress_callback(45, "开始逐段处理...")
@@ -1553,6 +1628,10 @@ class WhisperCDOriginal:
                     i, (start_time, end_time), original_audio, sr, language, 0.0, processed_segments
                 )
                 processed_segments.extend(segment_result)
+                if segment_callback is not None:
+                    emitted_count = self._emit_finalized_segments(
+                        self._merge_segments(processed_segments, detected_language), emitted_count, segment_callback
+                    )
 
                 seg_elapsed = time.time() - seg_start_time
                 print(f"[DEBUG] [耗时] 片段 {i+1}/{total_segments} 解码耗时: {seg_elapsed:.2f}s")
@@ -1564,7 +1643,10 @@ class WhisperCDOriginal:
             if progress_callback:
                 progress_callback(100, "处理完成")
 
-            return self._postprocess_segments(processed_segments, detected_language)
+            result = self._postprocess_segments(processed_segments, detected_language)
+            if segment_callback is not None:
+                self._emit_finalized_segments(result['segments'], emitted_count, segment_callback, final=True)
+            return result
 
         finally:
             import gc
@@ -1573,18 +1655,22 @@ class WhisperCDOriginal:
                 torch.cuda.empty_cache()
 
     def transcribe(self, audio_path: str, language: Optional[str] = None,
-                  progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
+                  progress_callback: Optional[Callable] = None,
+                  segment_callback: Optional[Callable] = None,
+                  audio: Optional[Tuple[np.ndarray, int]] = None) -> Dict[str, Any]:
         """转录音频
 
         Args:
             audio_path: 音频路径
             language: 语言代码
             progress_callback: 进度回调函数
+            segment_callback: 片段定稿回调
+            audio: 已解码的 (采样数据, 采样率)，可选
 
         Returns:
             转录结果
         """
-        return self.contrastive_decoding(audio_path, language, progress_callback)
+        return self.contrastive_decoding(audio_path, language, progress_callback, segment_callback, audio=audio)
 
     def cleanup(self):
         if hasattr(self, 'whisper_model') and self.whisper_model is not None: